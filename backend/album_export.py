@@ -0,0 +1,257 @@
+"""
+Album export
+============
+Renders a user's album on the server: every event (then the extras) laid
+out by layout_engine.generate_layout on its A4 canvas (595x842 pt), each
+event starting on a new page.
+
+- Tiles: a photo is decoded only at the size it is shown (JPEG draft mode
+  decodes at 1/2, 1/4 or 1/8 scale directly), cropped to its zone and kept
+  on disk under EXPORT_TILE_DIR. The key is the photo's content hash (the
+  URL for photos stored without one) plus the pixel size, so re-exports,
+  single-page previews and the same photo uploaded again reuse them.
+- Pages render in a process pool (EXPORT_WORKERS). At most
+  EXPORT_INFLIGHT_PAGES are queued or waiting to be sent, so memory stays
+  bounded however long the album is.
+- PDF: every page is one JPEG image drawn over the whole page, written
+  out as soon as it (and every page before it) is done. The page tree and
+  xref table go at the end, so nothing has to be held back.
+
+    pages = album_pages(entry.data, sizes, hashes=hashes)
+    for chunk in get_exporter().pdf(pages, dpi=150): ...
+    get_exporter().jpeg(pages[3], dpi=150)  -> JPEG bytes
+"""
+
+import hashlib
+import io
+import multiprocessing
+import os
+import threading
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+import derivatives
+import layout_engine
+
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", os.cpu_count() or 2))
+EXPORT_TILE_DIR = os.getenv("EXPORT_TILE_DIR", "export_tiles")
+EXPORT_INFLIGHT_PAGES = int(os.getenv("EXPORT_INFLIGHT_PAGES", 2 * EXPORT_WORKERS))
+EXPORT_DPI = int(os.getenv("EXPORT_DPI", 150))
+EXPORT_MAX_DPI = 300
+EXPORT_QUALITY = 88
+
+# generate_layout's canvas: A4 in PDF points
+PAGE_WIDTH = 595
+PAGE_HEIGHT = 842
+POINTS_PER_INCH = 72
+# Background of zones whose photo could not be fetched
+MISSING_TILE = (235, 235, 235)
+
+
+# --- ALBUM ---
+
+def album_pages(data, sizes, events=None, hashes=None):
+    """
+    Pages of the album: [[zone]], zone = {"url", "hash", "left", "top",
+    "width", "height"} in points. data: {"clusters", "extras"} as served by
+    /photos; sizes: {url: (width, height)}; events: names to include
+    (default all, "extras" included), in album order; hashes: {url:
+    content hash}, the tile cache key.
+    """
+    hashes = hashes or {}
+    if events is None:
+        events = list(data["clusters"]) + ["extras"]
+    pages = []
+    for event in events:
+        urls = data["extras"] if event == "extras" else data["clusters"].get(event, [])
+        photos = [{"image_url": url, "width": sizes.get(url, (None, None))[0],
+                   "height": sizes.get(url, (None, None))[1]} for url in urls]
+        first = len(pages)
+        for zone in layout_engine.generate_layout(photos, PAGE_WIDTH, PAGE_HEIGHT):
+            zone["hash"] = hashes.get(zone["url"])
+            while len(pages) <= first + zone["page"]:
+                pages.append([])
+            pages[first + zone["page"]].append(zone)
+    return pages
+
+
+def page_pixels(dpi):
+    return round(PAGE_WIDTH * dpi / POINTS_PER_INCH), round(PAGE_HEIGHT * dpi / POINTS_PER_INCH)
+
+
+# --- TILES ---
+
+def tile_key(url, width, height, content_hash=None):
+    return f"{content_hash or hashlib.sha1(url.encode()).hexdigest()}_{width}x{height}"
+
+
+def tile_path(root, url, width, height, content_hash=None):
+    key = tile_key(url, width, height, content_hash)
+    return os.path.join(root, key[:2], f"{key}.jpg")
+
+
+def render_tile(data, width, height):
+    """Photo bytes -> RGB image of exactly width x height (centre crop), decoded at reduced scale"""
+    image = Image.open(io.BytesIO(data))
+    image.draft("RGB", (width, height))
+    image = image.convert("RGB")
+    # centre crop to the zone's aspect ratio (they only differ for photos without a stored size)
+    crop_w, crop_h = image.width, image.height
+    if crop_w * height > crop_h * width:
+        crop_w = crop_h * width / height
+    else:
+        crop_h = crop_w * height / width
+    left, top = (image.width - crop_w) / 2, (image.height - crop_h) / 2
+    # reducing_gap: box-reduce first, LANCZOS only over the last factor of 2
+    return image.resize((width, height), Image.LANCZOS, box=(left, top, left + crop_w, top + crop_h),
+                        reducing_gap=2.0)
+
+
+def get_tile(root, url, width, height, fetch=derivatives.fetch_original, content_hash=None):
+    """The cached tile, rendered and written on first use"""
+    path = tile_path(root, url, width, height, content_hash)
+    if os.path.exists(path):
+        with Image.open(path) as tile:
+            return tile.convert("RGB")
+
+    tile = render_tile(fetch(url), width, height)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    tile.save(tmp, format="JPEG", quality=EXPORT_QUALITY)
+    os.replace(tmp, path)   # concurrent renders of the same tile just overwrite each other
+    return tile
+
+
+# --- PAGES ---
+
+def render_page(zones, dpi, root=EXPORT_TILE_DIR):
+    """Process pool worker: one page as JPEG bytes (plus its pixel size)"""
+    size = page_pixels(dpi)
+    scale = dpi / POINTS_PER_INCH
+    page = Image.new("RGB", size, "white")
+    for zone in zones:
+        left, top = round(zone["left"] * scale), round(zone["top"] * scale)
+        width = max(1, round((zone["left"] + zone["width"]) * scale) - left)
+        height = max(1, round((zone["top"] + zone["height"]) * scale) - top)
+        try:
+            page.paste(get_tile(root, zone["url"], width, height, content_hash=zone.get("hash")), (left, top))
+        except Exception as e:
+            print(f"❌ Export tile {zone['url']}: {e}")
+            page.paste(MISSING_TILE, (left, top, left + width, top + height))
+    buf = io.BytesIO()
+    page.save(buf, format="JPEG", quality=EXPORT_QUALITY)
+    return buf.getvalue(), size
+
+
+class PdfWriter:
+    """
+    Minimal PDF made of full-page JPEG images, produced piece by piece.
+    Objects: 1 catalog, 2 page tree, then image / content / page per page.
+    """
+
+    def __init__(self, width=PAGE_WIDTH, height=PAGE_HEIGHT):
+        self.width = width
+        self.height = height
+        self.offset = 0
+        self.offsets = {}
+        self.kids = []
+
+    def _emit(self, parts):
+        data = b"".join(parts)
+        self.offset += len(data)
+        return data
+
+    def _object(self, number, body, stream=None):
+        self.offsets[number] = self.offset
+        parts = [f"{number} 0 obj\n".encode(), body.encode()]
+        if stream is not None:
+            parts += [b"\nstream\n", stream, b"\nendstream"]
+        parts.append(b"\nendobj\n")
+        return self._emit(parts)
+
+    def header(self):
+        return self._emit([b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n"])
+
+    def page(self, jpeg, pixels):
+        image = 3 + 3 * len(self.kids)
+        content = f"q {self.width} 0 0 {self.height} 0 0 cm /Im0 Do Q".encode()
+        self.kids.append(image + 2)
+        return b"".join([
+            self._object(image, f"<< /Type /XObject /Subtype /Image /Width {pixels[0]} /Height {pixels[1]} "
+                                f"/ColorSpace /DeviceRGB /BitsPerComponent 8 /Filter /DCTDecode "
+                                f"/Length {len(jpeg)} >>", jpeg),
+            self._object(image + 1, f"<< /Length {len(content)} >>", content),
+            self._object(image + 2, f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {self.width} {self.height}] "
+                                    f"/Resources << /XObject << /Im0 {image} 0 R >> >> /Contents {image + 1} 0 R >>"),
+        ])
+
+    def trailer(self):
+        kids = " ".join(f"{kid} 0 R" for kid in self.kids)
+        parts = [
+            self._object(2, f"<< /Type /Pages /Kids [{kids}] /Count {len(self.kids)} >>"),
+            self._object(1, "<< /Type /Catalog /Pages 2 0 R >>"),
+        ]
+        xref = self.offset
+        count = max(self.offsets) + 1
+        rows = ["xref", f"0 {count}", "0000000000 65535 f "]
+        rows += [f"{self.offsets[n]:010d} 00000 n " for n in range(1, count)]
+        rows += ["trailer", f"<< /Size {count} /Root 1 0 R >>", "startxref", str(xref), "%%EOF", ""]
+        parts.append(self._emit(["\n".join(rows).encode()]))
+        return b"".join(parts)
+
+
+class AlbumExporter:
+    """
+    Page renderer pool. Create once per server process; workers stay alive
+    between exports.
+    """
+
+    def __init__(self, workers=EXPORT_WORKERS, inflight=EXPORT_INFLIGHT_PAGES, tile_dir=EXPORT_TILE_DIR):
+        self.inflight = max(1, inflight)
+        self.tile_dir = tile_dir
+        # spawn: forking a parent that already holds TensorFlow is unsafe
+        self.pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def render(self, pages, dpi=EXPORT_DPI):
+        """(JPEG bytes, pixel size) per page, in order, at most `inflight` pages ahead"""
+        pending = deque()
+        try:
+            for zones in pages:
+                if len(pending) >= self.inflight:
+                    yield pending.popleft().result()
+                pending.append(self.pool.submit(render_page, zones, dpi, self.tile_dir))
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            # client went away: drop the pages not started yet
+            for future in pending:
+                future.cancel()
+
+    def pdf(self, pages, dpi=EXPORT_DPI):
+        """The album as PDF byte chunks, one per page as it finishes"""
+        writer = PdfWriter()
+        yield writer.header()
+        for jpeg, pixels in self.render(pages, dpi):
+            yield writer.page(jpeg, pixels)
+        yield writer.trailer()
+
+    def jpeg(self, zones, dpi=EXPORT_DPI):
+        return self.pool.submit(render_page, zones, dpi, self.tile_dir).result()[0]
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+def get_exporter():
+    global _exporter
+    if _exporter is None:
+        with _exporter_lock:   # one process pool, however many first requests race here
+            if _exporter is None:
+                _exporter = AlbumExporter()
+    return _exporter
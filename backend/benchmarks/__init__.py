@@ -0,0 +1,4 @@
+"""
+Offline benchmarks for the backend.
+Run from the backend/ folder, e.g.  python -m benchmarks.bench_similarity
+"""
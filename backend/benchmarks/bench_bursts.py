@@ -0,0 +1,79 @@
+"""
+Burst detection before face inference
+=====================================
+A synthetic phone dump: scenes shot once or as bursts (small subject
+motion, sensor noise, exposure drift, different JPEG quality per frame),
+in shooting order. Measures the hashing pre-stage (tiny draft decode +
+pHash/dHash per photo) against a full decode, how well the groups match
+the true scenes, and how many face inference calls are left.
+
+    python -m benchmarks.bench_bursts --scenes 100 --size 1600
+"""
+
+import argparse
+import io
+import time
+
+import numpy as np
+from PIL import Image
+
+import ingest
+import near_duplicates
+
+
+def make_dump(scenes, size, burst_share, seed=0):
+    """[(filename, jpeg bytes)], true scene per photo"""
+    rng = np.random.default_rng(seed)
+    width, height = size, size * 3 // 4
+    items, labels = [], []
+    for scene in range(scenes):
+        # low-frequency "scene" with some detail on top
+        coarse = (rng.random((12, 16, 3)) * 255).astype(np.uint8)
+        base = np.asarray(Image.fromarray(coarse).resize((width, height), Image.BICUBIC), dtype=np.float32)
+        base += rng.normal(0, 6, base.shape)
+        frames = int(rng.integers(2, 11)) if rng.random() < burst_share else 1
+        for frame in range(frames):
+            shift = int(rng.integers(-width // 100, width // 100 + 1))
+            img = np.roll(base, shift, axis=1) * rng.uniform(0.93, 1.07) + rng.normal(0, 4, base.shape)
+            buf = io.BytesIO()
+            Image.fromarray(np.clip(img, 0, 255).astype(np.uint8)).save(buf, "JPEG", quality=int(rng.integers(80, 95)))
+            items.append((f"IMG_{len(items):04d}.jpg", buf.getvalue()))
+            labels.append(scene)
+    return items, np.array(labels)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenes", type=int, default=100)
+    parser.add_argument("--size", type=int, default=1600, help="photo width in pixels")
+    parser.add_argument("--burst-share", type=float, default=0.5, help="share of scenes shot as a burst")
+    args = parser.parse_args()
+
+    items, labels = make_dump(args.scenes, args.size, args.burst_share)
+    n = len(items)
+    print(f"{n} photos of {args.size}px from {args.scenes} scenes")
+
+    t0 = time.perf_counter()
+    hashes = ingest.hash_photos(items)
+    hash_ms = (time.perf_counter() - t0) * 1000 / n
+    sample = items[:min(20, n)]
+    t0 = time.perf_counter()
+    for filename, data in sample:
+        ingest.decode_image(filename, data, max_side=0)
+    decode_ms = (time.perf_counter() - t0) * 1000 / len(sample)
+
+    t0 = time.perf_counter()
+    groups = np.array(near_duplicates.group(hashes))
+    group_ms = (time.perf_counter() - t0) * 1000
+
+    representatives = int((groups == np.arange(n)).sum())
+    members = groups != np.arange(n)
+    wrong = int((labels[groups][members] != labels[members]).sum())
+    print(f"hashing:   {hash_ms:6.2f} ms/photo (full decode {decode_ms:.1f} ms), grouping {group_ms:.1f} ms total")
+    print(f"inference: {representatives} of {n} photos ({1 - representatives / n:.0%} fewer calls, "
+          f"{args.scenes} is the floor)")
+    print(f"members sharing a wrong representative: {wrong}")
+
+
+if __name__ == "__main__":
+    main()
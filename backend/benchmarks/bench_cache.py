@@ -0,0 +1,51 @@
+"""
+Embedding cache on repeat uploads
+=================================
+Pushes the same batch through IngestPipeline twice with a fresh
+EmbeddingCache. The second run should only hash the files.
+
+    python -m benchmarks.bench_cache --photos 300
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from embedding_cache import EmbeddingCache
+from ingest import IngestPipeline
+from storage import LocalStorage
+from benchmarks.bench_ingest import fake_process
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--photos", type=int, default=300)
+    parser.add_argument("--cpu-ms", type=float, default=40)
+    parser.add_argument("--upload-ms", type=float, default=120)
+    args = parser.parse_args()
+
+    os.environ["BENCH_CPU_MS"] = str(args.cpu_ms)
+    items = [(f"photo_{i}.jpg", os.urandom(2_000_000)) for i in range(args.photos)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = EmbeddingCache(os.path.join(tmp, "cache.db"))
+        pipeline = IngestPipeline(LocalStorage(tmp, latency=args.upload_ms / 1000),
+                                  process_fn=fake_process, worker_init=None, cache=cache)
+
+        timings = []
+        for _ in range(2):
+            t0 = time.perf_counter()
+            asyncio.run(pipeline.run(items, username="bench"))
+            timings.append(time.perf_counter() - t0)
+        pipeline.shutdown()
+        stats = cache.stats()
+
+    print(f"first upload:  {timings[0]:7.2f}s")
+    print(f"repeat upload: {timings[1]:7.2f}s  ({timings[1] / timings[0]:.1%} of first)")
+    print(f"cache: {stats['hits']} hits, {stats['misses']} misses, {stats['entries']} entries")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+Clustering pipeline on synthetic users
+======================================
+Runs every clustering stage on synthetic libraries (benchmarks/synthetic.py)
+of increasing size, no FastAPI, Cloudinary or DeepFace involved:
+
+    matrix     FaceMatrix.from_photos (normalize + stack)
+    persons    similarity.find_person_clusters (primary person search)
+    events     clustering.cluster_photos (STEP 2-4)
+    dbscan     ml_engine.cluster_faces (the DBSCAN path)
+
+For each stage: wall time, faces/s and peak memory (tracemalloc, measured
+in a second run so tracing does not slow the timed one). Quality is
+scored against the generated ground truth: purity and adjusted Rand index
+of the person clusters (faces) and of the events (photos).
+
+    python -m benchmarks.bench_clustering --faces 100 1000 10000 100000 --dim 512
+    python -m benchmarks.bench_clustering --json out.json --baseline old.json
+
+--baseline exits non-zero if any quality score fell by more than
+--tolerance compared with an earlier --json run of the same settings.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+from sklearn.metrics import adjusted_rand_score
+
+import clustering
+import ml_engine as ml
+import similarity as sim
+from benchmarks.synthetic import make_user
+
+
+def purity(truth, predicted):
+    """Share of items whose cluster's majority label is their own label"""
+    total = 0
+    for cluster in np.unique(predicted):
+        _, counts = np.unique(truth[predicted == cluster], return_counts=True)
+        total += counts.max()
+    return total / len(truth) if len(truth) else 1.0
+
+
+def measure(fn, memory):
+    """(result, seconds, peak MB or None)"""
+    with contextlib.redirect_stdout(io.StringIO()):   # cluster_photos logs every photo
+        t0 = time.perf_counter()
+        result = fn()
+        seconds = time.perf_counter() - t0
+        peak = None
+        if memory:
+            tracemalloc.start()
+            fn()
+            peak = tracemalloc.get_traced_memory()[1] / 2**20
+            tracemalloc.stop()
+    return result, seconds, peak
+
+
+def person_labels(clusters, num_faces):
+    labels = np.empty(num_faces, dtype=np.int64)
+    for label, rows in enumerate(clusters):
+        labels[rows] = label
+    return labels
+
+
+def event_labels(events, extras, num_photos):
+    # every extra is its own singleton, like the scenery photos of the ground truth
+    labels = np.empty(num_photos, dtype=np.int64)
+    for label, event in enumerate(events):
+        labels[event["photos"]] = label
+    for pos, idx in enumerate(extras):
+        labels[idx] = len(events) + pos
+    return labels
+
+
+def run_size(num_faces, args):
+    user = make_user(num_faces, dim=args.dim, persons=args.persons, people_per_event=args.people_per_event,
+                     photos_per_event=args.photos_per_event, faces_per_photo=args.faces_per_photo,
+                     noise=args.noise, common=args.common, seed=args.seed)
+    n = user.num_faces
+    truth_events = user.event_labels.copy()
+    scenery = np.flatnonzero(truth_events < 0)
+    truth_events[scenery] = truth_events.max() + 1 + np.arange(len(scenery))
+
+    stages = {}
+    fm, *stats = measure(user.face_matrix, args.memory)
+    stages["matrix"] = stats
+
+    clusters, *stats = measure(lambda: sim.find_person_clusters(fm), args.memory)
+    stages["persons"] = stats
+    persons = person_labels(clusters, n)
+
+    (events, extras), *stats = measure(lambda: clustering.cluster_photos(user.photos, fm), args.memory)
+    stages["events"] = stats
+    photo_events = event_labels(events, extras, fm.num_photos)
+
+    quality = {
+        "person_purity": purity(user.person_labels, persons),
+        "person_ari": adjusted_rand_score(user.person_labels, persons),
+        "event_purity": purity(truth_events, photo_events),
+        "event_ari": adjusted_rand_score(truth_events, photo_events),
+    }
+
+    if n <= args.dbscan_max:
+        groups, *stats = measure(lambda: ml.cluster_faces(fm.matrix), args.memory)
+        stages["dbscan"] = stats
+        dbscan = np.full(n, -1, dtype=np.int64)
+        for label, rows in groups.items():
+            dbscan[rows] = label
+        noise = np.flatnonzero(dbscan < 0)
+        dbscan[noise] = dbscan.max() + 1 + np.arange(len(noise))   # unassigned faces are singletons
+        quality["dbscan_ari"] = adjusted_rand_score(user.person_labels, dbscan)
+
+    return {
+        "faces": n,
+        "photos": fm.num_photos,
+        "stages": {name: {"seconds": s, "peak_mb": m} for name, (s, m) in stages.items()},
+        "quality": quality,
+    }
+
+
+def print_result(result):
+    print(f"\n{result['faces']} faces, {result['photos']} photos")
+    for name, stage in result["stages"].items():
+        peak = f"{stage['peak_mb']:9.1f} MB" if stage["peak_mb"] is not None else ""
+        print(f"  {name:8s} {stage['seconds']:9.3f}s {result['faces'] / max(stage['seconds'], 1e-9):12.0f} faces/s {peak}")
+    print("  " + "  ".join(f"{k} {v:.3f}" for k, v in result["quality"].items()))
+
+
+def check_baseline(results, baseline_path, tolerance):
+    with open(baseline_path) as f:
+        baseline = {r["faces"]: r["quality"] for r in json.load(f)["results"]}
+    failures = []
+    for result in results:
+        for metric, value in result["quality"].items():
+            old = baseline.get(result["faces"], {}).get(metric)
+            if old is not None and value < old - tolerance:
+                failures.append(f"{result['faces']} faces: {metric} {old:.3f} -> {value:.3f}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--faces", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--dim", type=int, default=4096)
+    parser.add_argument("--persons", type=int, default=50)
+    parser.add_argument("--people-per-event", type=int, default=4)
+    parser.add_argument("--photos-per-event", type=int, default=12)
+    parser.add_argument("--faces-per-photo", type=int, default=3)
+    parser.add_argument("--noise", type=float, default=0.5)
+    parser.add_argument("--common", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--dbscan-max", type=int, default=20000, help="skip DBSCAN above this many faces")
+    parser.add_argument("--no-memory", dest="memory", action="store_false", help="skip the tracemalloc run")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", help="earlier --json output to compare quality against")
+    parser.add_argument("--tolerance", type=float, default=0.01)
+    args = parser.parse_args()
+
+    results = []
+    for num_faces in args.faces:
+        results.append(run_size(num_faces, args))
+        print_result(results[-1])
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"settings": {k: v for k, v in vars(args).items() if k not in ("json", "baseline")},
+                       "results": results}, f, indent=2)
+
+    if args.baseline:
+        failures = check_baseline(results, args.baseline, args.tolerance)
+        for failure in failures:
+            print(f"❌ quality dropped: {failure}")
+        if failures:
+            sys.exit(1)
+        print("\n✓ quality matches the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Derivatives vs full-size photos
+===============================
+Bytes and decode time a gallery tile costs with the full-size URL versus
+a thumb/preview derivative, plus how the inference input bounds the pixels
+the face detector has to look at.
+
+    python -m benchmarks.bench_derivatives --width 4032 --height 3024 --photos 20
+"""
+
+import argparse
+import io
+import os
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+import derivatives
+
+
+def camera_photo(width, height, seed):
+    """Smooth noise, compresses roughly like a real photo (pure noise would not)"""
+    rng = np.random.default_rng(seed)
+    small = rng.integers(0, 255, (height // 32, width // 32, 3), dtype=np.uint8)
+    image = Image.fromarray(small).resize((width, height), Image.BICUBIC)
+    buf = io.BytesIO()
+    image.save(buf, format="JPEG", quality=derivatives.JPEG_QUALITY)
+    return buf.getvalue()
+
+
+def decode_seconds(data, runs=3):
+    t0 = time.perf_counter()
+    for _ in range(runs):
+        Image.open(io.BytesIO(data)).convert("RGB")
+    return (time.perf_counter() - t0) / runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--width", type=int, default=4032)
+    parser.add_argument("--height", type=int, default=3024)
+    parser.add_argument("--photos", type=int, default=20)
+    args = parser.parse_args()
+
+    photos = [camera_photo(args.width, args.height, i) for i in range(args.photos)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        originals = {}
+        for i, data in enumerate(photos):
+            path = os.path.join(tmp, f"{i}.jpg")
+            with open(path, "wb") as f:
+                f.write(data)
+            originals[f"file://{path}"] = data
+
+        cache = derivatives.DerivativeCache(os.path.join(tmp, "derivatives"))
+        print(f"{'':10s} {'KB/photo':>10s} {'decode ms':>10s} {'first render ms':>16s}")
+        print(f"{'original':10s} {np.mean([len(d) for d in photos]) / 1024:10.0f} "
+              f"{np.mean([decode_seconds(d) for d in photos]) * 1000:10.1f}")
+
+        for size in derivatives.SIZES:
+            t0 = time.perf_counter()
+            paths = [cache.get(url, size) for url in originals]
+            render = (time.perf_counter() - t0) / len(paths)
+            data = [open(p, "rb").read() for p in paths]
+            print(f"{size:10s} {np.mean([len(d) for d in data]) / 1024:10.0f} "
+                  f"{np.mean([decode_seconds(d) for d in data]) * 1000:10.1f} {render * 1000:16.1f}")
+
+        image = Image.open(io.BytesIO(photos[0])).convert("RGB")
+        small, scale = derivatives.inference_image(image)
+        print(f"\ninference input: {image.size[0]}x{image.size[1]} -> {small.size[0]}x{small.size[1]} "
+              f"({small.size[0] * small.size[1] / (image.size[0] * image.size[1]):.0%} of the pixels)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""
+Embedding batch size
+====================
+Runs ml_engine.embed_faces on the same set of face crops with different
+batch sizes and reports crops/second. Needs DeepFace + TensorFlow, the
+model is loaded (and warmed) before timing.
+
+    python -m benchmarks.bench_embedding_batch --crops 256 --batch-sizes 1 8 16 32 64
+"""
+
+import argparse
+import time
+import numpy as np
+
+import ml_engine as ml
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--crops", type=int, default=256)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 16, 32, 64])
+    parser.add_argument("--repeat", type=int, default=2)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    crops = [rng.random((160, 130, 3), dtype=np.float32) for _ in range(args.crops)]
+
+    ml.embed_faces(crops[:8], batch_size=8)  # load + warm the model
+
+    baseline = None
+    print(f"{'batch':>6} {'seconds':>9} {'crops/s':>9} {'speedup':>9}")
+    for batch_size in args.batch_sizes:
+        best = float("inf")
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            ml.embed_faces(crops, batch_size=batch_size)
+            best = min(best, time.perf_counter() - t0)
+        baseline = baseline or best
+        print(f"{batch_size:>6} {best:>9.2f} {args.crops / best:>9.1f} {baseline / best:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Embedding memory: Python lists vs compact arrays
+================================================
+Memory per face of the old list-of-floats records against compact
+per-photo arrays (embeddings.compact) in float32 and float16, their
+pickled size (what ingest workers send back), and the largest cosine
+similarity error each record dtype introduces once FaceMatrix upcasts it.
+
+    python -m benchmarks.bench_embeddings --faces 2000 --dim 4096
+"""
+
+import argparse
+import pickle
+import time
+import tracemalloc
+
+import numpy as np
+
+from embeddings import compact
+from similarity import FaceMatrix
+
+
+def list_bytes(matrix):
+    """Traced size of the same embeddings as lists of Python floats"""
+    tracemalloc.start()
+    lists = matrix.tolist()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del lists
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--faces", type=int, default=2000)
+    parser.add_argument("--dim", type=int, default=4096)
+    parser.add_argument("--faces-per-photo", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    matrix = np.abs(rng.standard_normal((args.faces, args.dim))).astype(np.float32)  # VGG-Face is non-negative
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    counts = np.full(args.faces // args.faces_per_photo, args.faces_per_photo)
+    counts[-1] += args.faces - counts.sum()
+    photos = np.split(matrix, np.cumsum(counts)[:-1])
+
+    baseline = list_bytes(matrix) / args.faces
+    exact = matrix[:500] @ matrix.T
+    print(f"{'format':10s} {'KB/face':>9s} {'vs lists':>9s} {'pickle KB/face':>15s} {'pickle ms':>10s} "
+          f"{'max cos err':>12s}")
+    print(f"{'lists':10s} {baseline / 1024:9.1f} {1:9.1f}x")
+
+    for dtype in ("float32", "float16"):
+        records = [compact(faces, dtype) for faces in photos]
+        per_face = sum(r.nbytes for r in records) / args.faces
+
+        t0 = time.perf_counter()
+        pickled = len(pickle.dumps(records, protocol=pickle.HIGHEST_PROTOCOL)) / args.faces
+        pickle_ms = (time.perf_counter() - t0) * 1000
+
+        fm = FaceMatrix(records)
+        error = np.abs(fm.matrix[:500] @ fm.matrix.T - exact).max()
+
+        print(f"{dtype:10s} {per_face / 1024:9.1f} {baseline / per_face:9.1f}x {pickled / 1024:15.1f} "
+              f"{pickle_ms:10.1f} {error:12.5f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Album export
+============
+A synthetic album of camera-size JPEGs (distinct URLs, hard links to a
+few originals so the disk stays small) exported to PDF through
+album_export: cold (empty tile cache) and warm, time to the first page,
+and a render worker's peak memory. The baseline decodes every photo at
+full size in one process and keeps every page until PIL writes the PDF;
+it runs on the first --baseline-pages pages only.
+
+    python -m benchmarks.bench_export --pages 200 --megapixels 12
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+import album_export
+from benchmarks.bench_derivatives import camera_photo
+from benchmarks.bench_ingest_memory import peak_mb
+
+
+def make_album(directory, pages, megapixels, originals=20, seed=0):
+    """(data, sizes) like /photos serves them: events of 5-40 photos, mixed orientation"""
+    rng = np.random.default_rng(seed)
+    width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+    height = width * 3 // 4
+    sources = []
+    for i in range(originals):
+        w, h = (width, height) if i % 3 else (height, width)
+        path = os.path.join(directory, f"original_{i}.jpg")
+        with open(path, "wb") as f:
+            f.write(camera_photo(w, h, i))
+        sources.append((path, (w, h)))
+
+    clusters, sizes, count = {}, {}, 0
+    # generate_layout puts ~6 photos on a page
+    while count < pages * 6:
+        event = []
+        for _ in range(int(rng.integers(5, 41))):
+            source, size = sources[int(rng.integers(len(sources)))]
+            path = os.path.join(directory, f"photo_{count}.jpg")
+            os.link(source, path)
+            url = f"file://{path}"
+            event.append(url)
+            sizes[url] = size
+            count += 1
+        clusters[f"Event_{len(clusters) + 1}"] = event
+    return {"clusters": clusters, "extras": []}, sizes
+
+
+def export(exporter, pages, dpi, path):
+    t0 = time.perf_counter()
+    first = None
+    with open(path, "wb") as f:
+        for i, chunk in enumerate(exporter.pdf(pages, dpi)):
+            f.write(chunk)
+            if i == 1:
+                first = time.perf_counter() - t0
+    return time.perf_counter() - t0, first
+
+
+def baseline(pages, dpi, path):
+    """Full decode per photo, all pages in memory, one PIL save"""
+    t0 = time.perf_counter()
+    size = album_export.page_pixels(dpi)
+    scale = dpi / album_export.POINTS_PER_INCH
+    images = []
+    for zones in pages:
+        page = Image.new("RGB", size, "white")
+        for zone in zones:
+            photo = Image.open(zone["url"][len("file://"):]).convert("RGB")
+            box = (max(1, round(zone["width"] * scale)), max(1, round(zone["height"] * scale)))
+            page.paste(photo.resize(box, Image.LANCZOS), (round(zone["left"] * scale), round(zone["top"] * scale)))
+        images.append(page)
+    images[0].save(path, save_all=True, append_images=images[1:], resolution=dpi)
+    return time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--megapixels", type=float, default=12)
+    parser.add_argument("--dpi", type=int, default=album_export.EXPORT_DPI)
+    parser.add_argument("--workers", type=int, default=album_export.EXPORT_WORKERS)
+    parser.add_argument("--baseline-pages", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data, sizes = make_album(tmp, args.pages, args.megapixels)
+        pages = album_export.album_pages(data, sizes)
+        photos = sum(len(p) for p in pages)
+        print(f"{len(pages)} pages, {photos} photos of {args.megapixels:g} MP, {args.dpi} dpi, {args.workers} workers")
+
+        exporter = album_export.AlbumExporter(workers=args.workers, tile_dir=os.path.join(tmp, "tiles"))
+        out = os.path.join(tmp, "album.pdf")
+        for label in ("cold", "warm"):
+            seconds, first = export(exporter, pages, args.dpi, out)
+            print(f"{label:9s} {seconds:7.2f} s  {len(pages) / seconds:6.1f} pages/s  first page after {first:.2f} s  "
+                  f"{os.path.getsize(out) / 2**20:.0f} MB")
+        worker_mb = max(f.result() for f in [exporter.pool.submit(peak_mb) for _ in range(args.workers)])
+        exporter.shutdown()
+        print(f"peak memory of a render worker {worker_mb:.0f} MB")
+
+        subset = pages[:args.baseline_pages]
+        start_mb = peak_mb()
+        seconds = baseline(subset, args.dpi, os.path.join(tmp, "baseline.pdf"))
+        print(f"baseline  {seconds:7.2f} s  {len(subset) / seconds:6.1f} pages/s  ({len(subset)} pages, "
+              f"peak memory +{peak_mb() - start_mb:.0f} MB)")
+
+
+if __name__ == "__main__":
+    main()
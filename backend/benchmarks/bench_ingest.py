@@ -0,0 +1,80 @@
+"""
+Ingest pipeline throughput
+==========================
+Sequential (old behaviour) vs IngestPipeline, using a CPU-burning stand-in
+for decode + DeepFace and LocalStorage with fake network latency instead of
+Cloudinary.
+
+    python -m benchmarks.bench_ingest --photos 200 --cpu-ms 40 --upload-ms 120
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from ingest import IngestPipeline
+from storage import LocalStorage
+
+CPU_SECONDS = float(os.getenv("BENCH_CPU_MS", 40)) / 1000
+
+
+def fake_process(items):
+    """Busy-loop for CPU_SECONDS per photo to mimic decode + detection + embedding."""
+    end = time.process_time() + CPU_SECONDS * len(items)
+    x = 0
+    while time.process_time() < end:
+        x += 1
+    return [{"faces": [[1.0, 0.0, 0.0]], "locations": [{}], "jpeg": file_bytes} for _, file_bytes in items]
+
+
+def run_sequential(items, storage):
+    for item in items:
+        result = fake_process([item])[0]
+        storage.upload(result["jpeg"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--photos", type=int, default=200)
+    parser.add_argument("--cpu-ms", type=float, default=40)
+    parser.add_argument("--upload-ms", type=float, default=120)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--uploads", type=int, default=16)
+    parser.add_argument("--chunk", type=int, default=4, help="photos per worker task")
+    args = parser.parse_args()
+
+    # Worker processes are spawned, they read the CPU cost from the environment
+    os.environ["BENCH_CPU_MS"] = str(args.cpu_ms)
+    global CPU_SECONDS
+    CPU_SECONDS = args.cpu_ms / 1000
+
+    items = [(f"photo_{i}.jpg", os.urandom(50_000)) for i in range(args.photos)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = LocalStorage(tmp, latency=args.upload_ms / 1000)
+
+        t0 = time.perf_counter()
+        run_sequential(items, storage)
+        sequential = time.perf_counter() - t0
+
+        pipeline = IngestPipeline(storage, workers=args.workers, upload_concurrency=args.uploads,
+                                  chunk_size=args.chunk,
+                                  process_fn=fake_process, worker_init=None)
+        asyncio.run(pipeline.run(items[:args.workers]))  # start the worker processes
+        t0 = time.perf_counter()
+        processed = asyncio.run(pipeline.run(items))
+        pipelined = time.perf_counter() - t0
+        pipeline.shutdown()
+
+    cpu_stage = args.photos * args.cpu_ms / 1000 / args.workers
+    io_stage = args.photos * args.upload_ms / 1000 / args.uploads
+    print(f"photos: {args.photos}  workers: {args.workers}  upload slots: {args.uploads}")
+    print(f"sequential:        {sequential:8.2f}s")
+    print(f"pipeline:          {pipelined:8.2f}s  ({len(processed)} ok, {sequential / pipelined:.1f}x)")
+    print(f"slowest stage est: {max(cpu_stage, io_stage):8.2f}s")
+
+
+if __name__ == "__main__":
+    main()
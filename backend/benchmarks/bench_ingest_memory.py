@@ -0,0 +1,113 @@
+"""
+Ingest peak memory vs batch size
+================================
+Peak RSS of one process running the decode / stored-copy / inference-copy
+part of ingest (no models) on large synthetic JPEGs:
+
+    in-memory  the old path: every upload read with `await file.read()`,
+               stored JPEGs kept as bytes until uploaded (worst case: the
+               uploads lag behind decoding)
+    spooled    uploads as spooled paths, stored copies written to temp
+               files, only the chunk's inference copies in memory
+
+Each measurement runs in a fresh process, so the numbers do not mix; the
+table shows how far the peak rose above the process's start (Linux only).
+
+    python -m benchmarks.bench_ingest_memory --photos 8 32 64 --megapixels 24
+"""
+
+import argparse
+import io
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+from PIL import Image
+
+import ingest
+from derivatives import JPEG_QUALITY, inference_image
+
+
+def make_photos(directory, count, megapixels, seed=0):
+    rng = np.random.default_rng(seed)
+    width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+    height = width * 3 // 4
+    # smooth gradients plus a little noise: camera-like JPEG sizes
+    base = np.linspace(0, 255, width, dtype=np.float32)[None, :, None] * np.ones((height, 1, 3), np.float32)
+    paths = []
+    for i in range(count):
+        pixels = np.clip(base * rng.uniform(0.5, 1.0) + rng.normal(0, 8, (height, width, 3)), 0, 255)
+        path = os.path.join(directory, f"photo_{i}.jpg")
+        Image.fromarray(pixels.astype(np.uint8)).save(path, quality=92)
+        paths.append(path)
+    return paths
+
+
+def peak_mb():
+    """Peak RSS of this process (Linux VmHWM; unlike ru_maxrss it does not carry over from the parent)"""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+
+
+def run_in_memory(paths, chunk):
+    start = peak_mb()
+    items = []
+    for path in paths:
+        with open(path, "rb") as f:
+            items.append((os.path.basename(path), f.read()))
+    waiting = []
+    for first in range(0, len(items), chunk):
+        images = []
+        for filename, data in items[first:first + chunk]:
+            img_rgb = ingest.decode_image(filename, data, max_side=0)
+            small, _ = inference_image(img_rgb)
+            images.append(cv2.cvtColor(np.array(small), cv2.COLOR_RGB2BGR))
+            buf = io.BytesIO()
+            img_rgb.save(buf, format="JPEG", quality=JPEG_QUALITY)
+            waiting.append(buf.getvalue())
+    return peak_mb() - start
+
+
+def run_spooled(paths, chunk):
+    start = peak_mb()
+    for first in range(0, len(paths), chunk):
+        images = []
+        for path in paths[first:first + chunk]:
+            bgr, _, result = ingest.prepare_photo(os.path.basename(path), path)
+            images.append(bgr)
+            os.remove(result["jpeg_path"])   # what the upload thread does
+        del images
+    return peak_mb() - start
+
+
+def measure(fn, paths, chunk):
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return pool.submit(fn, paths, chunk).result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--photos", type=int, nargs="+", default=[8, 32, 64])
+    parser.add_argument("--megapixels", type=float, default=24)
+    parser.add_argument("--chunk", type=int, default=ingest.INGEST_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["INGEST_TMP_DIR"] = os.path.join(tmp, "stored")
+        paths = make_photos(tmp, max(args.photos), args.megapixels)
+        size = sum(os.path.getsize(p) for p in paths) / len(paths) / 2**20
+        print(f"{args.megapixels:.0f} MP photos, {size:.1f} MB each, chunk {args.chunk}")
+        print(f"{'photos':>7s} {'in-memory MB':>13s} {'spooled MB':>11s}")
+        for count in args.photos:
+            old = measure(run_in_memory, paths[:count], args.chunk)
+            new = measure(run_spooled, paths[:count], args.chunk)
+            print(f"{count:7d} {old:13.0f} {new:11.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Album layout engine scaling
+===========================
+Time and quality of layout_engine on events of increasing size, with a
+realistic aspect mix (landscape, portrait, square, the odd panorama).
+Fill is the share of each full page covered by photos; crop is 0 since
+every photo keeps its aspect ratio. "memo" is the second request for the
+same photo set.
+
+    python -m benchmarks.bench_layout --photos 10 100 1000 10000
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+import layout_engine
+
+
+def make_photos(count, seed=0):
+    rng = np.random.default_rng(seed)
+    aspects = rng.choice([4 / 3, 3 / 2, 3 / 4, 2 / 3, 1.0, 16 / 9, 3.0], count,
+                         p=[0.35, 0.2, 0.2, 0.1, 0.07, 0.06, 0.02])
+    return [(f"https://example.com/{seed}/{i}.jpg", float(a)) for i, a in enumerate(aspects)]
+
+
+def fill(pages):
+    """Mean photo area share of every page but the last"""
+    full = pages[:-1] or pages
+    return np.mean([sum(z["w"] * z["h"] for z in p["zones"]) / 1e4 for p in full])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--photos", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    args = parser.parse_args()
+
+    print(f"{'photos':>7s} {'pages':>6s} {'per page':>9s} {'fill':>6s} {'first ms':>9s} {'memo ms':>8s}")
+    for count in args.photos:
+        photos = make_photos(count, seed=count)
+        t0 = time.perf_counter()
+        layout = layout_engine.layout_album(photos)
+        first = (time.perf_counter() - t0) * 1000
+        t0 = time.perf_counter()
+        layout_engine.layout_album(photos)
+        memo = (time.perf_counter() - t0) * 1000
+
+        pages = layout["pages"]
+        assert sum(len(p["zones"]) for p in pages) == count
+        print(f"{count:7d} {len(pages):6d} {count / len(pages):9.1f} {fill(pages):6.2f} {first:9.1f} {memo:8.2f}")
+
+
+if __name__ == "__main__":
+    main()
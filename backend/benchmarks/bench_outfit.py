@@ -0,0 +1,112 @@
+"""
+Outfit signatures: k-means vs fixed-palette histograms
+======================================================
+Per-image cost of the old signature (cv2.kmeans, k=5, 10 attempts, 200
+iterations on the full clothing ROI) against ml_engine's palette
+histogram, one image at a time and batched. Images are synthetic: each
+person wears one of --outfits striped outfits under varying light and
+noise. Separation is how well each signature tells same-outfit pairs
+from different-outfit pairs at the outfit_matches threshold.
+
+    python -m benchmarks.bench_outfit --images 200 --size 1280
+"""
+
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+import ml_engine as ml
+
+
+def kmeans_signature(img_np, face_locations=None):
+    """The previous get_outfit_signature, kept here as the baseline"""
+    outfit_roi = ml.outfit_roi(img_np, face_locations)
+    if outfit_roi.size == 0 or outfit_roi.shape[0] < 10 or outfit_roi.shape[1] < 10:
+        return [0.0] * 32
+    outfit_rgb = cv2.cvtColor(outfit_roi, cv2.COLOR_BGR2RGB)
+    pixels = np.float32(outfit_rgb.reshape(-1, 3))
+    k = 5
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 200, 0.1)
+    _, labels, centers = cv2.kmeans(pixels, k, None, criteria, 10, cv2.KMEANS_PP_CENTERS)
+    label_counts = np.bincount(labels.flatten())
+    sorted_indices = np.argsort(label_counts)[::-1]
+    dominant_colors = centers[sorted_indices]
+    color_percentages = label_counts[sorted_indices] / len(labels)
+    signature = []
+    for i in range(3):
+        signature.extend(dominant_colors[i] * color_percentages[i])
+    signature.extend(np.std(pixels, axis=0).tolist())
+    signature.append(np.mean(cv2.cvtColor(outfit_roi, cv2.COLOR_BGR2GRAY)))
+    signature = np.array(signature)
+    return (signature / np.linalg.norm(signature)).tolist()
+
+
+def make_images(count, size, outfits, seed=0):
+    """(BGR images, face locations, outfit label per image)"""
+    rng = np.random.default_rng(seed)
+    palettes = rng.integers(0, 256, (outfits, 3, 3))
+    width, height = size, size * 3 // 4
+    images, faces, labels = [], [], []
+    for _ in range(count):
+        outfit = int(rng.integers(outfits))
+        img = np.empty((height, width, 3), dtype=np.float32)
+        img[:] = rng.integers(0, 256, 3)                      # background
+        fw = width // 8
+        fx, fy = int(rng.integers(fw, width - 2 * fw)), int(rng.integers(0, height // 4))
+        top, bottom = fy + fw, min(height, fy + fw + int(fw * 1.8))
+        stripe = max(2, fw // 6)
+        for row in range(top, bottom):
+            img[row, fx:fx + fw] = palettes[outfit][(row // stripe) % 3]
+        img *= rng.uniform(0.8, 1.2)                          # lighting
+        img += rng.normal(0, 10, img.shape)
+        images.append(np.clip(img, 0, 255).astype(np.uint8))
+        faces.append([{"x": fx, "y": fy, "w": fw, "h": fw}])
+        labels.append(outfit)
+    return images, faces, np.array(labels)
+
+
+def separation(signatures, labels, threshold=0.80):
+    """Share of image pairs outfit_matches gets right"""
+    matrix = np.asarray(signatures, dtype=np.float32)
+    matrix = matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-10)
+    sims = matrix @ matrix.T
+    same = labels[:, None] == labels[None, :]
+    upper = np.triu_indices(len(labels), k=1)
+    return np.mean((sims[upper] > threshold) == same[upper])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=200)
+    parser.add_argument("--size", type=int, default=1280, help="image width in pixels")
+    parser.add_argument("--outfits", type=int, default=10)
+    parser.add_argument("--kmeans-max", type=int, default=100, help="time k-means on at most this many images")
+    args = parser.parse_args()
+
+    images, faces, labels = make_images(args.images, args.size, args.outfits)
+    print(f"{args.images} images of {args.size}px, {args.outfits} outfits\n")
+    print(f"{'method':18s} {'ms/image':>9s} {'length':>7s} {'pairs right':>12s}")
+
+    n = min(args.kmeans_max, args.images)
+    t0 = time.perf_counter()
+    old = [kmeans_signature(img, f) for img, f in zip(images[:n], faces[:n])]
+    old_ms = (time.perf_counter() - t0) * 1000 / n
+    print(f"{'k-means (old)':18s} {old_ms:9.2f} {len(old[0]):7d} {separation(old, labels[:n]):12.4f}")
+
+    t0 = time.perf_counter()
+    single = [ml.get_outfit_signature(img, f) for img, f in zip(images, faces)]
+    single_ms = (time.perf_counter() - t0) * 1000 / args.images
+    print(f"{'palette':18s} {single_ms:9.2f} {len(single[0]):7d} {separation(single, labels):12.4f}")
+
+    t0 = time.perf_counter()
+    batched = ml.get_outfit_signatures(images, faces)
+    batched_ms = (time.perf_counter() - t0) * 1000 / args.images
+    print(f"{'palette, batched':18s} {batched_ms:9.2f} {batched.shape[1]:7d} {separation(batched, labels):12.4f}")
+    assert np.allclose(batched, np.stack(single), atol=1e-6)
+    print(f"\n{old_ms / batched_ms:.0f}x faster per image (batched vs k-means)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+"Photos of this person": person index vs embedding scan
+======================================================
+Synthetic libraries (benchmarks/synthetic.py) stored in a temporary
+SQLite file with every face's person set, as ingest does. Compares
+answering the query by loading every embedding and matching it against
+the person's centroid (what it took before) with reading the
+(username, person, photo_id) index: the first page of 50 and every photo.
+
+    python -m benchmarks.bench_people --faces 1000 10000 50000
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+import similarity as sim
+from benchmarks.synthetic import make_user
+from store import Store
+
+
+def fill(store, user):
+    """Photos, faces and persons of a synthetic user; returns the person with most photos"""
+    photos = [{"url": f"file:///photos/{i}.jpg", "filename": p["filename"], "faces": len(p["faces"])}
+              for i, p in enumerate(user.photos)]
+    faces = [[(np.asarray(f, dtype=np.float32), {}) for f in p["faces"]] for p in user.photos]
+    fm = user.face_matrix()
+    face_to_photo = fm.face_to_photo()
+    labels = [(int(p), int(r - fm.offsets[p]), int(user.person_labels[r]), False) for r, p in enumerate(face_to_photo)]
+    with store.transaction() as conn:
+        store.add_photos(conn, "bench", 0, photos, faces)
+        store.set_face_persons(conn, "bench", labels)
+    return int(np.bincount(user.person_labels).argmax()), fm
+
+
+def timed(fn, runs=5):
+    t0 = time.perf_counter()
+    for _ in range(runs):
+        result = fn()
+    return (time.perf_counter() - t0) / runs * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--faces", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--dim", type=int, default=512)
+    args = parser.parse_args()
+
+    print(f"{'faces':>7s} {'photos':>7s} {'scan ms':>9s} {'page ms':>9s} {'all ms':>9s} {'photos of person':>17s}")
+    for num_faces in args.faces:
+        user = make_user(num_faces, dim=args.dim)
+        with tempfile.TemporaryDirectory() as tmp:
+            store = Store(os.path.join(tmp, "bench.db"))
+            person, fm = fill(store, user)
+            centroid = fm.matrix[user.person_labels == person].mean(axis=0)
+            centroid /= np.linalg.norm(centroid)
+            conn = store.connect()
+
+            def scan():
+                matrix = store.load_embeddings(conn, "bench")
+                hits = np.flatnonzero(matrix @ centroid > sim.PERSON_THRESHOLD)
+                return np.unique(fm.face_to_photo()[hits])
+
+            scan_ms, found = timed(scan)
+            page_ms, _ = timed(lambda: store.person_photos("bench", person, limit=50))
+            all_ms, rows = timed(lambda: store.person_photos("bench", person, limit=len(user.photos)))
+            print(f"{user.num_faces:7d} {len(user.photos):7d} {scan_ms:9.1f} {page_ms:9.2f} {all_ms:9.2f} "
+                  f"{len(rows):8d} ({len(found)} by scan)")
+
+
+if __name__ == "__main__":
+    main()
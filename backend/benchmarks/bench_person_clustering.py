@@ -0,0 +1,71 @@
+"""
+Person clustering engines at scale
+==================================
+Times every person_clustering engine on synthetic users
+(benchmarks/synthetic.py) of increasing size and scores it against the
+generated identities and against the greedy grouping (adjusted Rand
+index, 1.0 = the same partition). Greedy and DBSCAN are quadratic and are
+skipped above --greedy-max / --dbscan-max.
+
+    python -m benchmarks.bench_person_clustering --faces 1000 10000 100000 --dim 256
+"""
+
+import argparse
+
+from sklearn.metrics import adjusted_rand_score
+
+import ml_engine as ml
+import person_clustering
+from benchmarks.bench_clustering import measure, person_labels
+from benchmarks.synthetic import make_user
+
+
+def run_size(num_faces, args):
+    user = make_user(num_faces, dim=args.dim, persons=args.persons, noise=args.noise, seed=args.seed)
+    fm = user.face_matrix()
+    n = fm.num_faces
+    print(f"\n{n} faces, {fm.num_photos} photos, {args.dim}-d")
+    print(f"  {'method':9s} {'seconds':>9s} {'faces/s':>12s} {'peak MB':>9s} {'people':>7s} {'ARI truth':>10s} {'ARI greedy':>11s}")
+
+    greedy = None
+    for method in ("greedy", "graph", "centroid", "dbscan"):
+        limit = {"greedy": args.greedy_max, "dbscan": args.dbscan_max}.get(method)
+        if limit is not None and n > limit:
+            print(f"  {method:9s} skipped (> {limit} faces)")
+            continue
+
+        if method == "dbscan":
+            groups, seconds, peak = measure(lambda: ml.cluster_faces(fm.matrix), args.memory)
+            clusters = list(groups.values())
+            assigned = {row for rows in clusters for row in rows}
+            clusters += [[row] for row in range(n) if row not in assigned]   # noise: singletons
+        else:
+            clusters, seconds, peak = measure(lambda: person_clustering.cluster_persons(fm, method), args.memory)
+        labels = person_labels(clusters, n)
+        if method == "greedy":
+            greedy = labels
+
+        vs_greedy = f"{adjusted_rand_score(greedy, labels):11.4f}" if greedy is not None else f"{'-':>11s}"
+        peak = f"{peak:9.1f}" if peak is not None else f"{'-':>9s}"
+        print(f"  {method:9s} {seconds:9.3f} {n / max(seconds, 1e-9):12.0f} {peak} {len(clusters):7d} "
+              f"{adjusted_rand_score(user.person_labels, labels):10.4f} {vs_greedy}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--faces", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--dim", type=int, default=256, help="4096 for raw VGG-Face, 256 for reduced vectors")
+    parser.add_argument("--persons", type=int, default=50)
+    parser.add_argument("--noise", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--greedy-max", type=int, default=30000, help="skip greedy above this many faces")
+    parser.add_argument("--dbscan-max", type=int, default=10000, help="skip DBSCAN above this many faces")
+    parser.add_argument("--no-memory", dest="memory", action="store_false", help="skip the tracemalloc run")
+    args = parser.parse_args()
+
+    for num_faces in args.faces:
+        run_size(num_faces, args)
+
+
+if __name__ == "__main__":
+    main()
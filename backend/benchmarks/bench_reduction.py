@@ -0,0 +1,90 @@
+"""
+Reduced embeddings: speedup vs agreement
+========================================
+Clusters a synthetic user (benchmarks/synthetic.py) on the full 4096-d
+vectors and again on PCA / random projections, with the original and the
+recalibrated thresholds. Agreement is the adjusted Rand index between the
+full-size and the reduced result (1.0 = the same partition).
+
+    python -m benchmarks.bench_reduction --faces 5000 --dims 128 256
+"""
+
+import argparse
+import contextlib
+import io
+import time
+
+import numpy as np
+from sklearn.metrics import adjusted_rand_score
+
+import clustering
+import ml_engine as ml
+import reduction
+import similarity as sim
+from benchmarks.bench_clustering import event_labels, person_labels
+from benchmarks.synthetic import make_user
+
+
+def run(fm, dbscan_eps, with_dbscan):
+    """(labels per stage, seconds per stage)"""
+    timings = {}
+    t0 = time.perf_counter()
+    persons = person_labels(sim.find_person_clusters(fm), fm.num_faces)
+    timings["persons"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        events, extras = clustering.cluster_photos([{"filename": ""}] * fm.num_photos, fm)
+    timings["events"] = time.perf_counter() - t0
+    labels = {"persons": persons, "events": event_labels(events, extras, fm.num_photos)}
+
+    if with_dbscan:
+        t0 = time.perf_counter()
+        groups = ml.cluster_faces(fm.matrix, eps=dbscan_eps)
+        timings["dbscan"] = time.perf_counter() - t0
+        dbscan = np.arange(fm.num_faces) + fm.num_faces   # noise: singletons
+        for label, rows in groups.items():
+            dbscan[rows] = label
+        labels["dbscan"] = dbscan
+    return labels, timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--faces", type=int, default=5000)
+    parser.add_argument("--dim", type=int, default=4096)
+    parser.add_argument("--dims", type=int, nargs="+", default=[128, 256])
+    parser.add_argument("--noise", type=float, default=0.7, help="0.7: same-person cosine ~0.67, close to the thresholds")
+    parser.add_argument("--dbscan-max", type=int, default=10000)
+    args = parser.parse_args()
+
+    user = make_user(args.faces, dim=args.dim, noise=args.noise)
+    counts = [len(p["faces"]) for p in user.photos]
+    full = user.face_matrix()
+    with_dbscan = full.num_faces <= args.dbscan_max
+
+    base, base_time = run(full, 1 - reduction.DBSCAN_THRESHOLD, with_dbscan)
+    stages = list(base_time)
+    print(f"{full.num_faces} faces, {full.num_photos} photos, {args.dim}-d: "
+          + ", ".join(f"{s} {t:.2f}s" for s, t in base_time.items()))
+    print(f"\n{'reducer':14s} {'thresholds':11s} " + " ".join(f"{s + ' x':>10s} {s + ' ARI':>12s}" for s in stages))
+
+    for kind in ("pca", "random"):
+        for dim in args.dims:
+            reducer = reduction.fit_pca(full.matrix, dim) if kind == "pca" else reduction.random_projection(args.dim, dim)
+            uncalibrated = dict(reducer.thresholds)
+            agreement = reduction.calibrate(reducer, full.matrix)
+            reduced = reducer.transform(full.matrix)
+
+            for name, thresholds in (("original", uncalibrated), ("calibrated", reducer.thresholds)):
+                fm = sim.FaceMatrix.from_arrays(reduced, counts, (thresholds["person"], thresholds["match"]))
+                labels, timing = run(fm, 1 - thresholds["dbscan"], with_dbscan)
+                cells = [f"{base_time[s] / timing[s]:9.1f}x {adjusted_rand_score(base[s], labels[s]):12.4f}"
+                         for s in stages]
+                print(f"{kind + ' ' + str(dim):14s} {name:11s} " + " ".join(cells))
+            print(f"{'':14s} calibrated: " + ", ".join(
+                f"{k} {reducer.thresholds[k]:.3f} (pairs agree {agreement[k]:.4f})" for k in agreement))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Pairwise loops vs. vectorized FaceMatrix
+========================================
+Times the old per-pair `cosine_sim` clustering against similarity.py on
+random embeddings and checks both give the same primary person and the
+same shared-people counts.
+
+    python -m benchmarks.bench_similarity --faces 100 250 500 1000
+"""
+
+import argparse
+import time
+import numpy as np
+
+import similarity as sim
+
+
+# --- OLD IMPLEMENTATION (copied from main.py before vectorization) ---
+
+def cosine_sim(v1, v2):
+    v1, v2 = np.array(v1), np.array(v2)
+    return np.dot(v1, v2) / (np.linalg.norm(v1) * np.linalg.norm(v2) + 1e-10)
+
+def face_matches(face1, face2, threshold=0.60):
+    return cosine_sim(face1, face2) > threshold
+
+def old_find_primary_person(all_photos):
+    all_faces = []
+    face_to_photo = []
+    for idx, photo in enumerate(all_photos):
+        for face in photo["faces"]:
+            all_faces.append(face)
+            face_to_photo.append(idx)
+    if not all_faces:
+        return None, set()
+    clusters = []
+    used = set()
+    for i, face1 in enumerate(all_faces):
+        if i in used:
+            continue
+        cluster = [i]
+        used.add(i)
+        for j, face2 in enumerate(all_faces):
+            if j in used:
+                continue
+            if face_matches(face1, face2, threshold=0.58):
+                cluster.append(j)
+                used.add(j)
+        clusters.append(cluster)
+    primary_cluster = max(clusters, key=len)
+    return primary_cluster, set(face_to_photo[i] for i in primary_cluster)
+
+def old_get_shared_people(photo1_faces, photo2_faces, threshold=0.60):
+    matches = 0
+    for face1 in photo1_faces:
+        for face2 in photo2_faces:
+            if face_matches(face1, face2, threshold):
+                matches += 1
+                break
+    return matches
+
+
+# --- SYNTHETIC DATA ---
+
+def make_photos(num_faces, dim, people=8, noise=0.8, seed=0):
+    """Random photos with 1-3 faces drawn from a handful of identities."""
+    rng = np.random.default_rng(seed)
+    identities = rng.normal(size=(people, dim))
+    photos = []
+    total = 0
+    while total < num_faces:
+        n = min(int(rng.integers(1, 4)), num_faces - total)
+        who = rng.choice(people, size=n, replace=False)
+        faces = [(identities[p] + rng.normal(scale=noise, size=dim)).tolist() for p in who]
+        photos.append({"faces": faces})
+        total += n
+    return photos
+
+
+def run(num_faces, dim):
+    photos = make_photos(num_faces, dim)
+    pairs = [(i, (i * 7 + 3) % len(photos)) for i in range(len(photos))]
+
+    t0 = time.perf_counter()
+    old_cluster, old_photos = old_find_primary_person(photos)
+    old_shared = [old_get_shared_people(photos[a]["faces"], photos[b]["faces"]) for a, b in pairs]
+    old_time = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    fm = sim.FaceMatrix.from_photos(photos)
+    new_cluster, new_photos = sim.find_primary_person(fm)
+    counts = sim.shared_counts(fm, [fm.rows(a) for a, _ in pairs], [fm.rows(b) for _, b in pairs])
+    new_shared = [int(counts[k, k]) for k in range(len(pairs))]
+    new_time = time.perf_counter() - t0
+
+    same = (list(old_cluster) == new_cluster.tolist()
+            and old_photos == new_photos
+            and old_shared == new_shared)
+    return old_time, new_time, same
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--faces", type=int, nargs="+", default=[100, 250, 500, 1000])
+    parser.add_argument("--dim", type=int, default=4096, help="embedding size (VGG-Face is 4096)")
+    args = parser.parse_args()
+
+    print(f"{'faces':>8} {'pairwise (s)':>14} {'vectorized (s)':>16} {'speedup':>9}  same result")
+    for n in args.faces:
+        old_time, new_time, same = run(n, args.dim)
+        print(f"{n:>8} {old_time:>14.3f} {new_time:>16.4f} {old_time / new_time:>8.1f}x  {'yes' if same else 'NO'}")
+
+
+if __name__ == "__main__":
+    main()
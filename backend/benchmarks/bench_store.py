@@ -0,0 +1,144 @@
+"""
+Storage load test
+=================
+Many threads reading /photos-style user data while others append photos,
+against the old whole-file JSON database and the SQLite store. Reports
+throughput, latency percentiles and how many writes were lost.
+
+    python -m benchmarks.bench_store --users 2000 --threads 8 --ops 400
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from store import Store
+
+
+class JsonDatabase:
+    """The old load_json/save_json pattern from main.py"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, "r") as f:
+            try:
+                return json.load(f) or {}
+            except ValueError:
+                return {}
+
+    def save(self, data):
+        with open(self.path, "w") as f:
+            json.dump(data, f, indent=4)
+
+    def read(self, username):
+        return self.load().get(username, {"clusters": {}, "extras": []})
+
+    def append(self, username, url):
+        db = self.load()
+        db.setdefault(username, {"clusters": {}, "extras": []})["extras"].append(url)
+        self.save(db)
+
+    def count(self, username):
+        return len(self.read(username)["extras"])
+
+
+class SqliteDatabase:
+    def __init__(self, path):
+        self.store = Store(path)
+
+    def read(self, username):
+        return self.store.get_user_data(username)
+
+    def append(self, username, url):
+        with self.store.transaction() as conn:
+            next_id = conn.execute(
+                "SELECT COALESCE(MAX(photo_id) + 1, 0) FROM photos WHERE username = ?", (username,)
+            ).fetchone()[0]
+            position = conn.execute(
+                "SELECT COALESCE(MAX(position) + 1, 0) FROM extras WHERE username = ?", (username,)
+            ).fetchone()[0]
+            self.store.add_photos(conn, username, next_id, [{"url": url, "filename": url, "faces": 0}], [[]])
+            conn.execute("INSERT INTO extras VALUES (?, ?, ?)", (username, position, next_id))
+
+    def count(self, username):
+        return len(self.read(username)["extras"])
+
+
+def hammer(db, users, threads, ops, write_ratio):
+    latencies = []
+    writes = {}
+    lock = threading.Lock()
+
+    def worker(tid):
+        rng = random.Random(tid)
+        local = []
+        for i in range(ops):
+            username = f"user{rng.randrange(users)}"
+            t0 = time.perf_counter()
+            try:
+                if rng.random() < write_ratio:
+                    db.append(username, f"https://example.com/new/{tid}/{i}.jpg")
+                    with lock:
+                        writes[username] = writes.get(username, 0) + 1
+                else:
+                    db.read(username)
+            except Exception:
+                pass  # a torn JSON file shows up as lost writes below
+            local.append(time.perf_counter() - t0)
+        with lock:
+            latencies.extend(local)
+
+    t0 = time.perf_counter()
+    pool = [threading.Thread(target=worker, args=(t,)) for t in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    return elapsed, np.array(latencies), writes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--photos", type=int, default=5, help="seed photos per user")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--ops", type=int, default=400, help="operations per thread")
+    parser.add_argument("--write-ratio", type=float, default=0.2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, db in (("json", JsonDatabase(os.path.join(tmp, "database.json"))),
+                         ("sqlite", SqliteDatabase(os.path.join(tmp, "memorymap.db")))):
+            if name == "json":
+                # seeding through the file one photo at a time would take forever
+                db.save({f"user{u}": {"clusters": {}, "extras": [f"https://example.com/{u}/{p}.jpg" for p in range(args.photos)]}
+                         for u in range(args.users)})
+            else:
+                with db.store.transaction() as conn:
+                    for u in range(args.users):
+                        db.store.add_photos(conn, f"user{u}", 0,
+                                            [{"url": f"https://example.com/{u}/{p}.jpg", "filename": "", "faces": 0}
+                                             for p in range(args.photos)], [[]] * args.photos)
+                        conn.executemany("INSERT INTO extras VALUES (?, ?, ?)",
+                                         [(f"user{u}", p, p) for p in range(args.photos)])
+
+            elapsed, lat, writes = hammer(db, args.users, args.threads, args.ops, args.write_ratio)
+            lost = sum(max(0, args.photos + n - db.count(u)) for u, n in writes.items())
+            total = len(lat)
+            print(f"{name:>7}: {total / elapsed:8.0f} ops/s  p50 {np.percentile(lat, 50) * 1000:7.2f} ms  "
+                  f"p99 {np.percentile(lat, 99) * 1000:8.2f} ms  lost writes {lost}/{sum(writes.values())}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Event clustering with and without time windows
+==============================================
+Synthetic libraries (benchmarks/synthetic.py) whose events happen on
+different days: every photo gets an EXIF-like capture time within a few
+hours of its event's start, a share of them none at all. Times
+clustering.cluster_photos (STEP 2-4) with windows off and with
+EVENT_TIME_GAP_HOURS set, and scores the events against the ground truth.
+The primary person search is the same either way; the fast centroid
+engine keeps it from hiding the STEP 3-4 difference.
+
+    python -m benchmarks.bench_time_windows --faces 1000 5000 20000 --gap-hours 6
+"""
+
+import argparse
+import time
+
+import numpy as np
+from sklearn.metrics import adjusted_rand_score
+
+import clustering
+from benchmarks.bench_clustering import event_labels
+from benchmarks.synthetic import make_user
+
+DAY = 86400
+
+
+def add_capture_times(user, undated_share, seed=0):
+    """One event every 12-36 hours, its photos (scenery included) within 3 hours of its start"""
+    rng = np.random.default_rng(seed)
+    start, current = 0.0, None
+    for photo, event in zip(user.photos, user.event_labels):
+        if event >= 0 and event != current:
+            start, current = start + DAY * rng.uniform(0.5, 1.5), event
+        photo["taken_at"] = None if rng.random() < undated_share else start + rng.uniform(0, 3 * 3600)
+
+
+def run(user, truth, gap_hours, method):
+    clustering.EVENT_TIME_GAP_HOURS = gap_hours
+    t0 = time.perf_counter()
+    events, extras = clustering.cluster_photos(user.photos, user.face_matrix(), verbose=False, method=method)
+    seconds = time.perf_counter() - t0
+    labels = event_labels(events, extras, len(user.photos))
+    return seconds, adjusted_rand_score(truth, labels), len(events)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--faces", type=int, nargs="+", default=[1000, 5000, 20000])
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--gap-hours", type=float, default=6)
+    parser.add_argument("--undated", type=float, default=0.05, help="share of photos without a capture time")
+    parser.add_argument("--method", default="centroid", help="person clustering engine for the primary person search")
+    args = parser.parse_args()
+
+    print(f"{'faces':>7s} {'photos':>7s} {'windows':>8s} {'seconds':>8s} {'event ARI':>10s} {'events':>7s}")
+    for num_faces in args.faces:
+        user = make_user(num_faces, dim=args.dim)
+        add_capture_times(user, args.undated)
+        truth = user.event_labels.copy()
+        scenery = np.flatnonzero(truth < 0)
+        truth[scenery] = truth.max() + 1 + np.arange(len(scenery))
+        for gap in (0, args.gap_hours):
+            seconds, ari, events = run(user, truth, gap, args.method)
+            label = f"{gap:g}h" if gap else "off"
+            print(f"{user.num_faces:7d} {len(user.photos):7d} {label:>8s} {seconds:8.2f} {ari:10.3f} {events:7d}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Synthetic users for the clustering benchmarks
+=============================================
+A user's library is a set of events. Every event has a few participants
+(the user, who is in most events, plus people drawn from a pool) and a
+number of photos; each photo shows some of the participants. Some photos
+have no faces at all (scenery).
+
+Each person is a random unit vector; every face of that person is that
+vector plus Gaussian noise, normalized. Two faces of the same person then
+have a cosine similarity of about 1 / (1 + noise^2), two different people
+about `common^2 / (1 + common^2)` (real embeddings share a common
+component, VGG-Face outputs are non-negative).
+
+Ground truth comes along: the person of every face and the event of every
+photo (-1 for scenery), so clustering quality can be scored.
+"""
+
+import numpy as np
+
+from similarity import FaceMatrix
+
+
+class SyntheticUser:
+    def __init__(self, photos, person_labels, event_labels):
+        self.photos = photos                # {"filename", "faces"} like upload records
+        self.person_labels = person_labels  # per face, in FaceMatrix row order
+        self.event_labels = event_labels    # per photo, -1 = scenery
+
+    @property
+    def num_faces(self):
+        return len(self.person_labels)
+
+    def face_matrix(self):
+        return FaceMatrix.from_photos(self.photos)
+
+
+def make_user(num_faces, dim=4096, persons=50, people_per_event=4, photos_per_event=12,
+              faces_per_photo=3, noise=0.5, common=0.5, scenery_ratio=0.1, seed=0):
+    """Generate photos until the library holds about `num_faces` faces"""
+    rng = np.random.default_rng(seed)
+
+    shared = rng.standard_normal(dim)
+    shared /= np.linalg.norm(shared)
+    identities = rng.standard_normal((persons, dim))
+    identities /= np.linalg.norm(identities, axis=1, keepdims=True)
+    identities = identities + common * shared
+    identities /= np.linalg.norm(identities, axis=1, keepdims=True)
+
+    photos, person_labels, event_labels = [], [], []
+    event = 0
+    while len(person_labels) < num_faces:
+        # person 0 is the user, in roughly four events out of five
+        others = rng.choice(np.arange(1, persons), size=people_per_event - 1, replace=False)
+        participants = np.concatenate(([0], others)) if rng.random() < 0.8 else others
+
+        for _ in range(photos_per_event):
+            if rng.random() < scenery_ratio:
+                photos.append({"filename": f"scenery_{len(photos)}.jpg", "faces": []})
+                event_labels.append(-1)
+                continue
+            k = int(rng.integers(1, min(faces_per_photo, len(participants)) + 1))
+            people = rng.choice(participants, size=k, replace=False)
+            faces = identities[people] + noise * rng.standard_normal((k, dim)) / np.sqrt(dim)
+            faces /= np.linalg.norm(faces, axis=1, keepdims=True)
+            photos.append({"filename": f"event{event}_{len(photos)}.jpg", "faces": faces.astype(np.float32)})
+            person_labels.extend(people.tolist())
+            event_labels.append(event)
+        event += 1
+
+    return SyntheticUser(photos, np.array(person_labels), np.array(event_labels))
@@ -0,0 +1,200 @@
+"""
+Batch event clustering
+======================
+STEP 2-4 of the upload flow, working on photo indices:
+2. Find primary person (most frequent face)
+3. Group primary-person photos that share at least 50% of their people
+4. Attach the remaining photos to an event if 30% of their faces appear
+   there, otherwise they become extras
+
+Optional time / location windows (off by default): with
+EVENT_TIME_GAP_HOURS set, photos are first split into windows along their
+EXIF timeline wherever that much time passes between two shots (or, with
+EVENT_DISTANCE_KM, the camera moved that far). STEP 3 and 4 then only
+compare photos and events of the same window, so the pairwise work is the
+sum of the squared window sizes instead of the squared library size.
+Photos without a capture time never start an event: STEP 4 tries them
+against every event. A library with no capture times at all is one window.
+"""
+
+import os
+
+import person_clustering
+import similarity as sim
+from photo_metadata import distance_km
+
+# --- EVENT RULES ---
+EVENT_SHARED_RATIO = 0.5   # STEP 3: shared / min(people in both photos)
+EXTRA_SHARED_RATIO = 0.3   # STEP 4: shared / people in the leftover photo
+
+# --- WINDOWS ---
+EVENT_TIME_GAP_HOURS = float(os.getenv("EVENT_TIME_GAP_HOURS", 0))   # 0 = no windows
+EVENT_DISTANCE_KM = float(os.getenv("EVENT_DISTANCE_KM", 0))         # 0 = time only
+
+
+def _quiet(*args, **kwargs):
+    pass
+
+
+def time_windows(photos, gap_hours=None, distance_km_limit=None):
+    """
+    Split photo indices into windows along the capture timeline:
+    ([[idx]] of dated windows in time order, [idx] without a capture time).
+    A new window starts after a gap of more than gap_hours, or a move of
+    more than distance_km_limit between consecutive photos with GPS.
+    gap_hours=0 puts everything in one window.
+    """
+    gap_hours = EVENT_TIME_GAP_HOURS if gap_hours is None else gap_hours
+    distance_km_limit = EVENT_DISTANCE_KM if distance_km_limit is None else distance_km_limit
+    if not gap_hours:
+        return [list(range(len(photos)))], []
+
+    dated = sorted((i for i, p in enumerate(photos) if p.get("taken_at") is not None),
+                   key=lambda i: photos[i]["taken_at"])
+    undated = [i for i, p in enumerate(photos) if p.get("taken_at") is None]
+    windows = []
+    last = None
+    for idx in dated:
+        photo = photos[idx]
+        split = last is None or photo["taken_at"] - last["taken_at"] > gap_hours * 3600
+        if not split and distance_km_limit and photo.get("lat") is not None and last.get("lat") is not None:
+            split = distance_km(last["lat"], last["lon"], photo["lat"], photo["lon"]) > distance_km_limit
+        if split:
+            windows.append([])
+        windows[-1].append(idx)
+        last = photo
+    return windows, undated
+
+
+def cluster_photos(photos, fm=None, verbose=True, method=None):
+    """
+    photos: records with "filename" and "faces" (and "taken_at", "lat",
+    "lon" for time / location windows).
+    Returns (events, extras): events are {"photos": [photo idx], "faces": [face rows]}
+    where "faces" is the STEP 3 face set; extras is a list of photo indices.
+    verbose=False skips the step log (used for provisional clusters while streaming).
+    method picks the person clustering engine (person_clustering.METHODS).
+    """
+    fm = fm if fm is not None else sim.FaceMatrix.from_photos(photos)
+    log = print if verbose else _quiet
+
+    log(f"\n{'='*80}")
+    log("STEP 2: Finding primary person...\n")
+
+    primary_faces, primary_photo_indices = person_clustering.find_primary_person(fm, method)
+
+    if primary_faces is None:
+        log("⚠️ No faces detected - all photos go to extras\n")
+        return [], list(range(len(photos)))
+
+    log(f"✓ Primary person found in {len(primary_photo_indices)} photos")
+    log(f"✓ Primary person has {len(primary_faces)} face samples\n")
+
+    dated, undated = time_windows(photos)
+    if not dated:
+        dated, undated = [list(range(len(photos)))], []
+    windows = [sorted(w) for w in dated] + ([sorted(undated)] if undated else [])
+    undated_window = len(dated) if undated else None
+    if len(windows) > 1:
+        log(f"🕒 {len(dated)} time window(s), {len(undated)} photo(s) without a capture time\n")
+
+    # STEP 3: Group photos with primary person
+    log(f"{'='*80}")
+    log("STEP 3: Creating events...\n")
+
+    events = []
+    window_events = {}   # window position -> its event positions
+    used_indices = set()
+    primary_set = set(primary_photo_indices)
+
+    for window_pos, window in enumerate(windows):
+        if window_pos == undated_window:
+            continue   # undated photos only join events (STEP 4)
+        # Shared-people counts between every pair of primary photos of the window, one matrix pass
+        primary_list = [i for i in window if i in primary_set]
+        primary_shared = sim.shared_counts(fm, [fm.rows(i) for i in primary_list], [fm.rows(i) for i in primary_list])
+
+        for ref_pos, ref_idx in enumerate(primary_list):
+            if ref_idx in used_indices:
+                continue
+
+            # Start new event
+            event = {
+                "photos": [ref_idx],
+                "faces": list(fm.rows(ref_idx))
+            }
+            used_indices.add(ref_idx)
+
+            log(f"Event {len(events)+1}: {photos[ref_idx]['filename']}")
+
+            # Find photos with SAME people (not just primary person)
+            for other_pos, other_idx in enumerate(primary_list):
+                if other_idx in used_indices:
+                    continue
+
+                # Check: do these photos share the same people?
+                shared = int(primary_shared[ref_pos, other_pos])
+
+                # If at least 50% of people match, same event
+                min_people = min(fm.count(ref_idx), fm.count(other_idx))
+                if min_people > 0 and (shared / min_people) >= EVENT_SHARED_RATIO:
+                    event["photos"].append(other_idx)
+                    event["faces"].extend(fm.rows(other_idx))
+                    used_indices.add(other_idx)
+                    log(f"  + {photos[other_idx]['filename']} (shared: {shared}/{min_people})")
+
+            window_events.setdefault(window_pos, []).append(len(events))
+            events.append(event)
+            log()
+
+    log(f"✓ Created {len(events)} events\n")
+
+    # STEP 4: Handle photos without primary person
+    log(f"{'='*80}")
+    log("STEP 4: Checking photos without primary person...\n")
+
+    extras = []
+
+    for window_pos, window in enumerate(windows):
+        # Candidate events: same window (every event for undated photos)
+        candidates = list(range(len(events))) if window_pos == undated_window else window_events.get(window_pos, [])
+        # Shared-people counts of every leftover photo against every candidate event
+        leftover = [idx for idx in window if idx not in used_indices]
+        event_shared = sim.shared_counts(fm, [fm.rows(i) for i in leftover], [events[e]["faces"] for e in candidates])
+
+        for pos, idx in enumerate(leftover):
+            num_faces = fm.count(idx)
+
+            # Try to match to existing event by checking for shared people
+            matched = False
+
+            for candidate_pos, event_pos in enumerate(candidates):
+                shared = int(event_shared[pos, candidate_pos])
+
+                if num_faces > 0 and (shared / num_faces) >= EXTRA_SHARED_RATIO:
+                    events[event_pos]["photos"].append(idx)
+                    used_indices.add(idx)
+                    matched = True
+                    log(f"✓ {photos[idx]['filename']} matched to event (shared people: {shared})")
+                    break
+
+            if not matched:
+                extras.append(idx)
+                log(f"→ {photos[idx]['filename']} moved to extras")
+
+    return events, extras
+
+
+def print_results(photos, events, extras):
+    print(f"\n{'='*80}")
+    print("🎉 FINAL RESULTS")
+    print(f"{'='*80}\n")
+
+    for i, event in enumerate(events):
+        print(f"Event_{i+1}: {len(event['photos'])} photos")
+        for idx in event["photos"]:
+            print(f"  - {photos[idx]['filename']}")
+        print()
+
+    if extras:
+        print(f"Extras: {len(extras)} photos\n")
@@ -0,0 +1,162 @@
+"""
+Image derivatives
+=================
+Stored photos stay full size; everything that does not need full size
+gets a smaller derivative instead:
+
+- inference input: the face detector sees the photo downscaled to at most
+  INFERENCE_MAX_SIDE, so per-photo detection time no longer depends on the
+  camera resolution. Face locations are scaled back to the original.
+- thumb / preview: made on first request from the stored original, kept
+  on disk under DERIVATIVE_DIR and served with a strong ETag. Photo URLs
+  never change (storage names are random), so neither do derivatives.
+- face crops: a detected face (its facial_area) with some margin, for the
+  people list; cached the same way, keyed by URL and face box.
+"""
+
+import hashlib
+import io
+import os
+import urllib.request
+import uuid
+from urllib.parse import urlparse
+
+from PIL import Image
+
+INFERENCE_MAX_SIDE = int(os.getenv("INFERENCE_MAX_SIDE", 1280))
+DERIVATIVE_DIR = os.getenv("DERIVATIVE_DIR", "derivatives")
+JPEG_QUALITY = int(os.getenv("JPEG_QUALITY", 90))
+
+# Longest side in pixels of each on-demand size
+SIZES = {
+    "thumb": 320,
+    "preview": 1280,
+}
+DERIVATIVE_QUALITY = 82
+# Face crops: longest side in pixels, margin around the face box (share of its size)
+FACE_CROP_SIDE = 160
+FACE_CROP_MARGIN = 0.3
+
+
+# --- INFERENCE INPUT ---
+
+def inference_image(img_rgb, max_side=INFERENCE_MAX_SIDE):
+    """Downscale an RGB PIL image for face detection, returns (image, scale to original)"""
+    longest = max(img_rgb.size)
+    if longest <= max_side:
+        return img_rgb, 1.0
+    scale = longest / max_side
+    size = (max(1, round(img_rgb.width / scale)), max(1, round(img_rgb.height / scale)))
+    # box-average by the integer part of the factor first: far cheaper than
+    # resampling the full-size image, and the result is not kept around
+    factor = int(scale)
+    small = img_rgb.reduce(factor) if factor >= 2 else img_rgb
+    return small.resize(size, Image.BILINEAR), scale
+
+
+def scale_location(location, scale):
+    """Map a facial_area found on the inference image back to original pixels"""
+    if scale == 1.0:
+        return location
+    scaled = {}
+    for key, value in location.items():
+        if isinstance(value, (int, float)):
+            scaled[key] = int(round(value * scale))
+        elif isinstance(value, (list, tuple)):   # eye coordinates
+            scaled[key] = [int(round(v * scale)) for v in value]
+        else:
+            scaled[key] = value
+    return scaled
+
+
+# --- ON-DEMAND SIZES ---
+
+def face_size(area):
+    """Derivative "size" name of a face crop: its box in original pixels"""
+    return f"face_{area['x']}_{area['y']}_{area['w']}_{area['h']}"
+
+
+def derivative_key(url, size):
+    return f"{hashlib.sha1(url.encode()).hexdigest()}_{size}"
+
+
+def etag(url, size):
+    return f'"{derivative_key(url, size)}"'
+
+
+def fetch_original(url):
+    """Bytes of a stored photo (file:// from LocalStorage or http(s) from Cloudinary)"""
+    parsed = urlparse(url)
+    if parsed.scheme == "file":
+        with open(parsed.path, "rb") as f:
+            return f.read()
+    with urllib.request.urlopen(url, timeout=30) as res:
+        return res.read()
+
+
+def render(data, size):
+    """JPEG bytes of `data` scaled so its longest side is at most SIZES[size]"""
+    side = SIZES[size]
+    image = Image.open(io.BytesIO(data))
+    image.draft("RGB", (side, side))   # JPEG: decode at 1/2, 1/4 or 1/8 scale directly
+    image = image.convert("RGB")
+    image.thumbnail((side, side), Image.LANCZOS)
+    buf = io.BytesIO()
+    image.save(buf, format="JPEG", quality=DERIVATIVE_QUALITY, optimize=True)
+    return buf.getvalue()
+
+
+def render_face(data, area, side=FACE_CROP_SIDE):
+    """JPEG bytes of a square crop around a facial_area, longest side at most `side`"""
+    image = Image.open(io.BytesIO(data))
+    half = max(area["w"], area["h"]) * (1 + 2 * FACE_CROP_MARGIN) / 2
+    cx, cy = area["x"] + area["w"] / 2, area["y"] + area["h"] / 2
+    box = (max(0, round(cx - half)), max(0, round(cy - half)),
+           min(image.width, round(cx + half)), min(image.height, round(cy + half)))
+    face = image.crop(box).convert("RGB")
+    face.thumbnail((side, side), Image.LANCZOS)
+    buf = io.BytesIO()
+    face.save(buf, format="JPEG", quality=DERIVATIVE_QUALITY)
+    return buf.getvalue()
+
+
+class DerivativeCache:
+    def __init__(self, root=DERIVATIVE_DIR, fetch=fetch_original):
+        self.root = root
+        self.fetch = fetch
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, url, size):
+        key = derivative_key(url, size)
+        return os.path.join(self.root, key[:2], f"{key}.jpg")
+
+    def get(self, url, size):
+        """Path of the derivative on disk, rendered on first use"""
+        path = self.path(url, size)
+        if os.path.exists(path):
+            return path
+        return self._write(path, render(self.fetch(url), size))
+
+    def face(self, url, area):
+        """Path of a face crop (area: facial_area in original pixels), rendered on first use"""
+        path = self.path(url, face_size(area))
+        if os.path.exists(path):
+            return path
+        return self._write(path, render_face(self.fetch(url), area))
+
+    def _write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)   # concurrent renders of the same size just overwrite each other
+        return path
+
+
+_cache = None
+
+def get_derivatives():
+    global _cache
+    if _cache is None:
+        _cache = DerivativeCache()
+    return _cache
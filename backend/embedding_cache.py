@@ -0,0 +1,162 @@
+"""
+Content-hash embedding cache
+============================
+Keyed by the SHA-256 of the uploaded file bytes. Stores the face
+embeddings and facial areas of a photo, plus the URL it was stored under
+per user, so the same user uploading the same file again skips decode,
+detection, embedding and the storage upload. Another user's upload of
+the same bytes never gets that URL: their copy is stored for them.
+
+Backed by a small SQLite file; least recently used entries are evicted
+once the total payload size passes EMBEDDING_CACHE_MAX_MB. The total is
+kept up to date by triggers, so no write has to sum the table.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from embeddings import compact
+
+CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.db")
+CACHE_MAX_BYTES = int(float(os.getenv("EMBEDDING_CACHE_MAX_MB", 512)) * 1024 * 1024)
+
+
+def content_hash(file_bytes):
+    return hashlib.sha256(file_bytes).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, path=CACHE_PATH, max_bytes=CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            BEGIN IMMEDIATE;
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                dim INTEGER NOT NULL,
+                embeddings BLOB NOT NULL,
+                locations TEXT NOT NULL,
+                url TEXT,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS entries_last_used ON entries(last_used);
+            CREATE TABLE IF NOT EXISTS urls (
+                key TEXT NOT NULL,
+                username TEXT NOT NULL,
+                url TEXT NOT NULL,
+                PRIMARY KEY (key, username)
+            );
+            CREATE TABLE IF NOT EXISTS total (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                size INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO total SELECT 0, COALESCE(SUM(size), 0) FROM entries;
+            CREATE TRIGGER IF NOT EXISTS entries_added AFTER INSERT ON entries
+                BEGIN UPDATE total SET size = size + NEW.size WHERE id = 0; END;
+            CREATE TRIGGER IF NOT EXISTS entries_removed AFTER DELETE ON entries
+                BEGIN
+                    UPDATE total SET size = size - OLD.size WHERE id = 0;
+                    DELETE FROM urls WHERE key = OLD.key;
+                END;
+            COMMIT;
+        """)
+
+    def get(self, key, username=None):
+        """
+        Cached {"faces", "locations", "url"} for a content hash, or None.
+        url: where `username` stored these bytes, None if they never did.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT e.dim, e.embeddings, e.locations, u.url FROM entries e "
+                "LEFT JOIN urls u ON u.key = e.key AND u.username = ? WHERE e.key = ?", (username, key)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._db.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+
+        dim, blob, locations, url = row
+        faces = np.frombuffer(blob, dtype=np.float32).reshape(-1, dim) if dim else np.zeros((0, 0), np.float32)
+        return {"faces": compact(faces), "locations": json.loads(locations), "url": url}
+
+    def put(self, key, faces, locations, url=None, username=None):
+        """Cache a photo's faces; with url and username, also where that user stored it"""
+        faces = np.asarray(faces, dtype=np.float32)
+        dim = faces.shape[1] if faces.ndim == 2 else 0
+        blob = faces.tobytes()
+        locations = json.dumps(locations)
+        size = len(blob) + len(locations)
+
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                # an upsert, not a replace: a replace would drop the other users' URLs
+                self._db.execute(
+                    "INSERT INTO entries (key, dim, embeddings, locations, size, last_used) "
+                    "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(key) DO UPDATE SET last_used = excluded.last_used",
+                    (key, dim, blob, locations, size, time.time()),
+                )
+                if url is not None and username is not None:
+                    self._db.execute("INSERT OR REPLACE INTO urls (key, username, url) VALUES (?, ?, ?)",
+                                     (key, username, url))
+                self._evict()
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def _evict(self):
+        """Drop least recently used entries until the cache fits in max_bytes"""
+        total = self._db.execute("SELECT size FROM total WHERE id = 0").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        freed = 0
+        victims = []
+        for key, size in self._db.execute("SELECT key, size FROM entries ORDER BY last_used"):
+            if total - freed <= self.max_bytes:
+                break
+            victims.append((key,))
+            freed += size
+        self._db.executemany("DELETE FROM entries WHERE key = ?", victims)
+        self.evictions += len(victims)
+
+    def stats(self):
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            total = self._db.execute("SELECT size FROM total WHERE id = 0").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": entries,
+            "bytes": total,
+            "max_bytes": self.max_bytes,
+        }
+
+
+_cache = None
+
+def get_cache():
+    """One cache connection per process"""
+    global _cache
+    if _cache is None:
+        _cache = EmbeddingCache()
+    return _cache
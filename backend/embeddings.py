@@ -0,0 +1,30 @@
+"""
+Compact embedding storage
+=========================
+A VGG-Face embedding as a Python list is 4096 boxed floats, about 128 KB
+per face. Here embeddings are NumPy arrays end to end:
+
+- the model output stays one float32 matrix, faces are row views into it
+- upload records carry each photo's faces as one (k, D) array in
+  EMBEDDING_DTYPE: float32 by default (16 KB per face, ~8x smaller than
+  lists). EMBEDDING_DTYPE=float16 halves that again, but rounds every
+  component, so cosine similarities move slightly and faces sitting right
+  at a match threshold can flip (benchmarks/bench_embeddings.py measures
+  it); only opt in where memory matters more.
+
+The store and the embedding cache always keep float32, and FaceMatrix
+(similarity.py) always works in float32; it upcasts once.
+"""
+
+import os
+
+import numpy as np
+
+EMBEDDING_DTYPE = os.getenv("EMBEDDING_DTYPE", "float32")   # float32 | float16
+
+
+def compact(vectors, dtype=EMBEDDING_DTYPE):
+    """(k, D) array of one photo's faces in the record dtype (float32 or float16)"""
+    if len(vectors) == 0:
+        return np.zeros((0, 0), dtype=dtype)
+    return np.asarray(vectors, dtype=dtype).reshape(len(vectors), -1)
@@ -0,0 +1,430 @@
+"""
+Parallel ingest pipeline
+========================
+Stage 0 (process pool): perceptual hashes from a tiny decode; near-duplicates
+                        and bursts (near_duplicates.py) keep one representative.
+Stage 1 (process pool): decode HEIC/JPEG, detect + embed faces, re-encode JPEG,
+                        one chunk of photos per task so crops embed in batches.
+                        Burst members are only decoded and re-encoded, and
+                        take their representative's faces.
+Stage 2 (thread pool):  upload the JPEG to storage.
+
+Each photo moves to stage 2 as soon as its stage 1 finishes, so decoding
+of later photos overlaps uploading of earlier ones. Results come back in
+the original file order, which is what the clustering steps expect.
+
+Worker processes are long-lived: each loads and warms the DeepFace models
+once (init_worker) and reuses them for every upload.
+
+Memory stays bounded whatever the batch size: uploads arrive as spooled
+file paths (spool.py), a worker holds one full-size image at a time (the
+stored JPEG goes straight to a temp file the upload thread streams from)
+plus the chunk's inference copies, and at most INGEST_INFLIGHT_CHUNKS
+chunks are being processed or uploaded at once. What stays until
+clustering are the compact per-photo records.
+"""
+
+import asyncio
+import io
+import multiprocessing
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import cv2
+import pillow_heif
+from PIL import Image
+
+from derivatives import JPEG_QUALITY, inference_image, scale_location
+from embedding_cache import content_hash
+from embeddings import compact
+from photo_metadata import read_metadata
+from spool import file_hash
+import metrics
+import near_duplicates
+
+# --- CONCURRENCY CONFIG ---
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", os.cpu_count() or 2))
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", 8))
+# Photos handed to a worker at once; their face crops share embedding batches
+INGEST_CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", 8))
+# Photos per perceptual hashing task (tiny decodes, so larger chunks)
+HASH_CHUNK_SIZE = 32
+
+# --- MEMORY CONFIG ---
+# Chunks being processed or waiting for their uploads at once
+INGEST_INFLIGHT_CHUNKS = int(os.getenv("INGEST_INFLIGHT_CHUNKS", 2 * INGEST_WORKERS))
+# Longest side of the stored copy, 0 = full size. When set, JPEGs are
+# decoded directly at 1/2, 1/4 or 1/8 scale (PIL draft mode)
+STORED_MAX_SIDE = int(os.getenv("STORED_MAX_SIDE", 0))
+# Larger images are rejected before their pixels are allocated
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", 100_000_000))
+# Stored JPEGs wait here (not in memory) until they are uploaded
+INGEST_TMP_DIR = os.getenv("INGEST_TMP_DIR", "ingest_tmp")
+
+
+def decode_image(filename, source, max_side=STORED_MAX_SIDE):
+    """Bytes or a file path -> RGB PIL image (HEIC handled via pillow_heif)"""
+    if filename.lower().endswith(".heic"):
+        heif_file = pillow_heif.read_heif(source)
+        size = heif_file.size
+        if size[0] * size[1] > MAX_IMAGE_PIXELS:
+            raise ValueError(f"{size[0]}x{size[1]} is over MAX_IMAGE_PIXELS")
+        image = Image.frombytes(heif_file.mode, size, heif_file.data, "raw")
+    else:
+        image = Image.open(source if isinstance(source, str) else io.BytesIO(source))
+        if image.width * image.height > MAX_IMAGE_PIXELS:
+            raise ValueError(f"{image.width}x{image.height} is over MAX_IMAGE_PIXELS")
+        if max_side:
+            image.draft("RGB", (max_side, max_side))
+    image = image.convert("RGB")
+    if max_side:
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+    return image
+
+
+def save_jpeg(img_rgb, to_file):
+    """The stored copy: a temp file path (to_file) or JPEG bytes"""
+    if not to_file:
+        buf = io.BytesIO()
+        img_rgb.save(buf, format="JPEG", quality=JPEG_QUALITY)
+        return {"jpeg": buf.getvalue()}
+    os.makedirs(INGEST_TMP_DIR, exist_ok=True)
+    path = os.path.join(INGEST_TMP_DIR, f"{uuid.uuid4().hex}.jpg")
+    img_rgb.save(path, format="JPEG", quality=JPEG_QUALITY)
+    return {"jpeg_path": path}
+
+
+def prepare_photo(filename, source):
+    """
+    Decode one photo and write its stored copy. Returns (BGR inference
+    image, scale to original, partial result); the full-size pixels are
+    released before returning.
+    """
+    t0 = time.perf_counter()
+    meta = read_metadata(filename, source)
+    img_rgb = decode_image(filename, source)
+    small, scale = inference_image(img_rgb)
+    bgr = cv2.cvtColor(np.asarray(small), cv2.COLOR_RGB2BGR)
+    del small
+
+    t1 = time.perf_counter()
+    stored = save_jpeg(img_rgb, to_file=isinstance(source, str))
+    del img_rgb
+    spans = {"decode": t1 - t0, "encode": time.perf_counter() - t1}
+    return bgr, scale, {"faces": [], "locations": [], "spans": spans, "meta": meta, **stored}
+
+
+@metrics.profiled("ingest_chunk")
+def process_photos(items):
+    """
+    CPU-bound part of ingest, runs inside a worker process on a chunk of
+    (filename, file_bytes or spooled path). All photos of the chunk are
+    decoded and their faces detected first, then every face crop is
+    embedded in batches.
+    Returns one {"faces", "locations", "jpeg" or "jpeg_path", "spans", "meta",
+    "detector", "tried"} (or {"error"}) per item, in order; faces is a
+    compact (k, D) array, spans are seconds per stage. Spooled inputs get
+    their stored copy as a temp file ("jpeg_path").
+    Detection runs on a bounded-resolution copy, the stored JPEG stays full
+    size (or STORED_MAX_SIDE); only the inference copies are kept for the
+    whole chunk.
+    """
+    import ml_engine as ml  # imported in the worker so each process owns its model
+
+    results = []
+    images = []
+    scales = []
+    positions = []
+    for filename, source in items:
+        try:
+            bgr, scale, result = prepare_photo(filename, source)
+            images.append(bgr)
+            scales.append(scale)
+            positions.append(len(results))
+            results.append(result)
+        except Exception as e:
+            results.append({"error": str(e)})
+
+    timings = {}
+    face_data = ml.get_face_embeddings_batch(images, timings=timings)
+    del images
+    num_crops = sum(len(faces) for faces in face_data if faces is not None)
+    for pos, scale, faces, detect in zip(positions, scales, face_data, timings["detect"]):
+        result = results[pos]
+        if faces is None:   # failed, not faceless: never stored or cached as a photo without people
+            result["error"] = "Face embedding failed"
+            continue
+        result["faces"] = compact([f["embedding"] for f in faces])
+        if faces and "reduced" in faces[0]:
+            result["reduced"] = compact([f["reduced"] for f in faces])
+            result["reducer"] = timings["reducer"]
+        result["locations"] = [scale_location(f["location"], scale) for f in faces]
+        result["detector"], result["tried"] = detect["backend"], detect["tried"]
+        result["spans"]["detect"] = detect["seconds"]
+        # the batch is embedded at once, each photo gets its share by face count
+        result["spans"]["embed"] = timings.get("embed", 0.0) * len(faces) / num_crops if num_crops else 0.0
+
+    return results
+
+
+def hash_photos(items):
+    """
+    Burst detection pre-stage, in a worker process: (pHash, dHash) per
+    (filename, source) from a tiny decode, None for files that do not
+    decode (the full pass reports those).
+    """
+    hashes = []
+    for filename, source in items:
+        try:
+            img_rgb = decode_image(filename, source, max_side=near_duplicates.HASH_DECODE_SIDE)
+            hashes.append(near_duplicates.image_hashes(img_rgb))
+        except Exception:
+            hashes.append(None)
+    return hashes
+
+
+def store_photos(items):
+    """
+    Stored copies only, no face inference (burst members): one
+    {"jpeg" or "jpeg_path", "spans", "meta"} (or {"error"}) per item.
+    """
+    results = []
+    for filename, source in items:
+        try:
+            t0 = time.perf_counter()
+            meta = read_metadata(filename, source)
+            img_rgb = decode_image(filename, source)
+            t1 = time.perf_counter()
+            stored = save_jpeg(img_rgb, to_file=isinstance(source, str))
+            del img_rgb
+            spans = {"decode": t1 - t0, "encode": time.perf_counter() - t1}
+            results.append({"spans": spans, "meta": meta, **stored})
+        except Exception as e:
+            results.append({"error": str(e)})
+    return results
+
+
+def init_worker():
+    """Process pool initializer: every worker loads and warms its own models"""
+    import ml_engine as ml
+    ml.warmup()
+
+
+def worker_stats():
+    import ml_engine as ml
+    return dict(ml.WARMUP_STATS, pid=os.getpid())
+
+
+class IngestPipeline:
+    """
+    Reusable pools for the two stages. Create once per server process;
+    worker processes stay alive between uploads so models load only once.
+    """
+
+    def __init__(self, storage, workers=INGEST_WORKERS, upload_concurrency=UPLOAD_CONCURRENCY,
+                 chunk_size=INGEST_CHUNK_SIZE, process_fn=process_photos, worker_init=init_worker,
+                 cache=None, inflight_chunks=INGEST_INFLIGHT_CHUNKS,
+                 burst_detection=near_duplicates.BURST_DETECTION, hash_fn=hash_photos, store_fn=store_photos):
+        self.storage = storage
+        self.cache = cache
+        self.process_fn = process_fn
+        self.burst_detection = burst_detection
+        self.hash_fn = hash_fn
+        self.store_fn = store_fn
+        self.chunk_size = chunk_size
+        self.inflight_chunks = inflight_chunks
+        self.workers = workers
+        # spawn: forking a parent that already holds TensorFlow is unsafe
+        self.cpu_pool = ProcessPoolExecutor(max_workers=workers,
+                                            mp_context=multiprocessing.get_context("spawn"),
+                                            initializer=worker_init)
+        self.io_pool = ThreadPoolExecutor(max_workers=upload_concurrency)
+        self.upload_concurrency = upload_concurrency
+
+    async def _upload_one(self, idx, total, filename, key, result, upload_slots, username=None):
+        loop = asyncio.get_running_loop()
+        spans = dict(result.get("spans", {}))
+        try:
+            if "error" in result:
+                raise RuntimeError(result["error"])
+
+            async with upload_slots:
+                start = time.perf_counter()
+                url = await loop.run_in_executor(self.io_pool, self._store, result)
+                spans["upload"] = time.perf_counter() - start
+
+            if self.cache is not None:
+                await asyncio.to_thread(self.cache.put, key, result["faces"], result["locations"], url, username)
+
+            burst = result.get("burst")
+            print(f"[{idx+1}/{total}] {filename} - {len(result['faces'])} face(s){' (burst)' if burst else ''}")
+            metrics.record_file(filename, spans, result.get("detector"), result.get("tried", 0),
+                                len(result["faces"]), outcome="burst" if burst else "ok")
+            return {"url": url, "filename": filename, "faces": result["faces"],
+                    "locations": result["locations"], "hash": key, "reduced": result.get("reduced"),
+                    "reducer": result.get("reducer"), "burst": burst, **result.get("meta", {})}
+
+        except Exception as e:
+            print(f"[{idx+1}/{total}] ❌ {filename}: {e}")
+            metrics.record_file(filename, spans, outcome="error")
+            return None
+        finally:
+            if result.get("jpeg_path") and os.path.exists(result["jpeg_path"]):
+                os.remove(result["jpeg_path"])
+
+    def _store(self, result):
+        if "jpeg_path" in result:
+            return self.storage.upload_file(result["jpeg_path"])
+        return self.storage.upload(result["jpeg"])
+
+    async def _ingest_chunk(self, total, chunk, upload_slots, inflight, on_photo=None, shared=None, username=None):
+        """
+        chunk: list of (idx, filename, source, key) -> [(idx, record or None)].
+        shared: {idx: representative's record} for burst members, which are
+        only stored (store_fn) and take their faces from the representative.
+        """
+        loop = asyncio.get_running_loop()
+        process_fn = self.process_fn if shared is None else self.store_fn
+
+        async def upload(idx, filename, key, result):
+            if shared is not None and "error" not in result:
+                rep = shared[idx]
+                result.update(faces=rep["faces"], locations=rep["locations"], reduced=rep.get("reduced"),
+                              reducer=rep.get("reducer"), burst=rep["hash"])
+            record = await self._upload_one(idx, total, filename, key, result, upload_slots, username)
+            if on_photo is not None:
+                on_photo(idx, filename, record)
+            return record
+
+        async with inflight:   # held until the chunk's uploads are done
+            try:
+                with metrics.span("chunk"):
+                    results = await loop.run_in_executor(
+                        self.cpu_pool, process_fn, [(filename, source) for _, filename, source, _ in chunk]
+                    )
+            except Exception as e:
+                results = [{"error": str(e)}] * len(chunk)
+
+            records = await asyncio.gather(*[
+                upload(idx, filename, key, result)
+                for (idx, filename, _, key), result in zip(chunk, results)
+            ])
+        return [(idx, record) for (idx, _, _, _), record in zip(chunk, records)]
+
+    def _check_cache(self, idx, total, filename, source, known, username):
+        """Blocking part of the cache check, run in a thread: (idx, content hash, cached record or None)"""
+        key = known[0] if known else content_hash(source) if isinstance(source, bytes) else file_hash(source)
+        return idx, key, self._lookup_cache(idx, total, filename, source, key, username)
+
+    def _lookup_cache(self, idx, total, filename, source, key, username):
+        """Cached record for a file the user already ingested before (same bytes), or None"""
+        cached = self.cache.get(key, username) if self.cache is not None else None
+        if not cached or not cached["url"]:
+            return None
+        meta = read_metadata(filename, source)
+
+        print(f"[{idx+1}/{total}] {filename} - {len(cached['faces'])} face(s) (cached)")
+        metrics.record_file(filename, {}, faces=len(cached["faces"]), outcome="cached")
+        return {"url": cached["url"], "filename": filename, "faces": cached["faces"],
+                "locations": cached["locations"], "hash": key, **meta}
+
+    async def run(self, items, on_photo=None, username=None):
+        """
+        items: list of (filename, file_bytes or spooled path[, content hash]),
+        uploaded by `username` (cached storage URLs are per user).
+        Returns processed photo records in input order; failed files are dropped.
+        on_photo(idx, filename, record or None) is called as each photo finishes,
+        in completion order (cache hits first).
+        """
+        with metrics.span("ingest"):
+            return await self._run(items, on_photo, username)
+
+    async def _run(self, items, on_photo, username):
+        total = len(items)
+        records = [None] * total
+
+        # Cache check happens before anything is decoded; hashing, the cache
+        # lookup and the EXIF read block, so they run in threads
+        misses = []
+        checks = [asyncio.to_thread(self._check_cache, idx, total, filename, source, known, username)
+                  for idx, (filename, source, *known) in enumerate(items)]
+        for check in asyncio.as_completed(checks):
+            idx, key, records[idx] = await check
+            filename, source = items[idx][:2]
+            if records[idx] is None:
+                misses.append((idx, filename, source, key))
+            elif on_photo is not None:
+                on_photo(idx, filename, records[idx])
+        misses.sort(key=lambda miss: miss[0])   # upload order, burst grouping relies on it
+
+        members = []
+        if self.burst_detection and len(misses) > 1:
+            misses, members = await self._split_bursts(misses)
+
+        upload_slots = asyncio.Semaphore(self.upload_concurrency)
+        inflight = asyncio.Semaphore(self.inflight_chunks)
+        await self._ingest_all(total, misses, records, upload_slots, inflight, on_photo, username=username)
+
+        if members:
+            # a member whose representative failed gets the full pass itself
+            orphans = [m[:4] for m in members if records[m[4]] is None]
+            shared = {m[0]: records[m[4]] for m in members if records[m[4]] is not None}
+            await asyncio.gather(
+                self._ingest_all(total, orphans, records, upload_slots, inflight, on_photo, username=username),
+                self._ingest_all(total, [m[:4] for m in members if m[0] in shared], records,
+                                 upload_slots, inflight, on_photo, shared, username),
+            )
+
+        return [r for r in records if r is not None]
+
+    async def _ingest_all(self, total, items, records, upload_slots, inflight, on_photo, shared=None, username=None):
+        tasks = [
+            self._ingest_chunk(total, items[start:start + self.chunk_size], upload_slots, inflight, on_photo, shared,
+                               username)
+            for start in range(0, len(items), self.chunk_size)
+        ]
+        for chunk in await asyncio.gather(*tasks):
+            for idx, record in chunk:
+                records[idx] = record
+
+    async def _split_bursts(self, misses):
+        """
+        Group near-duplicates (near_duplicates.py) before any inference:
+        (representatives, members as (idx, filename, source, key, representative idx))
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            with metrics.span("hash"):
+                parts = await asyncio.gather(*[
+                    loop.run_in_executor(self.cpu_pool, self.hash_fn,
+                                         [(filename, source) for _, filename, source, _ in misses[start:start + HASH_CHUNK_SIZE]])
+                    for start in range(0, len(misses), HASH_CHUNK_SIZE)
+                ])
+        except Exception as e:
+            print(f"⚠️ Burst detection skipped: {e}")
+            return misses, []
+
+        groups = near_duplicates.group([h for part in parts for h in part])
+        representatives, members = [], []
+        for pos, item in enumerate(misses):
+            if groups[pos] == pos:
+                representatives.append(item)
+            else:
+                members.append((*item, misses[groups[pos]][0]))
+        if members:
+            print(f"🔁 {len(members)} near-duplicate photo(s), face inference on {len(representatives)} of {len(misses)}")
+        return representatives, members
+
+    async def warm(self):
+        """Start every worker process (running the initializer) and collect their stats"""
+        loop = asyncio.get_running_loop()
+        return await asyncio.gather(*[
+            loop.run_in_executor(self.cpu_pool, worker_stats) for _ in range(self.workers)
+        ])
+
+    def shutdown(self):
+        self.cpu_pool.shutdown(cancel_futures=True)
+        self.io_pool.shutdown(cancel_futures=True)
@@ -0,0 +1,104 @@
+"""
+Upload jobs with streamed progress
+==================================
+POST /upload-jobs/ returns a job id straight away and the upload runs in
+the background. Every step appends an event to the job's log:
+
+    progress   one per photo   {"done", "total", "filename", "ok", "faces"}
+    partial    every few photos, provisional clusters of the batch so far
+    done       final {"clusters", "extras"} of the user's library
+    error      {"message"}
+
+The log is kept in memory, so a client can reconnect to the SSE stream
+with Last-Event-ID (or poll GET /upload-jobs/{id}) and miss nothing.
+With UPLOAD_QUEUE=sqlite the same log lives in the queue database
+instead (upload_queue.QueuedJob).
+"""
+
+import asyncio
+import json
+import time
+import uuid
+
+# Finished jobs stay around this long for late reconnects
+JOB_TTL_SECONDS = 3600
+KEEP_ALIVE_SECONDS = 15
+
+
+def sse_event(seq, event_type, data):
+    return f"id: {seq}\nevent: {event_type}\ndata: {json.dumps(data)}\n\n"
+
+
+class Job:
+    def __init__(self, username, total):
+        self.id = uuid.uuid4().hex
+        self.username = username
+        self.total = total
+        self.done = 0
+        self.status = "queued"
+        self.created = time.time()
+        self.finished = None
+        self.events = []        # (seq, type, data)
+        self.partial = None
+        self.result = None
+        self.task = None        # asyncio task running the upload
+        self._changed = asyncio.Event()
+
+    def emit(self, event_type, data):
+        self.events.append((len(self.events) + 1, event_type, data))
+        if event_type == "progress":
+            self.done = data["done"]
+        elif event_type == "partial":
+            self.partial = data
+        elif event_type == "done":
+            self.status, self.result, self.finished = "done", data, time.time()
+        elif event_type == "error":
+            self.status, self.finished = "error", time.time()
+        # wake every waiting stream, then arm the event again
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def snapshot(self):
+        return {
+            "job_id": self.id,
+            "username": self.username,
+            "status": self.status,
+            "done": self.done,
+            "total": self.total,
+            "partial": self.partial,
+            "result": self.result,
+            "last_event_id": len(self.events),
+        }
+
+    async def stream(self, last_event_id=0):
+        """Server-Sent Events, starting after last_event_id, until the job ends"""
+        sent = last_event_id
+        while True:
+            for seq, event_type, data in self.events[sent:]:
+                yield sse_event(seq, event_type, data)
+                sent = seq
+            if self.finished is not None and sent >= len(self.events):
+                return
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout=KEEP_ALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"  # stops proxies from closing an idle stream
+
+
+class JobRegistry:
+    def __init__(self):
+        self.jobs = {}
+
+    def create(self, username, total):
+        self._expire()
+        job = Job(username, total)
+        self.jobs[job.id] = job
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def _expire(self):
+        now = time.time()
+        for job_id in [j.id for j in self.jobs.values() if j.finished and now - j.finished > JOB_TTL_SECONDS]:
+            del self.jobs[job_id]
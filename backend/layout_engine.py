@@ -1,80 +1,244 @@
-# backend/layout_engine.py
+"""
+Album layout engine
+===================
+Lays out a whole event (any number of photos) as justified rows over as
+many pages as it needs, keeping every photo's aspect ratio:
+
+1. Row breaking: a linear-partition DP over the photo sequence. A row of
+   photos i..j is scaled to fill the page width; its cost is how far that
+   height lands from the target row height (squared). At most
+   LAYOUT_MAX_PER_ROW photos per row, so this is O(n * max_per_row).
+   The last row is not stretched beyond the target height.
+2. Page breaking: a second DP over the rows, minimizing the squared unused
+   height of every page but the last. Rows never split across pages.
+3. The last page (a whole small event, or the tail of a large one) is
+   re-broken with the row count that covers most of it, so one photo
+   becomes a full-page shot rather than a 220px strip.
+
+Pages come back as zones in % of the page (the Editor's LAYOUTS format)
+plus the photo URL. Results are memoized by a hash of the photo set and
+the parameters (LRU, LAYOUT_CACHE_SIZE), so asking again for an unchanged
+event costs one hash.
+
+    layout_album([(url, aspect), ...])  -> {"key", "pages": [{"zones"}]}
+    generate_layout(photos)             -> flat positions (old interface)
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+# Default page: the Editor's 600x800 canvas, margins / gaps like its LAYOUTS
+LAYOUT_PAGE_WIDTH = int(os.getenv("LAYOUT_PAGE_WIDTH", 600))
+LAYOUT_PAGE_HEIGHT = int(os.getenv("LAYOUT_PAGE_HEIGHT", 800))
+LAYOUT_MARGIN = int(os.getenv("LAYOUT_MARGIN", 20))
+LAYOUT_GAP = int(os.getenv("LAYOUT_GAP", 10))
+LAYOUT_ROW_HEIGHT = int(os.getenv("LAYOUT_ROW_HEIGHT", 220))
+LAYOUT_MAX_PER_ROW = int(os.getenv("LAYOUT_MAX_PER_ROW", 5))
+LAYOUT_CACHE_SIZE = int(os.getenv("LAYOUT_CACHE_SIZE", 512))
+# Photos stored before sizes were recorded
+DEFAULT_ASPECT = 4 / 3
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def aspect_of(width, height):
+    """width / height, DEFAULT_ASPECT when unknown"""
+    if not width or not height:
+        return DEFAULT_ASPECT
+    return width / height
+
+
+# --- ROWS ---
+
+def break_rows(aspects, width, target, gap, max_per_row=LAYOUT_MAX_PER_ROW):
+    """
+    Justified rows: [(first, end, height)] covering aspects[first:end].
+    Minimizes sum((height - target)^2) over all rows but an underfull last one.
+    """
+    n = len(aspects)
+    prefix = [0.0]
+    for a in aspects:
+        prefix.append(prefix[-1] + a)
+
+    inf = float("inf")
+    cost = [0.0] + [inf] * n
+    back = [0] * (n + 1)
+    for end in range(1, n + 1):
+        best, best_first = inf, end - 1
+        for first in range(max(0, end - max_per_row), end):
+            height = (width - gap * (end - first - 1)) / (prefix[end] - prefix[first])
+            row_cost = 0.0 if end == n and height > target else (height - target) ** 2
+            total = cost[first] + row_cost
+            if total < best:
+                best, best_first = total, first
+        cost[end], back[end] = best, best_first
+
+    rows = []
+    end = n
+    while end > 0:
+        first = back[end]
+        height = (width - gap * (end - first - 1)) / (prefix[end] - prefix[first])
+        if end == n:
+            height = min(height, target)
+        rows.append((first, end, height))
+        end = first
+    rows.reverse()
+    return rows
+
+
+# --- PAGES ---
+
+def break_pages(heights, page_height, gap):
+    """
+    Group consecutive rows onto pages: [(first, end)] of row indices.
+    Minimizes the squared unused height of every page but the last.
+    """
+    n = len(heights)
+    inf = float("inf")
+    cost = [0.0] + [inf] * n
+    back = [0] * (n + 1)
+    for end in range(1, n + 1):
+        used = -gap
+        first = end
+        # walk back while the rows still fit (a single row always does)
+        while first > 0:
+            used += heights[first - 1] + gap
+            if used > page_height and first < end:
+                break
+            page_cost = 0.0 if end == n else (page_height - min(used, page_height)) ** 2
+            if cost[first - 1] + page_cost < cost[end]:
+                cost[end], back[end] = cost[first - 1] + page_cost, first - 1
+            first -= 1
+    pages = []
+    end = n
+    while end > 0:
+        pages.append((back[end], end))
+        end = back[end]
+    pages.reverse()
+    return pages
+
+
+def _pct(value, total):
+    return round(100 * value / total, 3)
+
+
+def _fit(rows, aspects, inner_w, inner_h, gap):
+    """Row heights of one page, shrunk (keeping aspect ratios) until the rows fit"""
+    heights = [min(h, inner_h) for _, _, h in rows]
+    used = sum(heights) + gap * (len(rows) - 1)
+    widest = max(sum(aspects[first:end]) * h for (first, end, _), h in zip(rows, heights))
+    scale = min(1.0, (inner_h - gap * (len(rows) - 1)) / (used - gap * (len(rows) - 1)), inner_w / widest)
+    return [h * scale for h in heights]
+
+
+def _refit_last_page(aspects, first, inner_w, inner_h, gap, max_per_row):
+    """
+    The last page is often underfull (a whole small event, or the rest of a
+    big one): try every row count and keep the arrangement covering most of
+    the page. Only the last page's photos are involved, so this is cheap.
+    """
+    tail = aspects[first:]
+    best, best_area = None, -1.0
+    for count in range(1, len(tail) + 1):
+        target = (inner_h - gap * (count - 1)) / count
+        rows = [(first + a, first + b, h) for a, b, h in break_rows(tail, inner_w, target, gap, max_per_row)]
+        heights = _fit(rows, aspects, inner_w, inner_h, gap)
+        area = sum(sum(aspects[a:b]) * h * h for (a, b, _), h in zip(rows, heights))
+        if area > best_area + 1e-6:
+            best, best_area = (rows, heights), area
+    return best
+
+
+def compute_layout(photos, page_width=LAYOUT_PAGE_WIDTH, page_height=LAYOUT_PAGE_HEIGHT,
+                   margin=LAYOUT_MARGIN, gap=LAYOUT_GAP, row_height=LAYOUT_ROW_HEIGHT,
+                   max_per_row=LAYOUT_MAX_PER_ROW):
+    """photos: [(url, aspect)] -> [{"zones": [{"x", "y", "w", "h", "url"}]}] (% of the page)"""
+    if not photos:
+        return []
+    inner_w = page_width - 2 * margin
+    inner_h = page_height - 2 * margin
+    aspects = [a if a and a > 0 else DEFAULT_ASPECT for _, a in photos]
+    rows = break_rows(aspects, inner_w, row_height, gap, max_per_row)
+    # a very tall photo alone in its row is shrunk to fit the page
+    heights = [min(h, inner_h) for _, _, h in rows]
+
+    page_rows = [rows[first:end] for first, end in break_pages(heights, inner_h, gap)]
+    laid_out = [(r, _fit(r, aspects, inner_w, inner_h, gap)) for r in page_rows[:-1]]
+    laid_out.append(_refit_last_page(aspects, page_rows[-1][0][0], inner_w, inner_h, gap, max_per_row))
+
+    pages = []
+    for page, heights in laid_out:
+        # rows narrower than the page and the block as a whole are centred
+        y = margin + (inner_h - sum(heights) - gap * (len(page) - 1)) / 2
+        zones = []
+        for (first, end, _), height in zip(page, heights):
+            row_w = sum(aspects[first:end]) * height + gap * (end - first - 1)
+            x = margin + max(0.0, inner_w - row_w) / 2
+            for i in range(first, end):
+                w = aspects[i] * height
+                zones.append({
+                    "x": _pct(x, page_width), "y": _pct(y, page_height),
+                    "w": _pct(w, page_width), "h": _pct(height, page_height),
+                    "url": photos[i][0],
+                })
+                x += w + gap
+            y += height + gap
+        pages.append({"zones": zones})
+    return pages
+
+
+# --- MEMOIZED ENTRY POINT ---
+
+def layout_key(photos, params):
+    """Hash of the photo set (URLs and aspects, in order) and the layout parameters"""
+    digest = hashlib.sha1(json.dumps(params, sort_keys=True).encode())
+    for url, aspect in photos:
+        digest.update(f"{url}\0{aspect:.4f}\n".encode())
+    return digest.hexdigest()
+
+
+def layout_album(photos, **params):
+    """
+    Memoized compute_layout: {"key", "photos", "pages"}. `key` identifies
+    the photo set and parameters and doubles as an ETag.
+    """
+    key = layout_key(photos, params)
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached is not None:
+            _cache.move_to_end(key)
+            return cached
+
+    result = {"key": key, "photos": len(photos), "pages": compute_layout(photos, **params)}
+    with _cache_lock:
+        _cache[key] = result
+        while len(_cache) > LAYOUT_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return result
+
 
 def generate_layout(photos, canvas_width=595, canvas_height=842):
     """
-    Returns a list of calculated positions for the photos.
-    This is a Rule-Based AI: It adapts based on the count.
+    Positions in canvas units for photo dicts ({"image_url", optional
+    "width" / "height"}), every photo placed; "page" says which page.
     """
-    count = len(photos)
-    layout_data = []
-    
-    # Margin and Padding
-    margin = 40
-    gap = 20
-    
-    # Available drawing area
-    draw_width = canvas_width - (2 * margin)
-    draw_height = canvas_height - (2 * margin)
-
-    # --- LAYOUT LOGIC ---
-    
-    # SCENARIO 1: Single Photo (Hero Shot)
-    if count == 1:
-        layout_data.append({
-            "url": photos[0]["image_url"],
-            "left": margin,
-            "top": margin,
-            "width": draw_width,
-            "height": draw_width * 0.75 # 4:3 Aspect Ratio
-        })
-
-    # SCENARIO 2: Two Photos (Split Vertical)
-    elif count == 2:
-        img_height = (draw_height - gap) / 2
-        for i, photo in enumerate(photos):
-            layout_data.append({
-                "url": photo["image_url"],
-                "left": margin,
-                "top": margin + (i * (img_height + gap)),
-                "width": draw_width,
-                "height": img_height
-            })
-
-    # SCENARIO 3: Four Photos (2x2 Grid)
-    elif count == 4:
-        box_width = (draw_width - gap) / 2
-        box_height = box_width # Square
-        
-        # Grid positions: (0,0), (1,0), (0,1), (1,1)
-        positions = [(0,0), (1,0), (0,1), (1,1)]
-        
-        for i, photo in enumerate(photos):
-            col, row = positions[i]
-            layout_data.append({
-                "url": photo["image_url"],
-                "left": margin + (col * (box_width + gap)),
-                "top": margin + (row * (box_height + gap)),
-                "width": box_width,
-                "height": box_height
-            })
-
-    # SCENARIO 4: Default (Masonry / Simple Stack for 3, 5, or more)
-    else:
-        # Just stack them nicely with a max height
-        current_y = margin
-        fixed_height = 200
-        
-        for photo in photos:
-            # Stop if we run off the page
-            if current_y + fixed_height > canvas_height: break
-            
-            layout_data.append({
-                "url": photo["image_url"],
-                "left": margin,
-                "top": current_y,
-                "width": draw_width,
-                "height": fixed_height
-            })
-            current_y += fixed_height + gap
-
-    return layout_data
\ No newline at end of file
+    pages = layout_album(
+        [(p["image_url"], aspect_of(p.get("width"), p.get("height"))) for p in photos],
+        page_width=canvas_width, page_height=canvas_height, margin=40, gap=20,
+    )["pages"]
+    return [
+        {
+            "url": z["url"],
+            "page": page_idx,
+            "left": z["x"] * canvas_width / 100,
+            "top": z["y"] * canvas_height / 100,
+            "width": z["w"] * canvas_width / 100,
+            "height": z["h"] * canvas_height / 100,
+        }
+        for page_idx, page in enumerate(pages)
+        for z in page["zones"]
+    ]
@@ -0,0 +1,562 @@
+"""
+Per-user photo library with incremental clustering
+==================================================
+Keeps what a user's events are made of, so a new upload is added to the
+existing events instead of replacing them:
+
+- person centroids: running sum of every face assigned to a person
+  (normalized only to compare against it, so adding, merging and
+  splitting faces stay exact);
+  every face's person is stored too (the person -> photos index behind
+  the /people endpoints), ids stay the same across reclusters
+- event face sets: a deduplicated set of prototype faces per event
+  (a face joins the set only if it matches none of the existing ones)
+- raw embeddings: the faces table, only read by a full recluster
+
+New photos are matched against the event face sets with the STEP 4 rule,
+the rest are grouped among themselves with the STEP 3 rule. Cost depends
+on the new photos and the number of prototypes, not on the library size.
+A full recluster (on demand, or once the library has grown by
+RECLUSTER_DRIFT_RATIO since the last one) reruns the batch clustering
+over everything to undo drift.
+
+Everything is persisted through store.py (photos, faces, events, extras,
+persons tables); load and save inside one store.transaction(). An
+incremental add only writes the events and persons it touched and the
+extras it appended; a recluster rewrites them all.
+"""
+
+import os
+
+import numpy as np
+
+import clustering
+import person_clustering
+import reduction
+import similarity as sim
+
+RECLUSTER_DRIFT_RATIO = float(os.getenv("RECLUSTER_DRIFT_RATIO", 1.0))
+
+
+def _empty(dim=0):
+    return np.zeros((0, dim), dtype=np.float32)
+
+
+def _dedupe(vectors, existing=None, threshold=sim.MATCH_THRESHOLD):
+    """Keep only the vectors that match nothing in `existing` nor an earlier kept one"""
+    kept = []
+    for vector in vectors:
+        if existing is not None and len(existing) and (existing @ vector).max() > threshold:
+            continue
+        if kept and (np.vstack(kept) @ vector).max() > threshold:
+            continue
+        kept.append(vector)
+    return kept
+
+
+def _as_matrix(vectors, dim):
+    return np.vstack(vectors).astype(np.float32) if vectors else _empty(dim)
+
+
+def _stack(a, b):
+    if len(a) == 0:
+        return np.asarray(b, dtype=np.float32)
+    if len(b) == 0:
+        return a
+    return np.vstack([a, b]).astype(np.float32, copy=False)
+
+
+class UserLibrary:
+    def __init__(self, store, conn, username, person_method=None):
+        self.store = store
+        self.conn = conn
+        self.username = username
+        self.photos = []        # {"url", "filename", "hash", "faces", "burst"}, index = photo id
+        self.events = []        # {"photos": [photo ids], "prototypes": (k, D) face set}
+        self.extras = []        # photo ids
+        self.person_counts = []
+        self.person_sums = _empty()     # per person, sum of its faces (normalize before comparing)
+        self.person_covers = []     # (photo id, face idx) or None per person
+        self.dim = 0            # of the clustering space (reduced vectors when enabled)
+        self.photos_at_recluster = 0
+        self._pending = []      # (first photo id, photo dicts, faces) not yet written
+        self._labels = []       # (photo id, face idx, person, pinned) not yet written
+        self.unlabeled = False  # stored faces without a person (library older than the index)
+        self._changed = None    # rows save() writes (store.save_clusters), None = all of them
+        self.person_method = person_method     # person_clustering engine, None = default
+        self.reducer = reduction.get_reducer()
+        self.person_threshold, self.match_threshold = self.thresholds = reduction.thresholds()
+
+    # --- PERSISTENCE ---
+
+    @classmethod
+    def load(cls, store, conn, username, person_method=None):
+        """Load inside a store.transaction() so the later save() is atomic with it"""
+        lib = cls(store, conn, username, person_method)
+        state = store.load_library(conn, username)
+        lib.photos = state["photos"]
+        lib.events = state["events"]
+        lib.extras = state["extras"]
+        lib.person_counts = state["person_counts"]
+        lib.person_sums = state["person_sums"]
+        lib.person_covers = state["person_covers"]
+        lib.unlabeled = state["unlabeled"]
+        lib.dim = state["dim"]
+        lib.photos_at_recluster = state["photos_at_recluster"]
+        lib._changed = {"events": set(), "persons": set(), "extras_from": len(lib.extras)}
+        return lib
+
+    def _touch(self, events=(), persons=(), extras_from=None):
+        """Mark rows to write on save (nothing to track once everything is rewritten)"""
+        if self._changed is None:
+            return
+        self._changed["events"].update(events)
+        self._changed["persons"].update(persons)
+        if extras_from is not None:
+            self._changed["extras_from"] = min(self._changed["extras_from"], extras_from)
+
+    def save(self):
+        for first_id, photos, faces in self._pending:
+            self.store.add_photos(self.conn, self.username, first_id, photos, faces)
+        self._pending = []
+        self.store.set_face_persons(self.conn, self.username, self._labels)
+        self._labels = []
+        self.store.save_clusters(
+            self.conn, self.username, self.events, self.extras,
+            self.person_sums, self.person_counts, self.photos_at_recluster, self.dim, self.person_covers,
+            self._changed,
+        )
+        self._changed = {"events": set(), "persons": set(), "extras_from": len(self.extras)}
+
+    def load_embeddings(self):
+        """Every face of the library (stored + not yet saved) in the clustering space, in photo order"""
+        stored = self.store.load_embeddings(self.conn, self.username, self.reducer)
+        parts = [stored] if len(stored) else []
+        for _, _, faces in self._pending:
+            # pending faces are (raw, location, reduced or None)
+            parts.extend(np.asarray([raw if reduced is None else reduced for raw, _, reduced in photo_faces],
+                                    dtype=np.float32).reshape(len(photo_faces), -1)
+                         for photo_faces in faces if photo_faces)
+        return np.vstack(parts).astype(np.float32, copy=False) if parts else _empty()
+
+    # --- OUTPUT ---
+
+    def user_data(self):
+        """Same shape /photos/{username} has always returned"""
+        return {
+            "clusters": {
+                f"Event_{i+1}": [self.photos[p]["url"] for p in event["photos"]]
+                for i, event in enumerate(self.events)
+            },
+            "extras": [self.photos[p]["url"] for p in self.extras],
+            "bursts": self._bursts(),
+        }
+
+    def _bursts(self):
+        groups = {}
+        for photo in self.photos:
+            if photo.get("burst") is not None:
+                groups.setdefault(photo["burst"], []).append(photo["url"])
+        return [[self.photos[rep]["url"], *urls] for rep, urls in groups.items()]
+
+    # --- INGEST ---
+
+    def add_photos(self, records):
+        """
+        Add processed upload records ({"url", "filename", "faces", "hash",
+        "width", "height", "burst", "taken_at", "lat", "lon"}).
+        Files already in the library (same content hash) are skipped. A
+        record's "burst" is its representative's content hash; the photo
+        then follows the representative into its event.
+        """
+        ids = {p["hash"]: i for i, p in enumerate(self.photos) if p.get("hash")}
+        new = []
+        for record in records:
+            if record.get("hash") is None or record["hash"] not in ids:
+                if record.get("hash"):
+                    ids[record["hash"]] = len(self.photos) + len(new)
+                new.append(record)
+        if not new:
+            print("✓ All photos already in library\n")
+            return
+
+        raw_fm = sim.FaceMatrix.from_photos(new)
+        new_fm = reduction.face_matrix(new) if self.reducer is not None else raw_fm
+        # a library clustered in another space (reduction switched on/off) needs a full recluster
+        switched = bool(new_fm.num_faces and self.dim and new_fm.matrix.shape[1] != self.dim)
+        if new_fm.num_faces:
+            self.dim = new_fm.matrix.shape[1]
+
+        first_id = len(self.photos)
+        photos = []
+        faces = []
+        for i, record in enumerate(new):
+            photos.append({
+                "url": record["url"],
+                "filename": record["filename"],
+                "hash": record.get("hash"),
+                "faces": new_fm.count(i),
+                "width": record.get("width"),
+                "height": record.get("height"),
+                "burst": self._burst_of(ids.get(record.get("burst") or ""), photos),
+                "taken_at": record.get("taken_at"),
+                "lat": record.get("lat"),
+                "lon": record.get("lon"),
+            })
+            locations = record.get("locations") or [{}] * new_fm.count(i)
+            reduced = new_fm.matrix[new_fm.rows(i)] if self.reducer is not None else [None] * new_fm.count(i)
+            faces.append(list(zip(raw_fm.matrix[raw_fm.rows(i)], locations, reduced)))
+        self.photos.extend(photos)
+        self._pending.append((first_id, photos, faces))
+
+        drift = len(self.photos) - self.photos_at_recluster
+        if (switched or self.unlabeled or self.photos_at_recluster == 0
+                or drift > RECLUSTER_DRIFT_RATIO * self.photos_at_recluster):
+            self.recluster()
+        else:
+            self._add_incremental(first_id, new, new_fm)
+            self._attach_bursts(range(first_id, len(self.photos)))
+
+    def _burst_of(self, rep_id, batch):
+        """Photo id of the burst representative (never a member itself), None if there is none"""
+        first_id = len(self.photos)
+        if rep_id is None or rep_id >= first_id + len(batch):
+            return None
+        rep = self.photos[rep_id] if rep_id < first_id else batch[rep_id - first_id]
+        return rep["burst"] if rep.get("burst") is not None else rep_id
+
+    def _attach_bursts(self, photo_ids):
+        """
+        Burst members share their representative's event: move the given
+        photos that are members right after it (in its event, or extras)
+        """
+        members = {}
+        for pid in photo_ids:
+            rep = self.photos[pid].get("burst")
+            if rep is not None:
+                members.setdefault(rep, []).append(pid)
+        if not members:
+            return
+        placed = set(self.extras).union(*(e["photos"] for e in self.events))
+        moving = {m for rep, ms in members.items() if rep in placed for m in ms}
+
+        def attach(ids):
+            out = []
+            for pid in ids:
+                if pid in moving:
+                    continue
+                out.append(pid)
+                out.extend(members.get(pid, ()))
+            return out
+
+        for pos, event in enumerate(self.events):
+            photos = attach(event["photos"])
+            if photos != event["photos"]:
+                event["photos"] = photos
+                self._touch(events=[pos])
+        extras = attach(self.extras)
+        if extras != self.extras:
+            self._touch(extras_from=next((i for i, (a, b) in enumerate(zip(extras, self.extras)) if a != b),
+                                         min(len(extras), len(self.extras))))
+            self.extras = extras
+        emptied = [pos for pos, event in enumerate(self.events) if not event["photos"]]
+        if emptied:
+            self.events = [e for e in self.events if e["photos"]]
+            self._touch(events=range(emptied[0], len(self.events)))
+
+    def recluster(self):
+        """Full batch clustering over every photo in the library"""
+        print(f"🔄 Full recluster of {len(self.photos)} photos for {self.username}")
+        self._changed = None
+        counts = [p["faces"] for p in self.photos]
+        fm = sim.FaceMatrix.from_arrays(self.load_embeddings(), counts, self.thresholds)
+        if fm.num_faces:
+            self.dim = fm.matrix.shape[1]
+
+        events, extras = clustering.cluster_photos(self.photos, fm, method=self.person_method)
+
+        dim = self.dim
+        self.events = [
+            {"photos": list(event["photos"]), "prototypes": _as_matrix(_dedupe(fm.matrix[fm.rows_of(event["photos"])], threshold=self.match_threshold), dim)}
+            for event in events
+        ]
+        self.extras = list(extras)
+        self._attach_bursts(range(len(self.photos)))
+
+        # Person centroids from the same grouping as the primary person search
+        if fm.num_faces:
+            self._relabel_persons(fm, person_clustering.cluster_persons(fm, self.person_method))
+        else:
+            self.person_sums, self.person_counts, self.person_covers = _empty(dim), [], []
+        self.unlabeled = False
+
+        self.photos_at_recluster = len(self.photos)
+        clustering.print_results(self.photos, self.events, self.extras)
+
+    # --- PEOPLE ---
+
+    def _relabel_persons(self, fm, clusters):
+        """
+        Store a person for every face after a recluster, keeping ids stable:
+        each new group takes the old id most of its faces had (biggest
+        overlaps first, every id once), other groups get new ids. Faces
+        merged or split by hand (pinned) keep their person.
+        """
+        previous, pinned = self.store.face_persons(self.conn, self.username)
+        # faces not saved yet come last and have no person
+        missing = fm.num_faces - len(previous)
+        previous = np.concatenate([previous, np.full(missing, -1, dtype=np.int64)])
+        pinned = np.concatenate([pinned, np.zeros(missing, dtype=bool)])
+
+        overlaps = []
+        for c, rows in enumerate(clusters):
+            old = previous[rows][~pinned[rows]]
+            ids, counts = np.unique(old[old >= 0], return_counts=True)
+            overlaps.extend((int(n), c, int(i)) for i, n in zip(ids, counts))
+        assigned, taken = {}, set()
+        for _, c, old in sorted(overlaps, key=lambda o: (-o[0], o[1])):
+            if c not in assigned and old not in taken:
+                assigned[c] = old
+                taken.add(old)
+        # never reuse an id: clients may still hold it
+        next_id = max(len(self.person_counts), int(previous.max(initial=-1)) + 1)
+        labels = np.empty(fm.num_faces, dtype=np.int64)
+        for c, rows in enumerate(clusters):
+            if c not in assigned:
+                assigned[c], next_id = next_id, next_id + 1
+            labels[rows] = assigned[c]
+        labels[pinned] = previous[pinned]
+
+        count = int(labels.max()) + 1
+        self.person_sums = person_clustering._sum_by_label(labels, fm.matrix, count)
+        self.person_counts = np.bincount(labels, minlength=count).tolist()
+
+        # cover: the face closest to its person's centroid
+        face_to_photo = fm.face_to_photo()
+        keys = [(int(p), int(r - fm.offsets[p])) for r, p in enumerate(face_to_photo)]
+        closeness = (fm.matrix * person_clustering._normalized(self.person_sums)[labels]).sum(axis=1)
+        self.person_covers = [None] * count
+        for r in np.lexsort((-closeness, labels)):
+            if self.person_covers[labels[r]] is None:
+                self.person_covers[labels[r]] = keys[r]
+        self._labels = [(*key, int(person), bool(pin)) for key, person, pin in zip(keys, labels, pinned)]
+
+    def _person_exists(self, person):
+        if self.unlabeled:
+            raise ValueError("faces stored before the person index have no person yet, recluster first")
+        return 0 <= person < len(self.person_counts) and self.person_counts[person] > 0
+
+    def merge_persons(self, into, others):
+        """
+        Move every face of `others` to `into` (ids of non-empty persons).
+        All their faces get pinned, so a recluster does not undo the merge.
+        Returns the merged person's face count.
+        """
+        others = sorted(set(others) - {into})
+        if not others or not all(self._person_exists(p) for p in [into, *others]):
+            raise ValueError("merge needs existing, different persons")
+        self.person_sums[into] += self.person_sums[others].sum(axis=0)
+        self.person_sums[others] = 0
+        for person in others:
+            self.person_counts[into] += self.person_counts[person]
+            self.person_counts[person] = 0
+            self.person_covers[person] = None
+        self._touch(persons=[into, *others])
+        for person in [into, *others]:
+            self._labels.extend((photo_id, face_idx, into, True) for photo_id, face_idx in
+                                self.store.person_faces(self.conn, self.username, person))
+        return self.person_counts[into]
+
+    def split_person(self, person, photo_ids):
+        """
+        Move the person's faces on the given photos to a new person (pinned
+        there). Returns (new person id, faces moved).
+        """
+        if not self._person_exists(person):
+            raise ValueError("unknown person")
+        moved = [tuple(key) for key in self.store.person_faces(self.conn, self.username, person, photo_ids)]
+        if not moved:
+            raise ValueError("the person is on none of these photos")
+        if len(moved) >= self.person_counts[person]:
+            raise ValueError("a split has to leave some faces with the person")
+        vectors = self.store.face_vectors(self.conn, self.username, moved, self.reducer)
+        new = len(self.person_counts)
+        moved_sum = vectors.sum(axis=0)
+        self.person_sums[person] -= moved_sum
+        self.person_sums = _stack(self.person_sums, moved_sum[None, :])
+        self.person_counts[person] -= len(moved)
+        self.person_counts.append(len(moved))
+        self.person_covers.append(moved[0])
+        if self.person_covers[person] in moved:
+            self.person_covers[person] = next(
+                key for key in self.store.person_faces(self.conn, self.username, person) if key not in moved
+            )
+        self._labels.extend((photo_id, face_idx, new, True) for photo_id, face_idx in moved)
+        self._touch(persons=[person, new])
+        return new, len(moved)
+
+    def _extend_prototypes(self, event, vectors):
+        """Add faces that are not already represented in the event's face set"""
+        kept = _dedupe(vectors, event["prototypes"], self.match_threshold)
+        if kept:
+            event["prototypes"] = _stack(event["prototypes"], np.vstack(kept))
+
+    def _update_persons(self, vectors):
+        """
+        Assign faces to the nearest person centroid (or a new person), returns
+        person ids. The batch is matched against the centroids as they were
+        before it in one product; faces matching nobody are grouped among
+        themselves into new persons.
+        """
+        labels = np.full(len(vectors), -1, dtype=np.int64)
+        first = len(self.person_counts)
+        if first and len(vectors):
+            sims = vectors @ person_clustering._normalized(self.person_sums).T
+            best = np.argmax(sims, axis=1)
+            matched = sims[np.arange(len(vectors)), best] > self.person_threshold
+            labels[matched] = best[matched]
+
+        unmatched = np.flatnonzero(labels < 0)
+        new_sums = np.zeros((len(unmatched), vectors.shape[1]), dtype=np.float32)
+        new_centroids = np.zeros_like(new_sums)
+        num_new = 0
+        for row in unmatched:
+            vector = vectors[row]
+            if num_new:
+                sims = new_centroids[:num_new] @ vector
+                best = int(np.argmax(sims))
+                if sims[best] > self.person_threshold:
+                    new_sums[best] += vector
+                    new_centroids[best] = new_sums[best] / (np.linalg.norm(new_sums[best]) + 1e-10)
+                    labels[row] = first + best
+                    continue
+            new_sums[num_new] = new_centroids[num_new] = vector
+            labels[row] = first + num_new
+            num_new += 1
+
+        # one sum and one stack for the whole batch
+        known = labels < first
+        if known.any():
+            self.person_sums += person_clustering._sum_by_label(labels[known], vectors[known], first)
+        self.person_sums = _stack(self.person_sums, new_sums[:num_new])
+        added = np.bincount(labels, minlength=first + num_new)
+        self.person_counts = [int(n) for n in np.asarray(self.person_counts + [0] * num_new) + added]
+        self.person_covers.extend([None] * num_new)
+        self._touch(persons=np.unique(labels).tolist())
+        return labels.tolist()
+
+    def _event_candidates(self, new):
+        """
+        With clustering.EVENT_TIME_GAP_HOURS set: per new photo, the events
+        whose capture time span comes within the gap of it (events without
+        dated photos and photos without a capture time match everything).
+        None when windows are off.
+        """
+        gap = clustering.EVENT_TIME_GAP_HOURS * 3600
+        if not gap:
+            return None
+        spans = []
+        for event in self.events:
+            times = [self.photos[p]["taken_at"] for p in event["photos"] if self.photos[p].get("taken_at") is not None]
+            spans.append((min(times) - gap, max(times) + gap) if times else None)
+        return [
+            {e for e, span in enumerate(spans) if span is None or taken_at is None or span[0] <= taken_at <= span[1]}
+            for taken_at in (record.get("taken_at") for record in new)
+        ]
+
+    def _add_incremental(self, first_id, new, new_fm):
+        print(f"➕ Incremental add of {len(new)} photos to {len(self.events)} events")
+        person_ids = np.array(self._update_persons(new_fm.matrix), dtype=np.int64)
+        primary = int(np.argmax(self.person_counts)) if self.person_counts else None
+        for i in range(len(new)):
+            for j, row in enumerate(new_fm.rows(i)):
+                person = int(person_ids[row])
+                self._labels.append((first_id + i, j, person, False))
+                if self.person_covers[person] is None:
+                    self.person_covers[person] = (first_id + i, j)
+
+        # Time windows: per new photo, the events it may join (None = all of them)
+        allowed = self._event_candidates(new)
+        candidates = list(range(len(self.events))) if allowed is None else sorted(set().union(*allowed))
+
+        # One small matrix: new faces followed by every candidate event's face set
+        num_new = new_fm.num_faces
+        sizes = [len(self.events[e]["prototypes"]) for e in candidates]
+        prototypes = [self.events[e]["prototypes"] for e in candidates if len(self.events[e]["prototypes"])]
+        combined = sim.FaceMatrix.from_arrays(
+            _stack(new_fm.matrix, np.vstack(prototypes) if prototypes else _empty()), [num_new] + sizes,
+            self.thresholds,
+        )
+        photo_rows = [new_fm.rows(i) for i in range(len(new))]
+        proto_rows = [combined.rows(1 + pos) for pos in range(len(candidates))]
+
+        # STEP 4 rule against the existing events
+        event_shared = sim.shared_counts(combined, photo_rows, proto_rows)
+        unmatched = []
+        for i, record in enumerate(new):
+            num_faces = new_fm.count(i)
+            for pos, event_pos in enumerate(candidates):
+                if allowed is not None and event_pos not in allowed[i]:
+                    continue
+                event = self.events[event_pos]
+                shared = int(event_shared[i, pos])
+                if num_faces > 0 and shared / num_faces >= clustering.EXTRA_SHARED_RATIO:
+                    event["photos"].append(first_id + i)
+                    self._extend_prototypes(event, new_fm.matrix[photo_rows[i]])
+                    self._touch(events=[event_pos])
+                    print(f"✓ {record['filename']} matched to Event_{event_pos+1} (shared people: {shared})")
+                    break
+            else:
+                unmatched.append(i)
+
+        # STEP 3 rule among the leftovers that contain the primary person (same time window)
+        dated, _ = clustering.time_windows(new)
+        window = {i: w for w, members in enumerate(dated) for i in members}
+
+        def same_window(a, b):
+            return window.get(a) is None or window.get(b) is None or window[a] == window[b]
+
+        with_primary = [i for i in unmatched if primary is not None and (person_ids[photo_rows[i]] == primary).any()]
+        pair_shared = sim.shared_counts(new_fm, [photo_rows[i] for i in with_primary], [photo_rows[i] for i in with_primary])
+
+        new_events = []
+        used = set()
+        for ref_pos, ref in enumerate(with_primary):
+            if ref in used:
+                continue
+            event = {"photos": [first_id + ref], "prototypes": _empty(self.dim)}
+            event_faces = list(photo_rows[ref])
+            used.add(ref)
+            for other_pos, other in enumerate(with_primary):
+                if other in used or not same_window(ref, other):
+                    continue
+                min_people = min(new_fm.count(ref), new_fm.count(other))
+                shared = int(pair_shared[ref_pos, other_pos])
+                if min_people > 0 and shared / min_people >= clustering.EVENT_SHARED_RATIO:
+                    event["photos"].append(first_id + other)
+                    event_faces.extend(photo_rows[other])
+                    used.add(other)
+            new_events.append((event, event_faces, ref))
+
+        # STEP 4 rule for the rest, against the events just created
+        rest = [i for i in unmatched if i not in used]
+        rest_shared = sim.shared_counts(new_fm, [photo_rows[i] for i in rest], [faces for _, faces, _ in new_events])
+        for pos, i in enumerate(rest):
+            num_faces = new_fm.count(i)
+            for event_pos, (event, _, ref) in enumerate(new_events):
+                if not same_window(i, ref):
+                    continue
+                if num_faces > 0 and rest_shared[pos, event_pos] / num_faces >= clustering.EXTRA_SHARED_RATIO:
+                    event["photos"].append(first_id + i)
+                    break
+            else:
+                self.extras.append(first_id + i)
+                print(f"→ {new[i]['filename']} moved to extras")
+
+        for event, _, _ in new_events:
+            rows = np.concatenate([new_fm.rows(p - first_id) for p in event["photos"]])
+            self._extend_prototypes(event, new_fm.matrix[rows])
+            self.events.append(event)
+            self._touch(events=[len(self.events) - 1])
+            print(f"✓ New Event_{len(self.events)} with {len(event['photos'])} photos")
+        print()
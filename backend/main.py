@@ -6,27 +6,45 @@ Logic:
 2. Group photos with primary person together
 3. Split ONLY when clearly different people appear
 4. No time-based logic (causes incorrect splits)
+
+Clustering steps live in clustering.py; library.py adds new uploads to a
+user's existing events incrementally.
 """
 
-from fastapi import FastAPI, UploadFile, File, Form, Body, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, Body, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, FileResponse, Response, PlainTextResponse
 from typing import List
 import uvicorn
 import os
 import json
-import numpy as np
-import cv2
+import hashlib
 import cloudinary
-import cloudinary.uploader
-from datetime import datetime, timedelta
+from datetime import datetime, timezone
 from dotenv import load_dotenv
-from PIL import Image, ExifTags
-import pillow_heif
-import io
+import asyncio
+import shutil
+import uuid
 
-import ml_engine as ml
+load_dotenv()  # before the local modules, they read their config at import
 
-load_dotenv()
+import ml_engine as ml
+from library import UserLibrary
+from ingest import IngestPipeline
+from storage import get_storage
+from embedding_cache import get_cache
+from store import get_store
+from jobs import JobRegistry
+from upload_queue import LeaseLost, get_queue
+from spool import SPOOL_DIR, spool_upload
+from photo_cache import StaleCursor, accepted_encoding, compress, get_photo_cache, to_json, COMPRESS_MIN_BYTES
+import album_export
+import derivatives
+import layout_engine
+import metrics
+import person_clustering
+import clustering
+import reduction
 
 app = FastAPI()
 
@@ -45,272 +63,529 @@ cloudinary.config(
     secure=True
 )
 
-DB_PHOTOS = "database.json"
-DB_USERS = "users.json"
+# Provisional clusters are streamed to upload jobs after at least this many
+# new photos, and at most once per PARTIAL_SECONDS
+PARTIAL_EVERY = int(os.getenv("PARTIAL_EVERY", 5))
+PARTIAL_SECONDS = float(os.getenv("PARTIAL_SECONDS", 2))
 
-def save_json(filename, data):
-    with open(filename, "w") as f:
-        json.dump(data, f, indent=4)
+# /upload-photos/ in queue mode gives up waiting for the worker after this
+# long; the job keeps running and can be followed at /upload-jobs/{id}
+QUEUE_WAIT_SECONDS = float(os.getenv("QUEUE_WAIT_SECONDS", 600))
 
-def load_json(filename):
-    if not os.path.exists(filename):
-        return {} if filename == DB_PHOTOS else []
-    with open(filename, "r") as f:
-        try:
-            data = json.load(f)
-            return data if data else ({} if filename == DB_PHOTOS else [])
-        except:
-            return {} if filename == DB_PHOTOS else []
-
-def cosine_sim(v1, v2):
-    v1, v2 = np.array(v1), np.array(v2)
-    return np.dot(v1, v2) / (np.linalg.norm(v1) * np.linalg.norm(v2) + 1e-10)
-
-def face_matches(face1, face2, threshold=0.60):
-    return cosine_sim(face1, face2) > threshold
-
-def find_primary_person(all_photos):
-    """Find the person appearing most frequently"""
-    all_faces = []
-    face_to_photo = []
-    
-    for idx, photo in enumerate(all_photos):
-        for face in photo["faces"]:
-            all_faces.append(face)
-            face_to_photo.append(idx)
-    
-    if not all_faces:
-        return None, set()
-    
-    # Simple clustering: pick first face, find all similar faces
-    clusters = []
-    used = set()
-    
-    for i, face1 in enumerate(all_faces):
-        if i in used:
-            continue
-        
-        cluster = [i]
-        used.add(i)
-        
-        for j, face2 in enumerate(all_faces):
-            if j in used:
-                continue
-            if face_matches(face1, face2, threshold=0.58):
-                cluster.append(j)
-                used.add(j)
-        
-        clusters.append(cluster)
-    
-    # Find largest cluster
-    primary_cluster = max(clusters, key=len)
-    primary_faces = [all_faces[i] for i in primary_cluster]
-    primary_photos = set(face_to_photo[i] for i in primary_cluster)
-    
-    return primary_faces, primary_photos
-
-def photo_has_person(photo_faces, person_faces, threshold=0.60):
-    """Check if photo contains a specific person"""
-    for photo_face in photo_faces:
-        for person_face in person_faces:
-            if face_matches(photo_face, person_face, threshold):
-                return True
-    return False
-
-def get_shared_people(photo1_faces, photo2_faces, threshold=0.60):
-    """Count how many people appear in both photos"""
-    matches = 0
-    for face1 in photo1_faces:
-        for face2 in photo2_faces:
-            if face_matches(face1, face2, threshold):
-                matches += 1
-                break
-    return matches
+_pipeline = None
+jobs = JobRegistry()
+
+def get_pipeline():
+    """Ingest pools are created on first use and reused across uploads"""
+    global _pipeline
+    if _pipeline is None:
+        _pipeline = IngestPipeline(get_storage(), cache=get_cache())
+    return _pipeline
+
+@app.on_event("startup")
+async def warm_models():
+    """Spawn the ingest workers and load the face models before the first upload"""
+    if os.getenv("WARMUP_ON_STARTUP", "1") != "1":
+        return
+    if get_queue() is not None:
+        print("📮 UPLOAD_QUEUE=sqlite: uploads are queued, models load in the workers (python worker.py)")
+        return
+    for stats in await get_pipeline().warm():
+        print(f"🔥 Worker {stats['pid']}: models ready in {stats['cold_start']:.1f}s, "
+              f"{stats['per_image']*1000:.0f} ms/image ({stats['policy']}: {', '.join(stats['backends'])})")
+
+@app.on_event("shutdown")
+def shutdown_pipeline():
+    if _pipeline is not None:
+        _pipeline.shutdown()
+    if album_export._exporter is not None:
+        album_export._exporter.shutdown()
 
 @app.post("/signup/")
-async def signup(user: dict = Body(...)):
-    users = load_json(DB_USERS)
-    users.append(user)
-    save_json(DB_USERS, users)
+def signup(user: dict = Body(...)):
+    if not get_store().add_user(user):
+        raise HTTPException(status_code=400, detail="Username already exists")
     return {"status": "success"}
 
 @app.post("/login/")
-async def login(credentials: dict = Body(...)):
-    users = load_json(DB_USERS)
-    for user in users:
-        if user.get('username') == credentials.get('username') and user.get('password') == credentials.get('password'):
-            return {"status": "success", "user": user['username']}
+def login(credentials: dict = Body(...)):
+    user = get_store().get_user(credentials.get('username'))
+    if user and user.get('password') == credentials.get('password'):
+        return {"status": "success", "user": user['username']}
     raise HTTPException(status_code=401, detail="Invalid credentials")
 
+def person_method(method):
+    """Validate the optional `clustering_method` form field (None = PERSON_CLUSTERING)"""
+    if method and method not in person_clustering.METHODS:
+        raise HTTPException(status_code=400, detail=f"clustering_method must be one of {', '.join(person_clustering.METHODS)}")
+    return method or None
+
+@metrics.profiled("cluster")
+def add_to_library(username, processed, method=None):
+    """STEP 2-4: add to the user's library (incremental, or a full recluster)"""
+    store = get_store()
+    with metrics.span("cluster"), store.transaction() as conn:
+        lib = UserLibrary.load(store, conn, username, method)
+        lib.add_photos(processed)
+        lib.save()
+        user_data = lib.user_data()
+    get_photo_cache().invalidate(username)
+    return user_data
+
 @app.post("/upload-photos/")
-async def upload_photos(files: List[UploadFile] = File(...), username: str = Form(...)):
+async def upload_photos(files: List[UploadFile] = File(...), username: str = Form(...),
+                        clustering_method: str = Form(None)):
+    method = person_method(clustering_method)
     print(f"\n{'='*80}")
     print(f"📸 SIMPLE CLUSTERING - {len(files)} files")
     print(f"{'='*80}\n")
     
-    processed = []
-    
     # STEP 1: Process all photos
     print("STEP 1: Processing photos...\n")
     
-    for idx, file in enumerate(files):
+    with metrics.span("request"):
+        metrics.UPLOAD_PHOTOS.observe(len(files))
+        if get_queue() is not None:
+            items = await spool_files(files, get_queue().spool_dir, content_addressed=True)
+            return await wait_for_queued_upload(username, items, method)
+
+        # Uploads go to disk in chunks, decode/detect/upload run in the ingest pools
+        spool_dir = request_spool_dir()
         try:
-            file_bytes = await file.read()
-            
-            if file.filename.lower().endswith(".heic"):
-                heif_file = pillow_heif.read_heif(file_bytes)
-                image = Image.frombytes(heif_file.mode, heif_file.size, heif_file.data, "raw")
-            else:
-                image = Image.open(io.BytesIO(file_bytes))
-            
-            img_rgb = image.convert("RGB")
-            img_np = cv2.cvtColor(np.array(img_rgb), cv2.COLOR_RGB2BGR)
-            
-            # Get faces
-            face_data = ml.get_face_embeddings(img_np)
-            faces = [f["embedding"] for f in face_data]
-            
-            # Upload
-            buf = io.BytesIO()
-            img_rgb.save(buf, format="JPEG")
-            buf.seek(0)
-            res = cloudinary.uploader.upload(buf.getvalue(), folder="memorymap")
-            
-            processed.append({
-                "url": res.get("secure_url"),
-                "filename": file.filename,
-                "faces": faces
-            })
-            
-            print(f"[{idx+1}/{len(files)}] {file.filename} - {len(faces)} face(s)")
-            
-        except Exception as e:
-            print(f"[{idx+1}/{len(files)}] ❌ {file.filename}: {e}")
-    
-    if not processed:
-        return {"status": "error", "message": "No photos processed"}
-    
-    print(f"\n{'='*80}")
-    print("STEP 2: Finding primary person...\n")
-    
-    primary_faces, primary_photo_indices = find_primary_person(processed)
-    
-    if not primary_faces:
-        print("⚠️ No faces detected - all photos go to extras\n")
-        return {
-            "status": "success",
-            "data": {
-                "clusters": {},
-                "extras": [p["url"] for p in processed]
-            }
-        }
-    
-    print(f"✓ Primary person found in {len(primary_photo_indices)} photos")
-    print(f"✓ Primary person has {len(primary_faces)} face samples\n")
-    
-    # STEP 3: Group photos with primary person
-    print(f"{'='*80}")
-    print("STEP 3: Creating events...\n")
-    
-    events = []
-    used_indices = set()
-    
-    for ref_idx in sorted(primary_photo_indices):
-        if ref_idx in used_indices:
-            continue
-        
-        ref_photo = processed[ref_idx]
-        
-        # Start new event
-        event = {
-            "photos": [ref_photo["url"]],
-            "filenames": [ref_photo["filename"]],
-            "all_faces": ref_photo["faces"].copy()
-        }
-        used_indices.add(ref_idx)
+            items = await spool_files(files, spool_dir)
+            processed = await get_pipeline().run(items, username=username)
+        finally:
+            shutil.rmtree(spool_dir, ignore_errors=True)
         
-        print(f"Event {len(events)+1}: {ref_photo['filename']}")
+        if not processed:
+            return {"status": "error", "message": "No photos processed"}
         
-        # Find photos with SAME people (not just primary person)
-        for other_idx in sorted(primary_photo_indices):
-            if other_idx in used_indices:
-                continue
-            
-            other_photo = processed[other_idx]
-            
-            # Check: do these photos share the same people?
-            shared = get_shared_people(ref_photo["faces"], other_photo["faces"])
-            
-            # If at least 50% of people match, same event
-            min_people = min(len(ref_photo["faces"]), len(other_photo["faces"]))
-            if min_people > 0 and (shared / min_people) >= 0.5:
-                event["photos"].append(other_photo["url"])
-                event["filenames"].append(other_photo["filename"])
-                event["all_faces"].extend(other_photo["faces"])
-                used_indices.add(other_idx)
-                print(f"  + {other_photo['filename']} (shared: {shared}/{min_people})")
-        
-        events.append(event)
-        print()
-    
-    print(f"✓ Created {len(events)} events\n")
-    
-    # STEP 4: Handle photos without primary person
-    print(f"{'='*80}")
-    print("STEP 4: Checking photos without primary person...\n")
-    
-    extras = []
-    
-    for idx, photo in enumerate(processed):
-        if idx in used_indices:
-            continue
-        
-        # Try to match to existing event by checking for shared people
-        matched = False
-        
-        for event in events:
-            shared = get_shared_people(photo["faces"], event["all_faces"])
-            
-            if len(photo["faces"]) > 0 and (shared / len(photo["faces"])) >= 0.3:
-                event["photos"].append(photo["url"])
-                event["filenames"].append(photo["filename"])
-                used_indices.add(idx)
-                matched = True
-                print(f"✓ {photo['filename']} matched to event (shared people: {shared})")
-                break
-        
-        if not matched:
-            extras.append(photo["url"])
-            print(f"→ {photo['filename']} moved to extras")
-    
-    print(f"\n{'='*80}")
-    print("🎉 FINAL RESULTS")
-    print(f"{'='*80}\n")
-    
-    for i, event in enumerate(events):
-        print(f"Event_{i+1}: {len(event['photos'])} photos")
-        for fname in event['filenames']:
-            print(f"  - {fname}")
-        print()
-    
-    if extras:
-        print(f"Extras: {len(extras)} photos\n")
+        user_data = add_to_library(username, processed, method)
     
-    user_data = {
-        "clusters": {f"Event_{i+1}": event["photos"] for i, event in enumerate(events)},
-        "extras": extras
+    return {"status": "success", "data": user_data}
+
+def request_spool_dir():
+    return os.path.join(SPOOL_DIR, "requests", uuid.uuid4().hex)
+
+async def spool_files(files, directory, content_addressed=False):
+    """Stream every upload to disk -> [(filename, path, content hash)]"""
+    items = []
+    for file in files:
+        path, key = await spool_upload(file, directory, content_addressed)
+        items.append((file.filename, path, key))
+    return items
+
+async def wait_for_queued_upload(username, items, method):
+    """/upload-photos/ in queue mode: enqueue, then wait for a worker to finish the job"""
+    queue = get_queue()
+    job_id, _ = await asyncio.to_thread(queue.enqueue, username, items, method)
+    deadline = asyncio.get_running_loop().time() + QUEUE_WAIT_SECONDS
+    while True:
+        snapshot = await asyncio.to_thread(queue.snapshot, job_id)
+        if snapshot["status"] == "done":
+            return {"status": "success", "data": snapshot["result"]}
+        if snapshot["status"] == "error":
+            events = await asyncio.to_thread(queue.events_after, job_id, 0)
+            message = next((d["message"] for _, t, d in events if t == "error"), "Upload failed")
+            return {"status": "error", "message": message}
+        if asyncio.get_running_loop().time() >= deadline:
+            raise HTTPException(status_code=504, detail=f"Upload still processing, follow /upload-jobs/{job_id}")
+        await asyncio.sleep(1)
+
+# --- STREAMING UPLOAD JOBS ---
+
+@metrics.profiled("partial")
+def partial_clusters(records):
+    """Provisional events of the photos processed so far (this batch only)"""
+    events, extras = clustering.cluster_photos(records, reduction.face_matrix(records), verbose=False)
+    return {
+        "clusters": {f"Event_{i+1}": [records[p]["url"] for p in e["photos"]] for i, e in enumerate(events)},
+        "extras": [records[p]["url"] for p in extras],
     }
-    
-    db = load_json(DB_PHOTOS)
-    db[username] = user_data
-    save_json(DB_PHOTOS, db)
+
+async def run_upload_job(job, items, method=None):
+    job.status = "running"
+    loop = asyncio.get_running_loop()
+    finished = {}
+    partial = None          # task clustering the latest snapshot
+    partial_at = -PARTIAL_SECONDS
+    partial_size = 0
+
+    async def emit_partial(records):
+        # clustering is O(photos^2): a worker thread, never the event loop
+        try:
+            job.emit("partial", await asyncio.to_thread(partial_clusters, records))
+        except Exception as e:
+            print(f"⚠️ Partial clusters of job {job.id} skipped: {e}")
+
+    def on_photo(idx, filename, record):
+        nonlocal partial, partial_at, partial_size
+        if record is not None:
+            finished[idx] = record
+        job.emit("progress", {
+            "done": job.done + 1, "total": job.total, "filename": filename,
+            "ok": record is not None, "faces": len(record["faces"]) if record else 0,
+        })
+        # one at a time, throttled: photos finishing meanwhile go into the next one
+        if (len(finished) - partial_size >= PARTIAL_EVERY and job.done < job.total
+                and (partial is None or partial.done()) and loop.time() - partial_at >= PARTIAL_SECONDS):
+            partial_at, partial_size = loop.time(), len(finished)
+            partial = asyncio.create_task(emit_partial([finished[i] for i in sorted(finished)]))
+
+    try:
+        with metrics.span("request"):
+            try:
+                processed = await get_pipeline().run(items, on_photo=on_photo, username=job.username)
+            finally:
+                if partial is not None:
+                    partial.cancel()    # stale once the final result is on its way
+            if not processed:
+                job.emit("error", {"message": "No photos processed"})
+                return
+            # the library transaction is blocking SQLite work, keep it off the event loop
+            user_data = await asyncio.to_thread(add_to_library, job.username, processed, method)
+        job.emit("done", user_data)
+    except LeaseLost:
+        raise   # the job is someone else's now: no error event either
+    except Exception as e:
+        print(f"❌ Upload job {job.id} failed: {e}")
+        job.emit("error", {"message": str(e)})
+
+@app.post("/upload-jobs/")
+async def create_upload_job(files: List[UploadFile] = File(...), username: str = Form(...),
+                            clustering_method: str = Form(None)):
+    """Same as /upload-photos/, but returns a job id at once; follow it via /events"""
+    method = person_method(clustering_method)
+    metrics.UPLOAD_PHOTOS.observe(len(files))
+    queue = get_queue()
+    if queue is not None:
+        # spool + enqueue only, a worker process picks it up
+        items = await spool_files(files, queue.spool_dir, content_addressed=True)
+        job_id, created = await asyncio.to_thread(queue.enqueue, username, items, method)
+        print(f"📮 Upload job {job_id}: {len(items)} files for {username} {'queued' if created else '(already queued)'}")
+        return {"status": "accepted", "job_id": job_id, "total": len(items)}
+    spool_dir = request_spool_dir()
+    items = await spool_files(files, spool_dir)
+    job = jobs.create(username, len(items))
+    job.task = asyncio.create_task(run_upload_job(job, items, method))
+    job.task.add_done_callback(lambda _: shutil.rmtree(spool_dir, ignore_errors=True))
+    print(f"📸 Upload job {job.id}: {len(items)} files for {username}")
+    return {"status": "accepted", "job_id": job.id, "total": job.total}
+
+def find_job(job_id):
+    """In-process job, or one from the upload queue"""
+    job = jobs.get(job_id)
+    if job is None and get_queue() is not None:
+        job = get_queue().get(job_id)
+    return job
+
+@app.get("/upload-jobs/{job_id}")
+def get_upload_job(job_id: str):
+    """Current state of a job, for polling or to resume after a dropped stream"""
+    job = find_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return job.snapshot()
+
+@app.get("/upload-jobs/{job_id}/events")
+async def stream_upload_job(job_id: str, last_event_id: int = 0,
+                            last_event_id_header: str = Header(None, alias="Last-Event-ID")):
+    """
+    Server-Sent Events: progress, partial, done/error. Reconnecting browsers
+    send Last-Event-ID and only get the events they missed.
+    """
+    job = find_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    if last_event_id_header and last_event_id_header.isdigit():
+        last_event_id = int(last_event_id_header)
+    return StreamingResponse(
+        job.stream(last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post("/recluster/{username}")
+@metrics.profiled("recluster")
+def recluster(username: str, method: str = None):
+    """Full reclustering of a user's library, fixes drift from incremental adds"""
+    method = person_method(method)
+    store = get_store()
+    with store.transaction() as conn:
+        lib = UserLibrary.load(store, conn, username, method)
+        lib.recluster()
+        lib.save()
+        user_data = lib.user_data()
+    get_photo_cache().invalidate(username)
     
     return {"status": "success", "data": user_data}
 
+# --- PEOPLE ---
+
+@app.get("/people/{username}")
+def get_people(username: str):
+    """
+    Every person in the library, most faces first, with a URL of their
+    cover face crop. Ids are stable across uploads and reclusters.
+    """
+    return {"people": [
+        {"id": person, "faces": faces, "face": f"/people/{username}/{person}/face" if url else None}
+        for person, faces, url, _ in get_store().people(username)
+    ]}
+
+@app.get("/people/{username}/on-photo")
+def get_photo_people(username: str, url: str):
+    """Ids of the persons on one photo"""
+    people = get_store().photo_persons(username, url)
+    if people is None:
+        raise HTTPException(status_code=404, detail="Unknown photo")
+    return {"url": url, "people": people}
+
+@app.get("/people/{username}/{person}/photos")
+def get_person_photos(username: str, person: int, limit: int = 50, cursor: str = None):
+    """
+    Photos of one person in upload order, `limit` at a time: pass
+    "next_cursor" as `cursor` for the next page (null on the last one).
+    Served from the person index, so a page costs the same for any
+    library size.
+    """
+    if not 1 <= limit <= 500:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 500")
+    try:
+        after = int(cursor) if cursor is not None else -1
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    rows = get_store().person_photos(username, person, after, limit + 1)
+    if not rows and after < 0:
+        raise HTTPException(status_code=404, detail="Unknown person")
+    page = rows[:limit]
+    return {
+        "person": person,
+        "photos": [url for _, url in page],
+        "next_cursor": str(page[-1][0]) if len(rows) > limit else None,
+    }
+
+@app.get("/people/{username}/{person}/face")
+def get_person_face(username: str, person: int, if_none_match: str = Header(None)):
+    """Crop of the person's cover face (cached like the other derivatives)"""
+    rows = get_store().people(username, person)
+    if not rows or rows[0][2] is None:
+        raise HTTPException(status_code=404, detail="Unknown person")
+    _, _, url, location = rows[0]
+    area = json.loads(location or "{}")
+    if not all(k in area for k in ("x", "y", "w", "h")):
+        raise HTTPException(status_code=404, detail="No face location stored")
+    etag = derivatives.etag(url, derivatives.face_size(area))
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if if_none_match == etag:
+        return Response(status_code=304, headers=headers)
+    try:
+        path = derivatives.get_derivatives().face(url, area)
+    except Exception as e:
+        print(f"❌ Face crop of {url}: {e}")
+        raise HTTPException(status_code=502, detail="Original not available")
+    return FileResponse(path, media_type="image/jpeg", headers=headers)
+
+@app.post("/people/{username}/merge")
+def merge_people(username: str, body: dict = Body(...)):
+    """{"into": id, "people": [ids]}: every face of `people` becomes `into`"""
+    store = get_store()
+    with store.transaction() as conn:
+        lib = UserLibrary.load(store, conn, username)
+        try:
+            faces = lib.merge_persons(int(body["into"]), [int(p) for p in body["people"]])
+        except (KeyError, TypeError, ValueError) as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        lib.save()
+    get_photo_cache().invalidate(username)
+    return {"person": int(body["into"]), "faces": faces}
+
+@app.post("/people/{username}/{person}/split")
+def split_person(username: str, person: int, body: dict = Body(...)):
+    """{"photos": [urls]}: the person's faces on these photos become a new person"""
+    store = get_store()
+    with store.transaction() as conn:
+        lib = UserLibrary.load(store, conn, username)
+        ids = {p["url"]: i for i, p in enumerate(lib.photos)}
+        try:
+            unknown = [url for url in body["photos"] if url not in ids]
+            if unknown:
+                raise ValueError(f"unknown photos: {', '.join(unknown[:3])}")
+            new, faces = lib.split_person(person, [ids[url] for url in body["photos"]])
+        except (KeyError, TypeError, ValueError) as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        lib.save()
+    get_photo_cache().invalidate(username)
+    return {"person": new, "faces": faces}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Prometheus text format: stage timings, detector usage, photo counts"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/queue/stats")
+def queue_stats():
+    """Jobs per status, when uploads go through the queue"""
+    queue = get_queue()
+    if queue is None:
+        raise HTTPException(status_code=404, detail="UPLOAD_QUEUE is not enabled")
+    return queue.stats()
+
+@app.get("/cache/stats")
+def cache_stats():
+    return get_cache().stats()
+
+def epoch(value, name):
+    """ISO 8601 date or date-time query parameter -> epoch seconds (naive = EXIF clock time)"""
+    if value is None:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} must be an ISO 8601 date or date-time")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
 @app.get("/photos/{username}")
-def get_photos(username: str):
-    data = load_json(DB_PHOTOS)
-    return data.get(username, {"clusters": {}, "extras": []})
+def get_photos(username: str, limit: int = None, cursor: str = None, since: str = None, until: str = None,
+               if_none_match: str = Header(None), accept_encoding: str = Header(None)):
+    """
+    {"clusters", "extras", "bursts"} of a user, from the read cache
+    (photo_cache.py). bursts: near-duplicate groups, representative first.
+    With `limit`: one page of at most that many photos plus "next_cursor"
+    (pass it as `cursor` for the next page, null on the last one).
+    With `since` / `until` (ISO dates, until exclusive): only photos taken
+    in that range, found through the capture time index; photos without
+    EXIF time are left out.
+    """
+    entry = get_photo_cache().get(username)
+    encoding = accepted_encoding(accept_encoding)
+    if since is not None or until is not None:
+        if limit is not None or cursor is not None:
+            raise HTTPException(status_code=400, detail="since / until cannot be combined with limit / cursor")
+        start, end = epoch(since, "since"), epoch(until, "until")
+        etag = f'"{entry.etag[1:-1]}-{start}-{end}"'
+        if if_none_match == etag:
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+        body = to_json(entry.taken_between(get_store().photos_taken_between(username, start, end)))
+        if encoding is not None and len(body) >= COMPRESS_MIN_BYTES:
+            body = compress(body, encoding)
+        else:
+            encoding = None
+    elif limit is None:
+        etag = entry.etag
+        if if_none_match == etag:
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+        body, encoding = entry.encoded(encoding)
+    else:
+        if limit < 1:
+            raise HTTPException(status_code=400, detail="limit must be at least 1")
+        etag = f'"{entry.etag[1:-1]}-{cursor or 0}-{limit}"'
+        if if_none_match == etag:
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+        try:
+            body = to_json(entry.page(limit, cursor))
+        except StaleCursor as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        if encoding is not None and len(body) >= COMPRESS_MIN_BYTES:
+            body = compress(body, encoding)
+        else:
+            encoding = None
+
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Accept-Encoding"}
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@app.get("/layouts/{username}/{event}")
+def get_layout(username: str, event: str, page_width: int = layout_engine.LAYOUT_PAGE_WIDTH,
+               page_height: int = layout_engine.LAYOUT_PAGE_HEIGHT, row_height: int = layout_engine.LAYOUT_ROW_HEIGHT,
+               if_none_match: str = Header(None)):
+    """
+    Album pages for one event (Event_N, or "extras"): justified rows of
+    every photo at its aspect ratio, as many pages as needed. Zones are in
+    % of the page like the Editor's layouts. Memoized by photo set.
+    """
+    if min(page_width, page_height, row_height) < 1 or row_height > page_height:
+        raise HTTPException(status_code=400, detail="page_width, page_height and row_height must be positive, row_height <= page_height")
+    cache = get_photo_cache()
+    entry = cache.get(username)
+    urls = entry.data["extras"] if event == "extras" else entry.data["clusters"].get(event)
+    if urls is None:
+        raise HTTPException(status_code=404, detail="Unknown event")
+    sizes = cache.sizes(username, entry)
+    photos = [(url, layout_engine.aspect_of(*sizes.get(url, (None, None)))) for url in urls]
+    layout = layout_engine.layout_album(photos, page_width=page_width, page_height=page_height, row_height=row_height)
+
+    etag = f'"{layout["key"]}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if if_none_match == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=to_json(layout), media_type="application/json", headers=headers)
+
+@app.get("/export/{username}")
+def export_album(username: str, format: str = "pdf", dpi: int = album_export.EXPORT_DPI, page: int = None,
+                 events: str = None, if_none_match: str = Header(None)):
+    """
+    The user's album rendered on the server: every event (comma separated
+    `events` to pick some, "extras" included) laid out on A4 pages.
+    format=pdf streams the whole album as pages finish; format=jpeg
+    returns one page (`page`, 0-based).
+    """
+    if format not in ("pdf", "jpeg"):
+        raise HTTPException(status_code=400, detail="format must be pdf or jpeg")
+    if not 36 <= dpi <= album_export.EXPORT_MAX_DPI:
+        raise HTTPException(status_code=400, detail=f"dpi must be between 36 and {album_export.EXPORT_MAX_DPI}")
+    cache = get_photo_cache()
+    entry = cache.get(username)
+    names = set(events.split(",")) if events else None
+    if names and any(n != "extras" and n not in entry.data["clusters"] for n in names):
+        raise HTTPException(status_code=404, detail="Unknown event")
+    if names:  # album order, so the same pick always renders (and tags) the same
+        names = [n for n in [*entry.data["clusters"], "extras"] if n in names]
+    pages = album_export.album_pages(entry.data, cache.sizes(username, entry), names,
+                                     cache.hashes(username, entry))
+    if not pages:
+        raise HTTPException(status_code=404, detail="Nothing to export")
+    if format == "jpeg" and not 0 <= (page or 0) < len(pages):
+        raise HTTPException(status_code=404, detail=f"page must be between 0 and {len(pages) - 1}")
+
+    # the layout only changes with the photo set, so the cache version identifies the output
+    part = (page or 0) if format == "jpeg" else "all"
+    picked = hashlib.sha1(",".join(names).encode()).hexdigest()[:16] if names else "all"
+    etag = f'"{entry.etag[1:-1]}-{format}-{dpi}-{part}-{picked}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if if_none_match == etag:
+        return Response(status_code=304, headers=headers)
+    exporter = album_export.get_exporter()
+    if format == "jpeg":
+        return Response(content=exporter.jpeg(pages[page or 0], dpi), media_type="image/jpeg", headers=headers)
+    headers["Content-Disposition"] = f'attachment; filename="{username}-album.pdf"'
+    return StreamingResponse(exporter.pdf(pages, dpi), media_type="application/pdf", headers=headers)
+
+@app.get("/derivatives/{size}")
+def get_derivative(size: str, url: str, if_none_match: str = Header(None)):
+    """
+    Downscaled copy of a stored photo (size: thumb | preview), rendered on
+    first request. Use for gallery tiles instead of the full-size URL.
+    """
+    if size not in derivatives.SIZES:
+        raise HTTPException(status_code=404, detail="Unknown size")
+    # only photos we stored, so this cannot be used to fetch arbitrary URLs
+    # (nor to probe them through the ETag)
+    if not get_store().has_photo_url(url):
+        raise HTTPException(status_code=404, detail="Unknown photo")
+    etag = derivatives.etag(url, size)
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=31536000, immutable"}
+    if if_none_match == etag:
+        return Response(status_code=304, headers=headers)
+    try:
+        path = derivatives.get_derivatives().get(url, size)
+    except Exception as e:
+        print(f"❌ Derivative {size} of {url}: {e}")
+        raise HTTPException(status_code=502, detail="Original not available")
+    return FileResponse(path, media_type="image/jpeg", headers=headers)
 
 if __name__ == "__main__":
     uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=True)
\ No newline at end of file
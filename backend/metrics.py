@@ -0,0 +1,182 @@
+"""
+Upload path metrics
+===================
+Counters and histograms kept in memory and rendered in the Prometheus
+text format at GET /metrics. No client library: recording is a dict
+lookup and a few additions under a lock, cheap next to any of the stages
+it measures.
+
+Stage timings (memorymap_stage_seconds{stage=...}):
+    decode, detect, embed, encode   inside the ingest workers, per file
+                                    (embed is the file's share of its batch)
+    upload                          storage upload, per file
+    chunk                           one worker task, queueing included
+    ingest, cluster, request        per upload
+
+Worker processes cannot share these objects; they return their timings
+with each result and the server process records them (ingest.py).
+
+METRICS_SPAN_LOG=1 also prints one JSON line per file with its spans.
+
+PROFILE_SAMPLE_RATE (0-1) runs that share of the calls of @profiled
+functions under cProfile, dumped to PROFILE_DIR. The profiler sees only
+the thread (or ingest worker process) it was started in, so it wraps the
+function doing the work rather than the request; at most one call per
+process is profiled at a time.
+"""
+
+import bisect
+import cProfile
+import functools
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+SPAN_LOG = os.getenv("METRICS_SPAN_LOG", "0") == "1"
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+# Seconds; covers a cached lookup up to a slow detector cascade
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_lock = threading.Lock()
+
+
+def _label_str(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+class Counter:
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with _lock:
+            values = sorted(self.values.items())
+        for key, value in values:
+            lines.append(f"{self.name}{_label_str(key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.series = {}    # labels -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        pos = bisect.bisect_left(self.buckets, value)
+        with _lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [0] * (len(self.buckets) + 2)
+            if pos < len(self.buckets):
+                series[pos] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with _lock:
+            all_series = sorted((key, list(series)) for key, series in self.series.items())
+        for key, series in all_series:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_label_str(key + (('le', bound),))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_label_str(key + (('le', '+Inf'),))} {series[-1]}")
+            lines.append(f"{self.name}_sum{_label_str(key)} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{_label_str(key)} {series[-1]}")
+        return lines
+
+
+# --- METRICS ---
+
+STAGE_SECONDS = Histogram("memorymap_stage_seconds", "Time spent per upload stage")
+PHOTOS = Counter("memorymap_photos_total", "Photos through the ingest pipeline by outcome")
+FACES = Counter("memorymap_faces_total", "Faces detected in ingested photos")
+DETECTOR = Counter("memorymap_detector_total", "Detection runs by the backend that found faces (none = no faces)")
+DETECTOR_TRIES = Histogram("memorymap_detector_backends_tried", "Detector backends tried per photo",
+                           buckets=(1, 2, 3, 4, 5))
+UPLOAD_PHOTOS = Histogram("memorymap_upload_photos", "Photos per upload request",
+                          buckets=(1, 5, 10, 20, 50, 100, 500))
+
+ALL = [STAGE_SECONDS, PHOTOS, FACES, DETECTOR, DETECTOR_TRIES, UPLOAD_PHOTOS]
+
+
+@contextmanager
+def span(stage):
+    """Time a block into memorymap_stage_seconds{stage=...}"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+
+def record_file(filename, spans, detector=None, tried=0, faces=0, outcome="ok"):
+    """Everything measured for one ingested file"""
+    for stage, seconds in spans.items():
+        STAGE_SECONDS.observe(seconds, stage=stage)
+    PHOTOS.inc(outcome=outcome)
+    if outcome != "error":
+        FACES.inc(faces)
+    if tried:
+        DETECTOR.inc(backend=detector or "none")
+        DETECTOR_TRIES.observe(tried)
+    if SPAN_LOG:
+        print(json.dumps({"file": filename, "outcome": outcome, "faces": faces, "detector": detector,
+                          "tried": tried, "spans": {k: round(v, 4) for k, v in spans.items()}}))
+
+
+# one profiler per process: overlapping cProfile sessions would fight over the profiling hook
+_profiling = threading.Lock()
+
+
+def profiled(name):
+    """Decorator: cProfile a PROFILE_SAMPLE_RATE share of calls, in the calling thread"""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if PROFILE_SAMPLE_RATE <= 0 or random.random() >= PROFILE_SAMPLE_RATE:
+                return fn(*args, **kwargs)
+            if not _profiling.acquire(blocking=False):
+                return fn(*args, **kwargs)
+            try:
+                profiler = cProfile.Profile()
+                profiler.enable()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    profiler.disable()
+                    os.makedirs(PROFILE_DIR, exist_ok=True)
+                    path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{name}-"
+                                                     f"{os.getpid()}-{random.randrange(10**6):06d}.prof")
+                    profiler.dump_stats(path)
+                    print(f"🔬 Profile of {name} written to {path}")
+            finally:
+                _profiling.release()
+        return wrapper
+    return decorate
+
+
+def render():
+    lines = []
+    for metric in ALL:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,70 @@
+"""
+Import the old users.json / database.json files into the SQLite store.
+
+    python migrate_json.py [--users users.json] [--photos database.json]
+
+Users that already exist in the store are skipped. Legacy photos have no
+stored embeddings, so they keep their event but never match new faces;
+a full recluster moves them to extras.
+"""
+
+import argparse
+import json
+import os
+
+import numpy as np
+
+from store import get_store
+
+
+def load_json(filename, default):
+    if not os.path.exists(filename):
+        return default
+    with open(filename, "r") as f:
+        try:
+            return json.load(f) or default
+        except ValueError:
+            return default
+
+
+def migrate(users_file, photos_file):
+    store = get_store()
+
+    users = load_json(users_file, [])
+    added = sum(store.add_user(user) for user in users if user.get("username"))
+    print(f"✓ Users: {added} imported, {len(users) - added} skipped")
+
+    db = load_json(photos_file, {})
+    imported = 0
+    for username, user_data in db.items():
+        with store.transaction() as conn:
+            if conn.execute("SELECT 1 FROM photos WHERE username = ? LIMIT 1", (username,)).fetchone():
+                print(f"→ {username}: already has photos, skipped")
+                continue
+
+            photos = []
+            events = []
+            for urls in user_data.get("clusters", {}).values():
+                events.append({"photos": list(range(len(photos), len(photos) + len(urls))), "prototypes": np.zeros((0, 0), dtype=np.float32)})
+                photos.extend(urls)
+            extras = list(range(len(photos), len(photos) + len(user_data.get("extras", []))))
+            photos.extend(user_data.get("extras", []))
+
+            store.add_photos(
+                conn, username, 0,
+                [{"url": url, "filename": url.rsplit("/", 1)[-1], "hash": None, "faces": 0} for url in photos],
+                [[] for _ in photos],
+            )
+            store.save_clusters(conn, username, events, extras, None, [], len(photos), 0)
+            imported += 1
+            print(f"✓ {username}: {len(events)} events, {len(photos)} photos")
+
+    print(f"✓ Photo libraries: {imported} imported")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import JSON databases into the SQLite store")
+    parser.add_argument("--users", default="users.json")
+    parser.add_argument("--photos", default="database.json")
+    args = parser.parse_args()
+    migrate(args.users, args.photos)
@@ -1,45 +1,119 @@
-from PIL import Image, ExifTags
+import os
+import time
 import numpy as np
 import cv2
 import colorsys
-from datetime import datetime
-from deepface import DeepFace
 from sklearn.cluster import DBSCAN
 from sklearn.metrics.pairwise import cosine_similarity
 
+from embedding_cache import get_cache
+import person_clustering
+import reduction
+from similarity import FaceMatrix
+
 # --- ML CONFIG ---
 THUMBNAIL_SIZE = (100, 100)
 
-def get_face_embeddings(img_np):
-    """Detects faces and returns 128-d vectors with their locations."""
+# --- DETECTION CONFIG ---
+MODEL_NAME = "VGG-Face"
+# cascade:     try every backend in DETECTOR_CASCADE until one finds faces
+# fixed:       only ever use DETECTOR_BACKEND
+# cheap-first: try the first (cheapest) backend, escalate to the rest only
+#              when a Haar pre-check suggests there really are faces
+DETECTOR_POLICY = os.getenv("DETECTOR_POLICY", "cascade")
+DETECTOR_BACKEND = os.getenv("DETECTOR_BACKEND", "opencv")
+DETECTOR_CASCADE = os.getenv("DETECTOR_CASCADE", "opencv,ssd,retinaface").split(",")
+# Face crops per forward pass of the recognition model
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 32))
+
+# --- OUTFIT CONFIG ---
+# ROIs are area-downsampled to at most this many pixels before quantizing
+OUTFIT_MAX_PIXELS = 4096
+# Fixed palette: levels per color channel -> OUTFIT_LEVELS**3 histogram bins
+OUTFIT_LEVELS = 4
+OUTFIT_BINS = OUTFIT_LEVELS ** 3
+# histogram, then spread per channel and brightness
+OUTFIT_SIGNATURE_LEN = OUTFIT_BINS + 4
+OUTFIT_STATS_WEIGHT = 0.5
+
+# Filled by warmup(): cold-start and per-image latency of this process
+WARMUP_STATS = {}
+
+_haar_detector = None
+
+def _deepface():
+    """DeepFace (and TensorFlow) load on first use, so the clustering helpers import without them"""
+    from deepface import DeepFace
+    return DeepFace
+
+def policy_backends():
+    """Every detector backend the active policy may use"""
+    if DETECTOR_POLICY == "fixed":
+        return [DETECTOR_BACKEND]
+    return list(DETECTOR_CASCADE)
+
+def precheck_has_faces(img_np):
+    """Cheap Haar cascade on a small grayscale copy - lenient on purpose"""
+    global _haar_detector
+    if _haar_detector is None:
+        _haar_detector = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+
+    gray = cv2.cvtColor(img_np, cv2.COLOR_BGR2GRAY)
+    scale = 640 / max(gray.shape)
+    if scale < 1:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    faces = _haar_detector.detectMultiScale(gray, scaleFactor=1.2, minNeighbors=3, minSize=(20, 20))
+    return len(faces) > 0
+
+def _backends_for(img_np):
+    """Backends to try for this image, in order (lazy, so pre-checks only run if needed)"""
+    backends = policy_backends()
+    if DETECTOR_POLICY != "cheap-first":
+        yield from backends
+        return
+
+    yield backends[0]
+    if len(backends) > 1 and precheck_has_faces(img_np):
+        yield from backends[1:]
+
+def _extract(img_np, backend):
+    """Stage one for a single backend: detect + align, return confident face crops"""
+    objs = _deepface().extract_faces(
+        img_np, 
+        detector_backend=backend,
+        enforce_detection=False, 
+        align=True
+    )
+    
+    results = []
+    for obj in objs or []:
+        confidence = obj.get("confidence", 1.0)
+        if confidence > 0.5:
+            results.append({
+                "face": obj["face"],
+                "location": obj.get("facial_area", {})
+            })
+    return results
+
+def detect_faces(img_np, info=None):
+    """
+    Stage one: run the detection policy on one image.
+    Returns [{"face": aligned RGB crop in [0, 1], "location": facial_area}, ...]
+    `info`, if given, gets "backend" (the one that found faces, or None)
+    and "tried" (how many backends ran).
+    """
+    info = info if info is not None else {}
+    info.update(backend=None, tried=0)
     try:
-        # Try multiple backends for better detection
-        backends = ['opencv', 'ssd', 'retinaface']
-        
-        for backend in backends:
+        for backend in _backends_for(img_np):
+            info["tried"] += 1
             try:
-                objs = DeepFace.represent(
-                    img_np, 
-                    model_name="VGG-Face", 
-                    enforce_detection=False, 
-                    detector_backend=backend
-                )
-                
-                if objs and len(objs) > 0:
-                    results = []
-                    for obj in objs:
-                        confidence = obj.get("face_confidence", 1.0)
-                        if confidence > 0.5:
-                            embedding = obj.get("embedding", [])
-                            facial_area = obj.get("facial_area", {})
-                            results.append({
-                                "embedding": embedding,
-                                "location": facial_area
-                            })
-                    
-                    if results:
-                        print(f"    ✓ Found {len(results)} faces using {backend}")
-                        return results
+                results = _extract(img_np, backend)
+                if results:
+                    info["backend"] = backend
+                    print(f"    ✓ Found {len(results)} faces using {backend}")
+                    return results
             except:
                 continue
         
@@ -50,121 +124,257 @@ def get_face_embeddings(img_np):
         print(f"    ⚠ Error in face detection: {e}")
         return []
 
-def get_outfit_signature(img_np, face_locations=None):
+def _prepare_crop(face, target_size):
+    """RGB [0, 1] crop -> padded BGR model input, same steps DeepFace.represent takes"""
+    img = face[:, :, ::-1]
+    th, tw = target_size
+    factor = min(th / img.shape[0], tw / img.shape[1])
+    new_size = (max(1, int(img.shape[1] * factor)), max(1, int(img.shape[0] * factor)))
+    img = cv2.resize(img.astype(np.float32), new_size)
+    
+    pad_h, pad_w = th - img.shape[0], tw - img.shape[1]
+    img = np.pad(img, ((pad_h // 2, pad_h - pad_h // 2), (pad_w // 2, pad_w - pad_w // 2), (0, 0)))
+    if img.max() > 1:
+        img = img / 255
+    return img
+
+def embed_faces(crops, batch_size=EMBED_BATCH_SIZE):
     """
-    Extracts PRECISE outfit color signature from clothing region ONLY.
-    Focuses on dominant clothing colors, not background.
+    Stage two: run the recognition model over many face crops at once.
+    Returns a float32 (len(crops), D) matrix of L2-normalized embeddings.
     """
-    h, w, _ = img_np.shape
+    if not crops:
+        return np.zeros((0, 0), dtype=np.float32)
     
-    # Default to center-lower region if no face detected
-    if not face_locations or len(face_locations) == 0:
-        # Use center-torso region (avoid edges where background appears)
-        outfit_roi = img_np[int(h*0.35):int(h*0.70), int(w*0.35):int(w*0.65)]
-    else:
-        # Use face location to extract clothing BELOW face
-        face = face_locations[0]
-        
-        if isinstance(face, dict):
-            face_y = face.get('y', 0)
-            face_h = face.get('h', 0)
-            face_x = face.get('x', 0)
-            face_w = face.get('w', 0)
-            
-            # Clothing region: IMMEDIATELY below face, narrower to avoid background
-            clothing_top = min(h, face_y + face_h)
-            clothing_bottom = min(h, clothing_top + int(face_h * 1.8))  # Reduced from 2.5
-            clothing_left = max(0, int(face_x + face_w * 0.2))  # Narrower - avoid arms/background
-            clothing_right = min(w, int(face_x + face_w * 0.8))
-            
-            outfit_roi = img_np[clothing_top:clothing_bottom, clothing_left:clothing_right]
-        else:
-            outfit_roi = img_np[int(h*0.35):int(h*0.70), int(w*0.35):int(w*0.65)]
-    
-    # Validate ROI
-    if outfit_roi.size == 0 or outfit_roi.shape[0] < 10 or outfit_roi.shape[1] < 10:
-        return [0.0] * 32  # Smaller signature
-    
-    # Convert to RGB
-    outfit_rgb = cv2.cvtColor(outfit_roi, cv2.COLOR_BGR2RGB)
-    
-    # Extract 5 dominant colors using k-means
-    pixels = outfit_rgb.reshape(-1, 3)
-    pixels = np.float32(pixels)
-    
-    k = 5  # Get top 5 colors
-    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 200, 0.1)
+    client = _deepface().build_model(MODEL_NAME)
+    keras_model = getattr(client, "model", client)
+    target_size = tuple(getattr(client, "input_shape", (224, 224)))
     
+    embeddings = None
+    for start in range(0, len(crops), batch_size):
+        batch = np.stack([_prepare_crop(c, target_size) for c in crops[start:start + batch_size]])
+        out = np.asarray(keras_model(batch, training=False), dtype=np.float32)
+        if embeddings is None:
+            embeddings = np.empty((len(crops), out.shape[1]), dtype=np.float32)
+        embeddings[start:start + len(out)] = out / (np.linalg.norm(out, axis=1, keepdims=True) + 1e-10)
+    return embeddings
+
+def _embed_per_image(detections, batch_size):
+    """Embed each image's crops on its own -> (matrix, detections with None for images that failed)"""
+    parts = []
+    kept = []
+    for faces in detections:
+        try:
+            parts.append(embed_faces([d["face"] for d in faces], batch_size))
+            kept.append(faces)
+        except Exception as e:
+            print(f"    ⚠ Error in face embedding: {e}")
+            kept.append(None)
+    parts = [p for p in parts if len(p)]
+    embeddings = np.concatenate(parts) if parts else np.zeros((0, 0), dtype=np.float32)
+    return embeddings, kept
+
+def get_face_embeddings_batch(images, batch_size=EMBED_BATCH_SIZE, timings=None):
+    """
+    Detect faces in every image first, then embed all crops in batches.
+    Returns, per image, [{"embedding": row, "location": {...}}, ...] in
+    detection order; every embedding is a float32 row view of one matrix.
+    If the batch fails, each image's faces are embedded again on their own;
+    an image that still fails is None (failed, not faceless).
+    `timings`, if given, is filled with "detect" (per image: seconds,
+    backend, tried) and "embed" (seconds for all crops).
+    With an embedding reducer active every face also gets "reduced", and
+    timings "reducer" (its version).
+    """
+    timings = timings if timings is not None else {}
+    timings["detect"] = []
+    detections = []
+    for img_np in images:
+        info = {}
+        start = time.perf_counter()
+        detections.append(detect_faces(img_np, info))
+        timings["detect"].append(dict(info, seconds=time.perf_counter() - start))
+    crops = [d["face"] for faces in detections for d in faces]
+    
+    start = time.perf_counter()
     try:
-        _, labels, centers = cv2.kmeans(pixels, k, None, criteria, 10, cv2.KMEANS_PP_CENTERS)
-        
-        # Count pixels per color to get percentages
-        label_counts = np.bincount(labels.flatten())
-        
-        # Sort colors by frequency
-        sorted_indices = np.argsort(label_counts)[::-1]
-        dominant_colors = centers[sorted_indices]
-        color_percentages = label_counts[sorted_indices] / len(labels)
-        
-        # Create weighted color signature (top 3 colors matter most)
-        signature = []
-        for i in range(min(3, k)):  # Use only top 3 colors
-            color = dominant_colors[i]
-            weight = color_percentages[i]
-            
-            # Add weighted RGB values
-            signature.extend([
-                color[0] * weight,
-                color[1] * weight,
-                color[2] * weight
-            ])
-        
-        # Pad if needed
-        while len(signature) < 9:
-            signature.append(0.0)
-        
-        # Add color variance (detects patterns vs solid colors)
-        color_variance = np.std(pixels, axis=0)
-        signature.extend(color_variance.tolist())
-        
-        # Add brightness
-        brightness = np.mean(cv2.cvtColor(outfit_roi, cv2.COLOR_BGR2GRAY))
-        signature.append(brightness)
-        
-        # Normalize
-        signature = np.array(signature)
-        if np.linalg.norm(signature) > 0:
-            signature = signature / np.linalg.norm(signature)
-        
-        return signature.tolist()
-        
-    except Exception as e:
-        print(f"    Warning in outfit extraction: {e}")
-        # Fallback: simple mean color
-        mean_color = np.mean(outfit_rgb, axis=(0, 1))
-        fallback = list(mean_color) + [0.0] * 10
-        return fallback[:13]
-
-def get_image_date(image_bytes):
-    """Extract date from EXIF data"""
-    try:
-        image = Image.open(image_bytes)
-        exif_data = image._getexif()
-        if not exif_data:
-            return None
-        
-        for tag_id, value in exif_data.items():
-            tag_name = ExifTags.TAGS.get(tag_id)
-            if tag_name == "DateTimeOriginal":
-                return datetime.strptime(value, "%Y:%m:%d %H:%M:%S")
-        return None
+        embeddings = embed_faces(crops, batch_size)
     except Exception as e:
-        return None
+        print(f"    ⚠ Error in face embedding, retrying per image: {e}")
+        embeddings, detections = _embed_per_image(detections, batch_size)
+    timings["embed"] = time.perf_counter() - start
+    
+    reducer = reduction.get_reducer()
+    reduced = reducer.transform(embeddings) if reducer is not None and len(embeddings) else None
+    if reduced is not None:
+        timings["reducer"] = reducer.version
+    
+    results = []
+    pos = 0
+    for faces in detections:
+        if faces is None:
+            results.append(None)
+            continue
+        results.append([
+            {"embedding": embeddings[pos + i], "location": d["location"]}
+            for i, d in enumerate(faces)
+        ])
+        if reduced is not None:
+            for i, face in enumerate(results[-1]):
+                face["reduced"] = reduced[pos + i]
+        pos += len(faces)
+    return results
+
+def warmup(runs=3):
+    """
+    Load the recognition model and every detector of the active policy into
+    this process, then time a few passes on a synthetic image.
+    """
+    start = time.perf_counter()
+    _deepface().build_model(MODEL_NAME)
+    
+    dummy = np.full((480, 640, 3), 127, dtype=np.uint8)
+    cv2.circle(dummy, (320, 200), 80, (200, 170, 150), -1)
+    for backend in policy_backends():
+        try:
+            _extract(dummy, backend)
+        except Exception as e:
+            print(f"    ⚠ Warmup failed for {backend}: {e}")
+    embed_faces([np.full((224, 224, 3), 0.5, dtype=np.float32)])
+    cold_start = time.perf_counter() - start
+    
+    timings = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        for backend in _backends_for(dummy):
+            faces = _extract(dummy, backend)
+            if faces:
+                embed_faces([f["face"] for f in faces])
+                break
+        timings.append(time.perf_counter() - t0)
+    
+    WARMUP_STATS.update({
+        "policy": DETECTOR_POLICY,
+        "backends": policy_backends(),
+        "cold_start": cold_start,
+        "per_image": float(np.median(timings)),
+    })
+    return WARMUP_STATS
+
+def get_face_embeddings(img_np, cache_key=None):
+    """
+    Detects faces and returns VGG-Face vectors with their locations.
+    With a cache_key (content hash of the source file) the embedding cache
+    is checked before any inference and filled afterwards.
+    """
+    cache = get_cache() if cache_key else None
+    if cache is not None:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return [
+                {"embedding": embedding, "location": location}
+                for embedding, location in zip(cached["faces"], cached["locations"])
+            ]
+    
+    results = get_face_embeddings_batch([img_np])[0]
+    if results is None:
+        raise RuntimeError("Face embedding failed")
+    
+    if cache is not None:
+        cache.put(cache_key, [r["embedding"] for r in results], [r["location"] for r in results])
+    return results
 
-def cluster_faces(all_embeddings):
+def outfit_roi(img_np, face_locations=None):
+    """
+    Clothing region of a BGR image: just below the first face, or the
+    center torso when there is no face.
+    """
+    h, w = img_np.shape[:2]
+    face = face_locations[0] if face_locations else None
+    if not isinstance(face, dict):
+        # center-torso region (avoid edges where background appears)
+        return img_np[int(h*0.35):int(h*0.70), int(w*0.35):int(w*0.65)]
+
+    face_y = face.get('y', 0)
+    face_h = face.get('h', 0)
+    face_x = face.get('x', 0)
+    face_w = face.get('w', 0)
+    # Clothing region: IMMEDIATELY below face, narrower to avoid background
+    clothing_top = min(h, face_y + face_h)
+    clothing_bottom = min(h, clothing_top + int(face_h * 1.8))
+    clothing_left = max(0, int(face_x + face_w * 0.2))  # Narrower - avoid arms/background
+    clothing_right = min(w, int(face_x + face_w * 0.8))
+    return img_np[clothing_top:clothing_bottom, clothing_left:clothing_right]
+
+def _bounded_pixels(roi, max_pixels=OUTFIT_MAX_PIXELS):
+    """ROI as (n, 3) uint8 BGR pixels, area-downsampled to at most max_pixels"""
+    h, w = roi.shape[:2]
+    if h * w > max_pixels:
+        scale = (max_pixels / (h * w)) ** 0.5
+        roi = cv2.resize(roi, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+    return roi.reshape(-1, 3)
+
+def get_outfit_signatures(images, face_locations=None):
+    """
+    Outfit color signatures of many BGR images in one pass.
+    Each is a float32 vector of OUTFIT_SIGNATURE_LEN, L2-normalized:
+    a fixed-palette color histogram (OUTFIT_LEVELS per channel, square
+    rooted so cosine similarity compares distributions), then per-channel
+    spread and brightness, which tell patterns from solid colors.
+    ROIs too small to judge give an all-zero vector (matches nothing).
+    """
+    face_locations = face_locations or [None] * len(images)
+    n = len(images)
+    signatures = np.zeros((n, OUTFIT_SIGNATURE_LEN), dtype=np.float32)
+
+    parts, owners = [], []
+    for i, (img_np, faces) in enumerate(zip(images, face_locations)):
+        roi = outfit_roi(img_np, faces)
+        if roi.size == 0 or roi.shape[0] < 10 or roi.shape[1] < 10:
+            continue
+        pixels = _bounded_pixels(roi)
+        parts.append(pixels)
+        owners.append(np.full(len(pixels), i, dtype=np.int64))
+    if not parts:
+        return signatures
+
+    pixels = np.concatenate(parts)
+    owner = np.concatenate(owners)
+    counts = np.bincount(owner, minlength=n).astype(np.float32)
+    valid = counts > 0
+    per_roi = np.maximum(counts, 1)[:, None]
+
+    # palette bin of every pixel (BGR order, fixed levels per channel)
+    levels = (pixels.astype(np.int64) * OUTFIT_LEVELS) >> 8
+    bins = (levels[:, 2] * OUTFIT_LEVELS + levels[:, 1]) * OUTFIT_LEVELS + levels[:, 0]
+    hist = np.bincount(owner * OUTFIT_BINS + bins, minlength=n * OUTFIT_BINS).reshape(n, OUTFIT_BINS)
+    signatures[:, :OUTFIT_BINS] = np.sqrt(hist / per_roi)
+
+    values = pixels.astype(np.float32) / 255
+    sums = np.stack([np.bincount(owner, values[:, c], minlength=n) for c in range(3)], axis=1)
+    squares = np.stack([np.bincount(owner, values[:, c] ** 2, minlength=n) for c in range(3)], axis=1)
+    mean = sums / per_roi
+    spread = np.sqrt(np.maximum(squares / per_roi - mean ** 2, 0))
+    brightness = mean @ np.array([0.114, 0.587, 0.299], dtype=np.float32)   # BGR -> gray
+    signatures[:, OUTFIT_BINS:OUTFIT_BINS + 3] = OUTFIT_STATS_WEIGHT * spread[:, ::-1]
+    signatures[:, OUTFIT_BINS + 3] = OUTFIT_STATS_WEIGHT * brightness
+
+    norms = np.linalg.norm(signatures, axis=1, keepdims=True)
+    signatures[valid] /= np.maximum(norms[valid], 1e-10)
+    return signatures
+
+def get_outfit_signature(img_np, face_locations=None):
+    """Outfit color signature of one BGR image (see get_outfit_signatures)"""
+    return get_outfit_signatures([img_np], [face_locations])[0]
+
+def cluster_faces(all_embeddings, eps=0.35, method="dbscan"):
     """
     Cluster all face embeddings to identify unique people.
     Returns: dict mapping person_id -> list of face embedding indices
+    For reduced embeddings pass eps = 1 - reducer.thresholds["dbscan"].
+    method: "dbscan" (dense, quadratic) or a person_clustering engine
+    ("graph", "centroid", "greedy") with similarity 1 - eps; like DBSCAN's
+    noise, faces left on their own are not returned.
     """
     if len(all_embeddings) == 0:
         return {}
@@ -172,8 +382,13 @@ def cluster_faces(all_embeddings):
     # Convert to numpy array
     embeddings_array = np.array(all_embeddings)
     
+    if method != "dbscan":
+        fm = FaceMatrix([embeddings_array])
+        clusters = person_clustering.cluster_persons(fm, method, threshold=1 - eps)
+        return {label: rows.tolist() for label, rows in enumerate(c for c in clusters if len(c) > 1)}
+    
     # DBSCAN clustering with STRICTER epsilon for better person separation
-    clustering = DBSCAN(eps=0.35, min_samples=2, metric='cosine')  # Lowered from 0.4
+    clustering = DBSCAN(eps=eps, min_samples=2, metric='cosine')  # Lowered from 0.4
     labels = clustering.fit_predict(embeddings_array)
     
     # Group by person
@@ -205,6 +420,7 @@ def outfit_matches(outfit1, outfit2, threshold=0.80):
     """
     Check if two outfit signatures match.
     Uses STRICTER threshold because we're now comparing precise clothing colors.
+    Signatures are unit length (or all zero), so the dot product is the cosine.
     """
-    similarity = cosine_similarity([outfit1], [outfit2])[0][0]
+    similarity = float(np.dot(np.asarray(outfit1, dtype=np.float32), np.asarray(outfit2, dtype=np.float32)))
     return similarity > threshold
\ No newline at end of file
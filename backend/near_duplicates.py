@@ -0,0 +1,119 @@
+"""
+Near-duplicate and burst detection
+==================================
+Phone uploads are full of burst shots and near-identical frames. Before
+face inference every new photo gets two 64-bit perceptual hashes from a
+tiny decode (JPEG draft mode, ~1/8 scale):
+
+    pHash  sign of the 8x8 lowest DCT frequencies of a 32x32 grey copy
+           against their median: survives re-encoding, resizing, small
+           exposure changes
+    dHash  sign of horizontal gradients on a 9x8 grey copy: confirms the
+           layout matches, so two different scenes with a similar overall
+           tone are not merged
+
+Grouping is leader based, in upload order: a photo joins the nearest
+earlier representative (fewest pHash + dHash bits apart) among those
+within NEAR_DUP_PHASH_DISTANCE and NEAR_DUP_DHASH_DISTANCE bits, found
+with a BK-tree over the representatives' pHashes; otherwise it becomes a
+representative itself. Every member is close to its own representative,
+so a slow pan cannot chain unrelated frames into one group.
+
+Only representatives get face inference; members are stored and inherit
+the representative's faces and event (ingest.py, library.py). That is
+the trade-off, and why it is off unless BURST_DETECTION=1: a face seen
+only in a member (someone stepping into the frame, a turned head) is
+never detected, so it is missing from person search and the people
+index, and a member whose faces differ can land in the wrong event.
+"""
+
+import os
+
+import cv2
+import numpy as np
+
+BURST_DETECTION = os.getenv("BURST_DETECTION", "0") == "1"
+NEAR_DUP_PHASH_DISTANCE = int(os.getenv("NEAR_DUP_PHASH_DISTANCE", 8))
+NEAR_DUP_DHASH_DISTANCE = int(os.getenv("NEAR_DUP_DHASH_DISTANCE", 12))
+# Longest side of the decode the hashes are computed from
+HASH_DECODE_SIDE = 64
+
+_BITS = 1 << np.arange(64, dtype=np.uint64)
+
+
+def _pack(bits):
+    return int((bits.ravel().astype(np.uint64) * _BITS).sum())
+
+
+def image_hashes(img_rgb):
+    """(pHash, dHash) of a PIL RGB image as 64-bit ints"""
+    grey = cv2.cvtColor(np.asarray(img_rgb), cv2.COLOR_RGB2GRAY)
+    small = cv2.resize(grey, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8]
+    phash = _pack(low > np.median(low))
+    tiny = cv2.resize(grey, (9, 8), interpolation=cv2.INTER_AREA).astype(np.int16)
+    dhash = _pack(tiny[:, 1:] > tiny[:, :-1])
+    return phash, dhash
+
+
+def distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+class BKTree:
+    """Metric tree over 64-bit hashes under Hamming distance"""
+
+    def __init__(self):
+        self.root = None    # [hash, value, {distance: child}]
+
+    def add(self, key, value):
+        node = [key, value, {}]
+        if self.root is None:
+            self.root = node
+            return
+        current = self.root
+        while True:
+            d = distance(key, current[0])
+            child = current[2].get(d)
+            if child is None:
+                current[2][d] = node
+                return
+            current = child
+
+    def search(self, key, radius):
+        """[(distance, value)] of every hash within `radius` bits, nearest first"""
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node_key, value, children = stack.pop()
+            d = distance(key, node_key)
+            if d <= radius:
+                found.append((d, value))
+            # triangle inequality: only children at distance d +- radius can hold matches
+            for child_d, child in children.items():
+                if d - radius <= child_d <= d + radius:
+                    stack.append(child)
+        found.sort(key=lambda item: item[0])
+        return found
+
+
+def group(hashes, phash_distance=NEAR_DUP_PHASH_DISTANCE, dhash_distance=NEAR_DUP_DHASH_DISTANCE):
+    """
+    hashes: (pHash, dHash) or None (not hashable) per photo, in upload order.
+    Returns the representative's position for every photo (its own for
+    representatives and unhashable photos).
+    """
+    tree = BKTree()
+    representative = []
+    for pos, pair in enumerate(hashes):
+        rep = pos
+        if pair is not None:
+            matches = [(d + distance(pair[1], hashes[candidate][1]), candidate)
+                       for d, candidate in tree.search(pair[0], phash_distance)
+                       if distance(pair[1], hashes[candidate][1]) <= dhash_distance]
+            if matches:
+                rep = min(matches)[1]   # nearest, the earliest on a tie
+            if rep == pos:
+                tree.add(pair[0], pos)
+        representative.append(rep)
+    return representative
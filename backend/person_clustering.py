@@ -0,0 +1,216 @@
+"""
+Person clustering engines
+=========================
+Group face rows of a FaceMatrix into people. All methods return the same
+structure as similarity.find_person_clusters: a list of row arrays, one
+per person, ordered by their first row.
+
+    greedy     similarity.find_person_clusters: every unused face seeds a
+               cluster (exact, O(F^2) time)
+    graph      neighbour graph + connected components. Neighbours come from
+               an IVF partition (spherical k-means): every face
+               is only compared with the faces of the `nprobe` lists closest
+               to its own list. Edges are the GRAPH_K nearest neighbours above
+               the person threshold. About O(F * sqrt(F)) time, O(F * k) memory.
+    centroid   mini-batch centroid refinement: faces are assigned to the
+               nearest person centroid above the threshold (new people are
+               seeded greedily inside the batch), then REFINE_PASSES
+               passes reassign every face. O(F * people) time.
+
+Selected per upload (form field `clustering_method` of /upload-photos/ and
+/upload-jobs/, `?method=` of /recluster) or globally with PERSON_CLUSTERING.
+"""
+
+import os
+
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+import similarity as sim
+
+PERSON_CLUSTERING = os.getenv("PERSON_CLUSTERING", "greedy")
+METHODS = ("greedy", "graph", "centroid")
+
+# graph
+GRAPH_K = 16
+GRAPH_NPROBE = 8
+KMEANS_ITERATIONS = 8
+EXACT_BELOW = 4096      # smaller inputs: exact blocked neighbour search
+
+# centroid
+CENTROID_BATCH = 4096
+REFINE_PASSES = 2
+
+
+def _ordered(labels):
+    """Label per row -> list of row arrays ordered by first row"""
+    order = np.argsort(labels, kind="stable")
+    sorted_labels = labels[order]
+    splits = np.flatnonzero(np.diff(sorted_labels)) + 1
+    clusters = np.split(order, splits)
+    clusters.sort(key=lambda rows: rows[0])
+    return clusters
+
+
+# --- GRAPH ---
+
+def spherical_kmeans(vectors, nlist, iterations=KMEANS_ITERATIONS, seed=0):
+    """`nlist` normalized centroids of normalized vectors (cosine k-means)"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(vectors @ centroids.T, axis=1)
+        sums = _sum_by_label(assign, vectors, nlist)
+        empty = np.bincount(assign, minlength=nlist) == 0
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]  # reseed empty lists
+        centroids = _normalized(sums)
+    return centroids
+
+
+def _block_neighbours(matrix, queries, candidates, k, threshold):
+    """Top-k (query row, candidate row) pairs with similarity > threshold"""
+    sims = matrix[queries] @ matrix[candidates].T
+    if sims.shape[1] > k:
+        top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+    else:
+        top = np.broadcast_to(np.arange(sims.shape[1]), sims.shape)
+    top_sims = np.take_along_axis(sims, top, axis=1)
+    hit = top_sims > threshold
+    return np.repeat(queries, hit.sum(axis=1)), candidates[top[hit]]
+
+
+def neighbour_edges(matrix, threshold, k=GRAPH_K, nprobe=GRAPH_NPROBE):
+    """(rows, cols) of the approximate k-NN graph restricted to similarity > threshold"""
+    n = len(matrix)
+    src, dst = [], []
+    if n <= EXACT_BELOW:
+        everything = np.arange(n)
+        for start in range(0, n, sim.BLOCK_SIZE):
+            s, d = _block_neighbours(matrix, everything[start:start + sim.BLOCK_SIZE], everything, k + 1, threshold)
+            src.append(s)
+            dst.append(d)
+    else:
+        nlist = int(np.sqrt(n))
+        sample = matrix[np.random.default_rng(0).choice(n, min(n, 32 * nlist), replace=False)]
+        centroids = spherical_kmeans(sample, nlist)
+        assign = np.empty(n, dtype=np.int64)
+        for start in range(0, n, 65536):
+            assign[start:start + 65536] = np.argmax(matrix[start:start + 65536] @ centroids.T, axis=1)
+        members = _ordered(assign)
+        lists = {int(assign[rows[0]]): rows for rows in members}
+
+        # every face of list l is compared with the faces of the nprobe lists closest to l
+        probe = np.argsort(-(centroids @ centroids.T), axis=1)[:, :nprobe]
+        for l, queries in lists.items():
+            candidates = np.concatenate([lists[p] for p in probe[l] if p in lists])
+            for start in range(0, len(queries), sim.BLOCK_SIZE):
+                s, d = _block_neighbours(matrix, queries[start:start + sim.BLOCK_SIZE], candidates, k + 1, threshold)
+                src.append(s)
+                dst.append(d)
+
+    if not src:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(src), np.concatenate(dst)
+
+
+def graph_clusters(fm, threshold=None, k=GRAPH_K, nprobe=GRAPH_NPROBE):
+    threshold = fm.person_threshold if threshold is None else threshold
+    n = fm.num_faces
+    rows, cols = neighbour_edges(fm.matrix, threshold, k, nprobe)
+    graph = coo_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=(n, n))
+    _, labels = connected_components(graph, directed=False)
+    return _ordered(labels)
+
+
+# --- CENTROID ---
+
+def _sum_by_label(labels, vectors, count):
+    """Row sums of `vectors` per label (a sparse one-hot product, much faster than np.add.at)"""
+    onehot = coo_matrix((np.ones(len(labels), dtype=np.float32), (labels, np.arange(len(labels)))),
+                        shape=(count, len(labels)))
+    return np.asarray(onehot.tocsr() @ vectors, dtype=np.float32)
+
+
+def _normalized(vectors):
+    return vectors / (np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-10)
+
+
+def _assign(matrix, centroids, threshold):
+    """Nearest centroid per row, -1 where none is above the threshold"""
+    labels = np.full(len(matrix), -1, dtype=np.int64)
+    if len(centroids) == 0:
+        return labels
+    for start in range(0, len(matrix), CENTROID_BATCH):
+        sims = matrix[start:start + CENTROID_BATCH] @ centroids.T
+        best = np.argmax(sims, axis=1)
+        ok = sims[np.arange(len(best)), best] > threshold
+        labels[start:start + CENTROID_BATCH] = np.where(ok, best, -1)
+    return labels
+
+
+def centroid_clusters(fm, threshold=None, batch=CENTROID_BATCH, passes=REFINE_PASSES):
+    threshold = fm.person_threshold if threshold is None else threshold
+    matrix = fm.matrix
+    n, dim = matrix.shape if fm.num_faces else (0, 0)
+    sums = np.zeros((0, dim), dtype=np.float32)
+    centroids = sums
+    labels = np.full(n, -1, dtype=np.int64)
+    if n == 0:
+        return []
+
+    # one pass in mini-batches: join the nearest person or seed new ones
+    for start in range(0, n, batch):
+        rows = np.arange(start, min(start + batch, n))
+        batch_labels = _assign(matrix[rows], centroids, threshold)
+        joined = batch_labels >= 0
+        sums += _sum_by_label(batch_labels[joined], matrix[rows[joined]], len(sums))
+
+        new = np.flatnonzero(~joined)
+        if len(new):
+            seeds = sim.find_person_clusters(sim.FaceMatrix.from_arrays(matrix[rows[new]], [len(new)]), threshold)
+            for offset, members in enumerate(seeds):
+                batch_labels[new[members]] = len(sums) + offset
+            sums = np.vstack([sums, np.vstack([matrix[rows[new[members]]].sum(axis=0) for members in seeds])])
+        labels[rows] = batch_labels
+        centroids = _normalized(sums)
+
+    # refinement: reassign everything to the final centroids
+    for _ in range(passes):
+        labels = _assign(matrix, centroids, threshold)
+        orphans = np.flatnonzero(labels < 0)
+        labels[orphans] = len(centroids) + np.arange(len(orphans))    # stay on their own
+        used = np.unique(labels)
+        remap = np.full(labels.max() + 1, -1, dtype=np.int64)
+        remap[used] = np.arange(len(used))
+        labels = remap[labels]
+        sums = _sum_by_label(labels, matrix, len(used))
+        centroids = _normalized(sums)
+
+    return _ordered(labels)
+
+
+# --- DISPATCH ---
+
+def cluster_persons(fm, method=None, threshold=None):
+    """Person groups (list of face row arrays) with the selected engine"""
+    method = method or PERSON_CLUSTERING
+    if method not in METHODS:
+        raise ValueError(f"Unknown person clustering '{method}', expected one of {', '.join(METHODS)}")
+    if fm.num_faces == 0:
+        return []
+    if method == "graph":
+        return graph_clusters(fm, threshold)
+    if method == "centroid":
+        return centroid_clusters(fm, threshold)
+    return sim.find_person_clusters(fm, threshold)
+
+
+def find_primary_person(fm, method=None, threshold=None):
+    """Like similarity.find_primary_person, with a selectable engine"""
+    if fm.num_faces == 0:
+        return None, set()
+    clusters = cluster_persons(fm, method, threshold)
+    primary_cluster = max(clusters, key=len)
+    face_to_photo = fm.face_to_photo()
+    return primary_cluster, set(face_to_photo[primary_cluster].tolist())
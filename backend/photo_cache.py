@@ -0,0 +1,215 @@
+"""
+/photos read cache
+==================
+GET /photos/{username} is what the Dashboard and the Editor load on
+mount. Responses are served from an in-process cache:
+
+- one entry per user (LRU, PHOTO_CACHE_USERS): the serialized JSON, its
+  ETag and the gzip / brotli encodings, compressed once per version
+- every request checks the user's library version (one primary key
+  lookup); save_clusters bumps it on every write, in this process or in
+  a queue worker, so a stale entry is never served
+- If-None-Match answers 304 without a body
+- optional pagination: `limit` photos per page in event order (a large
+  event continues on the next page, extras come last), `cursor` from
+  the previous page's next_cursor. Cursors carry the version; after a
+  write the client is told to start over (409).
+- photo sizes for /layouts, read on first use per version
+- date ranges (`since` / `until`): the store's (username, taken_at) index
+  picks the photos, the cached entry maps them to their events
+
+Request cost depends on the size of this user's library only.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from store import get_store
+
+PHOTO_CACHE_USERS = int(os.getenv("PHOTO_CACHE_USERS", 1024))
+# Smaller bodies are sent uncompressed
+COMPRESS_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+class StaleCursor(Exception):
+    """The library changed since the cursor was issued"""
+
+
+def to_json(data):
+    return json.dumps(data, separators=(",", ":")).encode()
+
+
+def accepted_encoding(accept_encoding):
+    """Best encoding the client accepts: br, gzip or None"""
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+def compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+class CachedLibrary:
+    def __init__(self, version, data):
+        self.version = version
+        self.data = data
+        self.body = to_json(data)
+        self.etag = f'"{hashlib.sha1(self.body).hexdigest()}"'
+        self._encoded = {}
+        self._sections = None
+        self.sizes = None   # {url: (width, height)}, loaded for layouts only
+        self.hashes = None  # {url: content hash}, loaded for exports only
+        self._event_of = None
+
+    def encoded(self, encoding):
+        """(body, content encoding) for the negotiated encoding, compressed once"""
+        if encoding is None or len(self.body) < COMPRESS_MIN_BYTES:
+            return self.body, None
+        if encoding not in self._encoded:
+            self._encoded[encoding] = compress(self.body, encoding)
+        return self._encoded[encoding], encoding
+
+    def sections(self):
+        """[(event name or None for extras, urls)] in display order"""
+        if self._sections is None:
+            self._sections = list(self.data["clusters"].items()) + [(None, self.data["extras"])]
+        return self._sections
+
+    def page(self, limit, cursor=None):
+        """
+        Up to `limit` photos from the cursor on, same shape as the full
+        response plus next_cursor; bursts whose representative is on the page
+        """
+        section, offset = 0, 0
+        if cursor:
+            try:
+                version, section, offset = (int(v) for v in cursor.split("."))
+            except ValueError:
+                raise StaleCursor("Malformed cursor")
+            if version != self.version:
+                raise StaleCursor("Library changed, load it again from the first page")
+
+        clusters, extras = {}, []
+        sections = self.sections()
+        remaining = limit
+        while remaining > 0 and section < len(sections):
+            name, urls = sections[section]
+            taken = urls[offset:offset + remaining]
+            if name is None:
+                extras = taken
+            elif taken:
+                clusters[name] = taken
+            remaining -= len(taken)
+            offset += len(taken)
+            if offset >= len(urls):
+                section, offset = section + 1, 0
+
+        done = section >= len(sections)
+        on_page = set(extras).union(*clusters.values())
+        return {
+            "clusters": clusters,
+            "extras": extras,
+            "bursts": [b for b in self.data.get("bursts", []) if b[0] in on_page],
+            "next_cursor": None if done else f"{self.version}.{section}.{offset}",
+            "total_events": len(self.data["clusters"]),
+            "total_photos": sum(len(urls) for _, urls in sections),
+        }
+
+
+    def taken_between(self, rows):
+        """
+        Same shape as the full response for the photos of a date range:
+        rows are (url, taken_at) from the store's capture time index, oldest
+        first; each event keeps only its photos in the range, in time order
+        """
+        if self._event_of is None:
+            self._event_of = {url: name for name, urls in self.sections() for url in urls}
+        clusters, extras = {}, []
+        for url, _ in rows:
+            if url not in self._event_of:
+                continue   # stored after this version was read
+            name = self._event_of[url]
+            (extras if name is None else clusters.setdefault(name, [])).append(url)
+        on_page = set(extras).union(*clusters.values())
+        return {
+            "clusters": clusters,
+            "extras": extras,
+            "bursts": [b for b in self.data.get("bursts", []) if b[0] in on_page],
+            "total_photos": len(on_page),
+        }
+
+
+class PhotoCache:
+    def __init__(self, store, max_users=PHOTO_CACHE_USERS):
+        self.store = store
+        self.max_users = max_users
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, username):
+        version = self.store.library_version(username)
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is not None and entry.version == version:
+                self._entries.move_to_end(username)
+                return entry
+
+        version, data = self.store.get_versioned_user_data(username)
+        entry = CachedLibrary(version, data)
+        with self._lock:
+            self._entries[username] = entry
+            self._entries.move_to_end(username)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+        return entry
+
+    def sizes(self, username, entry):
+        """Photo sizes of the library behind `entry`, read once per version"""
+        if entry.sizes is None:
+            entry.sizes = self.store.photo_sizes(username)
+        return entry.sizes
+
+    def hashes(self, username, entry):
+        """Content hashes of the library behind `entry`, read once per version"""
+        if entry.hashes is None:
+            entry.hashes = self.store.photo_hashes(username)
+        return entry.hashes
+
+    def invalidate(self, username):
+        with self._lock:
+            self._entries.pop(username, None)
+
+
+_photo_cache = None
+
+def get_photo_cache():
+    global _photo_cache
+    if _photo_cache is None:
+        _photo_cache = PhotoCache(get_store())
+    return _photo_cache
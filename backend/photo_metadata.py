@@ -0,0 +1,90 @@
+"""
+Header-only photo metadata
+==========================
+Capture time, GPS position and pixel size in one pass over the file
+header: PIL and pillow_heif open images lazily, so no pixels are decoded.
+Ingest stores the values with every photo (store.py keeps a per-user
+index on capture time); clustering can use them to limit event grouping
+to time / location windows.
+
+    read_metadata(filename, path or bytes)
+        -> {"taken_at", "lat", "lon", "width", "height"}, unknown values None
+
+taken_at is DateTimeOriginal (or DateTime) as epoch seconds. Cameras
+write local clock time without a zone, so it is read as if it were UTC:
+right for ordering and gaps between photos, not an absolute instant.
+"""
+
+import io
+import math
+from datetime import datetime, timezone
+
+import pillow_heif
+from PIL import Image
+
+EXIF_IFD = 0x8769
+GPS_IFD = 0x8825
+DATETIME_ORIGINAL = 36867
+DATETIME = 306
+EARTH_RADIUS_KM = 6371.0
+
+
+def _timestamp(value):
+    if isinstance(value, bytes):
+        value = value.decode(errors="ignore")
+    try:
+        taken = datetime.strptime(str(value).strip("\x00 ")[:19], "%Y:%m:%d %H:%M:%S")
+    except ValueError:
+        return None
+    return taken.replace(tzinfo=timezone.utc).timestamp()
+
+
+def _degrees(dms, ref):
+    """EXIF (degrees, minutes, seconds) rationals + N/S/E/W -> signed decimal degrees"""
+    degrees = float(dms[0]) + float(dms[1]) / 60 + float(dms[2]) / 3600
+    if isinstance(ref, bytes):
+        ref = ref.decode(errors="ignore")
+    return -degrees if str(ref).strip("\x00 ").upper() in ("S", "W") else degrees
+
+
+def from_exif(exif):
+    """(taken_at, lat, lon) of a PIL Image.Exif"""
+    taken_at = _timestamp(exif.get_ifd(EXIF_IFD).get(DATETIME_ORIGINAL) or exif.get(DATETIME) or "")
+    lat = lon = None
+    gps = exif.get_ifd(GPS_IFD)
+    try:
+        if gps.get(2) and gps.get(4):
+            lat, lon = _degrees(gps[2], gps.get(1, "N")), _degrees(gps[4], gps.get(3, "E"))
+            if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+                lat = lon = None
+    except (TypeError, ValueError, ZeroDivisionError, IndexError):
+        lat = lon = None
+    return taken_at, lat, lon
+
+
+def read_metadata(filename, source):
+    """Metadata of a file path or its bytes; all None if the header cannot be read"""
+    meta = {"taken_at": None, "lat": None, "lon": None, "width": None, "height": None}
+    stream = source if isinstance(source, str) else io.BytesIO(source)
+    try:
+        if filename.lower().endswith(".heic"):
+            heif = pillow_heif.open_heif(stream)
+            meta["width"], meta["height"] = heif.size
+            exif = Image.Exif()
+            if heif.info.get("exif"):
+                exif.load(heif.info["exif"])
+        else:
+            with Image.open(stream) as image:
+                meta["width"], meta["height"] = image.size
+                exif = image.getexif()
+        meta["taken_at"], meta["lat"], meta["lon"] = from_exif(exif)
+    except Exception:
+        pass
+    return meta
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance (haversine)"""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((p2 - p1) / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
@@ -0,0 +1,238 @@
+"""
+Optional embedding reduction
+============================
+Matching cost scales with the embedding size (VGG-Face: 4096). With
+EMBEDDING_REDUCTION set, every embedding is also projected to REDUCED_DIM
+right after the model runs (ml_engine), stored next to the raw vector
+(faces.reduced) and the clustering runs on the reduced vectors:
+
+    random   Gaussian random projection (orthonormalized), needs no data
+    pca      PCA fitted on stored faces
+
+Cosine similarities shift after projection, so the thresholds are
+recalibrated: for each full-size threshold the reduced threshold is the
+one whose same/different decisions agree most with the full-size ones on
+a sample of face pairs. The reducer (projection + thresholds) lives in
+REDUCER_PATH and is shared by the server and the ingest workers; each
+process reloads it when the file changes. Every saved reducer carries a
+version, and reduced vectors a worker made are only used by a process
+holding the same version (the others project the raw vectors again).
+
+    python reduction.py fit --kind pca --dim 256
+
+fits (or draws) the reducer from the faces in the store, calibrates it,
+rewrites the stored reduced vectors and prints the agreement. Run
+POST /recluster/{username} afterwards, or let the next upload do it.
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+import similarity as sim
+
+EMBEDDING_REDUCTION = os.getenv("EMBEDDING_REDUCTION", "none")
+REDUCED_DIM = int(os.getenv("REDUCED_DIM", 256))
+REDUCER_PATH = os.getenv("REDUCER_PATH", "reducer.npz")
+
+# cosine 1 - eps of ml_engine.cluster_faces' DBSCAN
+DBSCAN_THRESHOLD = 0.65
+
+# Face pairs sampled for calibration
+CALIBRATION_FACES = 2000
+
+
+class Reducer:
+    def __init__(self, kind, components, mean=None, thresholds=None, version=0):
+        self.kind = kind
+        self.components = components      # (D, d)
+        self.mean = mean                  # (D,) for PCA
+        self.version = version            # set on save, 0 = never saved
+        self.thresholds = thresholds or {
+            "person": sim.PERSON_THRESHOLD,
+            "match": sim.MATCH_THRESHOLD,
+            "dbscan": DBSCAN_THRESHOLD,
+        }
+
+    @property
+    def dim_in(self):
+        return self.components.shape[0]
+
+    @property
+    def dim(self):
+        return self.components.shape[1]
+
+    def transform(self, vectors):
+        """(k, D) -> normalized float32 (k, d)"""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim_in)
+        if self.mean is not None:
+            vectors = vectors - self.mean
+        out = vectors @ self.components
+        out /= np.linalg.norm(out, axis=1, keepdims=True) + 1e-10
+        return out
+
+    def save(self, path=REDUCER_PATH):
+        self.version = time.time_ns()
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, kind=self.kind, components=self.components,
+                     mean=self.mean if self.mean is not None else np.zeros(0, np.float32),
+                     thresholds=np.array([self.thresholds["person"], self.thresholds["match"],
+                                          self.thresholds["dbscan"]]),
+                     version=self.version)
+        os.replace(tmp, path)   # running processes never read a half-written reducer
+
+    @classmethod
+    def load(cls, path=REDUCER_PATH):
+        data = np.load(path)
+        person, match, dbscan = data["thresholds"].tolist()
+        return cls(str(data["kind"]), data["components"].astype(np.float32),
+                   data["mean"].astype(np.float32) if len(data["mean"]) else None,
+                   {"person": person, "match": match, "dbscan": dbscan},
+                   int(data["version"]) if "version" in data.files else 0)
+
+
+def random_projection(dim_in, dim, seed=0):
+    rng = np.random.default_rng(seed)
+    q, _ = np.linalg.qr(rng.standard_normal((dim_in, dim)))
+    return Reducer("random", q.astype(np.float32))
+
+
+def fit_pca(vectors, dim):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    mean = vectors.mean(axis=0)
+    # right singular vectors of the centered data are the principal axes
+    _, _, vt = np.linalg.svd(vectors - mean, full_matrices=False)
+    components = vt[:dim].T
+    if components.shape[1] < dim:  # fewer samples than dims: pad with random axes
+        extra = random_projection(vectors.shape[1], dim - components.shape[1]).components
+        components = np.hstack([components, extra])
+    return Reducer("pca", components.astype(np.float32), mean)
+
+
+def best_threshold(full_sims, reduced_sims, threshold):
+    """Reduced threshold whose decisions agree most with full_sims > threshold"""
+    same = np.sort(reduced_sims[full_sims > threshold])
+    different = np.sort(reduced_sims[full_sims <= threshold])
+    candidates = np.unique(np.concatenate([same, different]))
+    if len(candidates) == 0:
+        return threshold, 1.0
+    # agreement(t) = same pairs above t + different pairs at or below t
+    agree = (len(same) - np.searchsorted(same, candidates, side="right")) \
+        + np.searchsorted(different, candidates, side="right")
+    # every t from the first best candidate up to the next candidate after the
+    # last best one scores the same; take the middle of that range
+    best = np.flatnonzero(agree == agree.max())
+    upper = candidates[best[-1] + 1] if best[-1] + 1 < len(candidates) else candidates[best[-1]]
+    return float((candidates[best[0]] + upper) / 2), agree[best[0]] / (len(same) + len(different))
+
+
+def calibrate(reducer, vectors, sample=CALIBRATION_FACES, seed=0):
+    """Recalibrate reducer.thresholds on normalized face vectors, returns pair agreement per threshold"""
+    rng = np.random.default_rng(seed)
+    if len(vectors) > sample:
+        vectors = vectors[rng.choice(len(vectors), sample, replace=False)]
+    vectors = vectors / (np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-10)
+    reduced = reducer.transform(vectors)
+
+    upper = np.triu_indices(len(vectors), k=1)
+    full_sims = (vectors @ vectors.T)[upper]
+    reduced_sims = (reduced @ reduced.T)[upper]
+
+    agreement = {}
+    for name, threshold in (("person", sim.PERSON_THRESHOLD), ("match", sim.MATCH_THRESHOLD),
+                            ("dbscan", DBSCAN_THRESHOLD)):
+        reducer.thresholds[name], agreement[name] = best_threshold(full_sims, reduced_sims, threshold)
+    return agreement
+
+
+_reducer = None
+_reducer_stat = None    # (mtime, size) of REDUCER_PATH when _reducer was loaded from it
+
+def _stat(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+def get_reducer():
+    """
+    The active reducer, or None when EMBEDDING_REDUCTION=none. Reloaded
+    when REDUCER_PATH changes (`python reduction.py fit`), checked on every
+    call: one stat.
+    """
+    global _reducer, _reducer_stat
+    if EMBEDDING_REDUCTION == "none":
+        return None
+    stat = _stat(REDUCER_PATH)
+    if _reducer is None or (stat is not None and stat != _reducer_stat):
+        if stat is not None:
+            _reducer, _reducer_stat = Reducer.load(REDUCER_PATH), stat
+        elif EMBEDDING_REDUCTION == "random":
+            # VGG-Face size; uncalibrated until `python reduction.py fit` runs
+            _reducer = random_projection(4096, REDUCED_DIM)
+        else:
+            raise RuntimeError(f"EMBEDDING_REDUCTION={EMBEDDING_REDUCTION} needs {REDUCER_PATH}, "
+                               f"run `python reduction.py fit --kind {EMBEDDING_REDUCTION}`")
+    return _reducer
+
+
+def thresholds():
+    """(person, match) thresholds of the space clustering runs in"""
+    reducer = get_reducer()
+    if reducer is None:
+        return sim.PERSON_THRESHOLD, sim.MATCH_THRESHOLD
+    return reducer.thresholds["person"], reducer.thresholds["match"]
+
+
+def record_vectors(record, reducer):
+    """A record's faces in the reduced space, reusing the vectors the worker made with the same reducer"""
+    reduced = record.get("reduced")
+    if (reduced is not None and record.get("reducer") == reducer.version and len(reduced) == len(record["faces"])
+            and (len(reduced) == 0 or reduced.shape[1] == reducer.dim)):
+        return reduced
+    return reducer.transform(record["faces"]) if len(record["faces"]) else []
+
+
+def face_matrix(records):
+    """FaceMatrix of upload records in the space clustering runs in"""
+    reducer = get_reducer()
+    if reducer is None:
+        return sim.FaceMatrix.from_photos(records)
+    return sim.FaceMatrix([record_vectors(r, reducer) for r in records], thresholds())
+
+
+# --- CLI ---
+
+def fit(kind, dim, path=REDUCER_PATH):
+    from store import get_store
+
+    store = get_store()
+    vectors = store.all_embeddings()
+    if len(vectors) == 0:
+        print("⚠️ No stored faces to fit on")
+        return
+
+    reducer = fit_pca(vectors, dim) if kind == "pca" else random_projection(vectors.shape[1], dim)
+    agreement = calibrate(reducer, vectors)
+    reducer.save(path)
+    print(f"✓ {kind} reducer {vectors.shape[1]} -> {dim} saved to {path} (fitted on {len(vectors)} faces)")
+    for name, value in agreement.items():
+        print(f"  {name:7s} threshold {reducer.thresholds[name]:.3f}, pair agreement {value:.4f}")
+
+    updated = store.update_reduced(reducer.transform)
+    print(f"✓ Reduced vectors rewritten for {updated} faces - recluster libraries to use them")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fit and calibrate the embedding reducer")
+    sub = parser.add_subparsers(dest="command", required=True)
+    fit_parser = sub.add_parser("fit")
+    fit_parser.add_argument("--kind", choices=["pca", "random"], default="pca")
+    fit_parser.add_argument("--dim", type=int, default=REDUCED_DIM)
+    fit_parser.add_argument("--path", default=REDUCER_PATH)
+    args = parser.parse_args()
+    fit(args.kind, args.dim, args.path)
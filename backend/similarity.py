@@ -0,0 +1,185 @@
+"""
+Vectorized face similarity
+==========================
+All face embeddings of an upload are L2-normalized ONCE into a single
+float32 matrix. Cosine similarity then becomes a plain matrix multiply,
+so every clustering step (primary person, event grouping, extras
+matching) reads from the same matrix instead of rebuilding NumPy arrays
+for each face pair.
+"""
+
+import numpy as np
+
+# --- THRESHOLDS (same values the pairwise code used) ---
+PERSON_THRESHOLD = 0.58   # faces of the same person (primary person search)
+MATCH_THRESHOLD = 0.60    # faces shared between photos / events
+
+# Rows per similarity block, keeps the temporary (block x F) matrix small
+BLOCK_SIZE = 1024
+
+
+class FaceMatrix:
+    """
+    Every face of every photo stacked into one normalized float32 matrix.
+    Faces of photo `p` live in rows offsets[p]:offsets[p+1].
+    The thresholds belong to the embedding space: reduced vectors
+    (reduction.py) come with their own recalibrated ones.
+    """
+
+    person_threshold = PERSON_THRESHOLD
+    match_threshold = MATCH_THRESHOLD
+
+    def __init__(self, photo_faces, thresholds=None):
+        if thresholds is not None:
+            self.person_threshold, self.match_threshold = thresholds
+        counts = [len(faces) for faces in photo_faces]
+        self.offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.offsets[1:])
+
+        # one (k, D) block per photo (compact arrays or lists of vectors), upcast once
+        blocks = [np.asarray(faces, dtype=np.float32).reshape(len(faces), -1) for faces in photo_faces if len(faces)]
+        if blocks:
+            matrix = np.concatenate(blocks)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            matrix /= norms + 1e-10
+        else:
+            matrix = np.zeros((0, 0), dtype=np.float32)
+        self.matrix = matrix
+
+    @classmethod
+    def from_photos(cls, photos, key="faces", thresholds=None):
+        return cls([photo[key] for photo in photos], thresholds)
+
+    @classmethod
+    def from_arrays(cls, matrix, counts, thresholds=None):
+        """Wrap an already-normalized float32 matrix, `counts` faces per photo"""
+        fm = cls.__new__(cls)
+        if thresholds is not None:
+            fm.person_threshold, fm.match_threshold = thresholds
+        fm.offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=fm.offsets[1:])
+        fm.matrix = matrix
+        return fm
+
+    @property
+    def thresholds(self):
+        return self.person_threshold, self.match_threshold
+
+    @property
+    def num_faces(self):
+        return self.matrix.shape[0]
+
+    @property
+    def num_photos(self):
+        return len(self.offsets) - 1
+
+    def count(self, photo_idx):
+        return int(self.offsets[photo_idx + 1] - self.offsets[photo_idx])
+
+    def rows(self, photo_idx):
+        return np.arange(self.offsets[photo_idx], self.offsets[photo_idx + 1])
+
+    def rows_of(self, photo_indices):
+        """Face rows of several photos, concatenated in the given photo order."""
+        if len(photo_indices) == 0:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate([self.rows(p) for p in photo_indices])
+
+    def face_to_photo(self):
+        return np.repeat(np.arange(self.num_photos), np.diff(self.offsets))
+
+    def similarity(self, rows_a, rows_b):
+        """Cosine similarity block between two sets of face rows."""
+        return self.matrix[rows_a] @ self.matrix[rows_b].T
+
+
+def _group_starts(sizes):
+    starts = np.zeros(len(sizes), dtype=np.int64)
+    if len(sizes) > 1:
+        np.cumsum(sizes[:-1], out=starts[1:])
+    return starts
+
+
+def shared_counts(fm, groups_a, groups_b, threshold=None):
+    """
+    counts[i, j] = how many faces of group_a[i] match at least one face of
+    group_b[j]. A group is a list/array of face rows (one photo, or all the
+    faces of an event). Same rule as the old `get_shared_people` loop.
+    threshold defaults to the matrix's match threshold.
+    """
+    threshold = fm.match_threshold if threshold is None else threshold
+    counts = np.zeros((len(groups_a), len(groups_b)), dtype=np.int64)
+    sizes_a = np.array([len(g) for g in groups_a], dtype=np.int64)
+    sizes_b = np.array([len(g) for g in groups_b], dtype=np.int64)
+
+    # reduceat cannot handle empty groups - they never share anyone anyway
+    keep_a = np.flatnonzero(sizes_a)
+    keep_b = np.flatnonzero(sizes_b)
+    if len(keep_a) == 0 or len(keep_b) == 0:
+        return counts
+
+    rows_a = np.concatenate([np.asarray(groups_a[i], dtype=np.int64) for i in keep_a])
+    rows_b = np.concatenate([np.asarray(groups_b[j], dtype=np.int64) for j in keep_b])
+    starts_b = _group_starts(sizes_b[keep_b])
+
+    # face (of A) x group (of B): does this face match anyone in the group?
+    face_hits = np.zeros((len(rows_a), len(keep_b)), dtype=np.int64)
+    for start in range(0, len(rows_a), BLOCK_SIZE):
+        block = fm.similarity(rows_a[start:start + BLOCK_SIZE], rows_b) > threshold
+        face_hits[start:start + BLOCK_SIZE] = np.logical_or.reduceat(block, starts_b, axis=1)
+
+    starts_a = _group_starts(sizes_a[keep_a])
+    counts[np.ix_(keep_a, keep_b)] = np.add.reduceat(face_hits, starts_a, axis=0)
+    return counts
+
+
+def get_shared_people(fm, rows_a, rows_b, threshold=None):
+    """Count how many faces in `rows_a` appear anywhere in `rows_b`"""
+    return int(shared_counts(fm, [rows_a], [rows_b], threshold)[0, 0])
+
+
+def photo_has_person(fm, photo_rows, person_rows, threshold=None):
+    """Check if any face of a photo matches any face of a person"""
+    threshold = fm.match_threshold if threshold is None else threshold
+    if len(photo_rows) == 0 or len(person_rows) == 0:
+        return False
+    return bool((fm.similarity(photo_rows, person_rows) > threshold).any())
+
+
+def find_person_clusters(fm, threshold=None):
+    """
+    Greedy single-pass grouping: every unused face seeds a cluster and
+    pulls in all unused faces similar to it. Identical to the old pairwise
+    loop, but each seed is one vector-matrix product.
+    """
+    threshold = fm.person_threshold if threshold is None else threshold
+    used = np.zeros(fm.num_faces, dtype=bool)
+    clusters = []
+
+    for start in range(0, fm.num_faces, BLOCK_SIZE):
+        seeds = np.arange(start, min(start + BLOCK_SIZE, fm.num_faces))
+        block = fm.matrix[seeds] @ fm.matrix.T > threshold
+
+        for offset, i in enumerate(seeds):
+            if used[i]:
+                continue
+            members = np.flatnonzero(block[offset] & ~used)
+            # The seed always belongs to its own cluster and comes first
+            members = np.concatenate(([i], members[members != i]))
+            used[members] = True
+            clusters.append(members)
+
+    return clusters
+
+
+def find_primary_person(fm, threshold=None):
+    """Find the person appearing most frequently -> (face rows, photo indices)"""
+    if fm.num_faces == 0:
+        return None, set()
+
+    clusters = find_person_clusters(fm, threshold)
+    primary_cluster = max(clusters, key=len)
+    face_to_photo = fm.face_to_photo()
+    primary_photos = set(face_to_photo[primary_cluster].tolist())
+
+    return primary_cluster, primary_photos
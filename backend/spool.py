@@ -0,0 +1,55 @@
+"""
+Upload spool
+============
+Uploads are copied to disk in SPOOL_CHUNK_BYTES pieces instead of being
+read into memory with `await file.read()`, hashing as they go. The
+ingest pipeline then hands worker processes file paths, not bytes, so a
+batch costs disk space rather than RAM whatever its size.
+
+    spool_upload(file, directory)                          -> (path, sha256)
+    spool_upload(file, directory, content_addressed=True)  -> directory/ab/ab12...
+
+Content-addressed spools (the upload queue) store every distinct file
+once and let the hash double as the file name.
+"""
+
+import hashlib
+import os
+import uuid
+
+SPOOL_DIR = os.getenv("SPOOL_DIR", "upload_spool")
+SPOOL_CHUNK_BYTES = int(os.getenv("SPOOL_CHUNK_BYTES", 1 << 20))
+
+
+def content_path(directory, key):
+    return os.path.join(directory, key[:2], key)
+
+
+async def spool_upload(upload, directory, content_addressed=False):
+    """Stream a FastAPI UploadFile to `directory`, returns (path, content hash)"""
+    os.makedirs(directory, exist_ok=True)
+    tmp = os.path.join(directory, f"{uuid.uuid4().hex}.tmp")
+    digest = hashlib.sha256()
+    with open(tmp, "wb") as f:
+        while chunk := await upload.read(SPOOL_CHUNK_BYTES):
+            digest.update(chunk)
+            f.write(chunk)
+    await upload.close()   # drops Starlette's own temporary copy
+    key = digest.hexdigest()
+
+    if not content_addressed:
+        path = os.path.join(directory, f"{uuid.uuid4().hex}{os.path.splitext(upload.filename or '')[1]}")
+    else:
+        path = content_path(directory, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.replace(tmp, path)
+    return path, key
+
+
+def file_hash(path):
+    """sha256 of a file, same value as embedding_cache.content_hash of its bytes"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(SPOOL_CHUNK_BYTES):
+            digest.update(chunk)
+    return digest.hexdigest()
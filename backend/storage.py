@@ -0,0 +1,59 @@
+"""
+Photo storage backends
+======================
+CloudinaryStorage is what production uses. LocalStorage writes into a
+folder on disk (optionally with fake network latency) so the ingest
+pipeline can be run and benchmarked without a Cloudinary account.
+"""
+
+import os
+import shutil
+import time
+import uuid
+
+import cloudinary.uploader
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "cloudinary")
+LOCAL_STORAGE_DIR = os.getenv("LOCAL_STORAGE_DIR", "local_storage")
+
+
+class CloudinaryStorage:
+    def __init__(self, folder="memorymap"):
+        self.folder = folder
+
+    def upload(self, data):
+        """Upload JPEG bytes, return the public URL"""
+        res = cloudinary.uploader.upload(data, folder=self.folder)
+        return res.get("secure_url")
+
+    def upload_file(self, path):
+        """Upload a JPEG file from disk (streamed by the SDK), return the public URL"""
+        return self.upload(path)
+
+
+class LocalStorage:
+    def __init__(self, root=LOCAL_STORAGE_DIR, latency=0.0):
+        self.root = root
+        self.latency = latency
+        os.makedirs(root, exist_ok=True)
+
+    def upload(self, data):
+        if self.latency:
+            time.sleep(self.latency)
+        path = os.path.join(self.root, f"{uuid.uuid4().hex}.jpg")
+        with open(path, "wb") as f:
+            f.write(data)
+        return f"file://{os.path.abspath(path)}"
+
+    def upload_file(self, source):
+        if self.latency:
+            time.sleep(self.latency)
+        path = os.path.join(self.root, f"{uuid.uuid4().hex}.jpg")
+        shutil.copyfile(source, path)
+        return f"file://{os.path.abspath(path)}"
+
+
+def get_storage():
+    if STORAGE_BACKEND == "local":
+        return LocalStorage()
+    return CloudinaryStorage()
@@ -0,0 +1,540 @@
+"""
+SQLite storage layer
+====================
+Replaces database.json / users.json. One SQLite file in WAL mode, so
+readers never block the writer and every write is a real transaction:
+concurrent uploads no longer overwrite each other, and reading one
+user's photos does not parse everybody else's.
+
+Tables (all keyed by username first):
+    users     username, password, profile (JSON of any other signup fields)
+    photos    one row per stored photo, with its EXIF capture time / GPS
+              (indexed by username, taken_at)
+    faces     one row per face, embedding (and reduced copy) as float32 BLOBs,
+              its person (indexed by username, person, photo_id: the
+              person -> photos index; photo -> persons is the primary key)
+    events    one row per event: member photo ids + prototype face set
+    extras    photos that belong to no event
+    persons   per person of the incremental clustering: face count, sum of
+              its face vectors (normalized only when compared), cover face
+    user_state
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+DB_PATH = os.getenv("DB_PATH", "memorymap.db")
+# (photo id, face idx) pairs per query, two bound parameters each
+FACE_KEYS_PER_QUERY = 400
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    password TEXT NOT NULL,
+    profile TEXT NOT NULL DEFAULT '{}'
+);
+CREATE TABLE IF NOT EXISTS photos (
+    username TEXT NOT NULL,
+    photo_id INTEGER NOT NULL,
+    url TEXT NOT NULL,
+    filename TEXT,
+    hash TEXT,
+    num_faces INTEGER NOT NULL DEFAULT 0,
+    width INTEGER,
+    height INTEGER,
+    burst INTEGER,
+    taken_at REAL,
+    lat REAL,
+    lon REAL,
+    PRIMARY KEY (username, photo_id)
+);
+CREATE INDEX IF NOT EXISTS photos_hash ON photos(username, hash);
+CREATE INDEX IF NOT EXISTS photos_url ON photos(url);
+CREATE TABLE IF NOT EXISTS faces (
+    username TEXT NOT NULL,
+    photo_id INTEGER NOT NULL,
+    face_idx INTEGER NOT NULL,
+    embedding BLOB NOT NULL,
+    location TEXT NOT NULL DEFAULT '{}',
+    reduced BLOB,
+    person INTEGER,
+    pinned INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (username, photo_id, face_idx)
+);
+CREATE TABLE IF NOT EXISTS events (
+    username TEXT NOT NULL,
+    event_idx INTEGER NOT NULL,
+    photo_ids TEXT NOT NULL,
+    prototypes BLOB NOT NULL,
+    PRIMARY KEY (username, event_idx)
+);
+CREATE TABLE IF NOT EXISTS extras (
+    username TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    photo_id INTEGER NOT NULL,
+    PRIMARY KEY (username, position)
+);
+CREATE TABLE IF NOT EXISTS persons (
+    username TEXT NOT NULL,
+    person_idx INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    centroid BLOB NOT NULL,
+    cover_photo INTEGER,
+    cover_face INTEGER,
+    summed INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (username, person_idx)
+);
+CREATE TABLE IF NOT EXISTS user_state (
+    username TEXT PRIMARY KEY,
+    photos_at_recluster INTEGER NOT NULL DEFAULT 0,
+    dim INTEGER NOT NULL DEFAULT 0,
+    version INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+def to_blob(matrix):
+    return np.ascontiguousarray(matrix, dtype=np.float32).tobytes()
+
+
+def from_blob(blob, dim):
+    if not dim:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.frombuffer(blob, dtype=np.float32).reshape(-1, dim)
+
+
+class Store:
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        conn = self.connect()
+        conn.executescript(SCHEMA)
+        self._migrate(conn)
+
+    def _migrate(self, conn):
+        """Columns added after a table was first created"""
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(faces)")}
+        if "reduced" not in columns:
+            conn.execute("ALTER TABLE faces ADD COLUMN reduced BLOB")
+        if "person" not in columns:
+            conn.execute("ALTER TABLE faces ADD COLUMN person INTEGER")
+            conn.execute("ALTER TABLE faces ADD COLUMN pinned INTEGER NOT NULL DEFAULT 0")
+        # person -> photos, for the people queries and merge / split
+        conn.execute("CREATE INDEX IF NOT EXISTS faces_person ON faces(username, person, photo_id)")
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(persons)")}
+        if "cover_photo" not in columns:
+            conn.execute("ALTER TABLE persons ADD COLUMN cover_photo INTEGER")
+            conn.execute("ALTER TABLE persons ADD COLUMN cover_face INTEGER")
+        if "summed" not in columns:
+            conn.execute("ALTER TABLE persons ADD COLUMN summed INTEGER NOT NULL DEFAULT 0")
+        # centroids used to be stored normalized: scale them back up to sums
+        # (summed = 0 in the WHERE, so another process migrating too is a no-op)
+        for username, person_idx, count, blob in conn.execute(
+            "SELECT username, person_idx, count, centroid FROM persons WHERE summed = 0"
+        ).fetchall():
+            conn.execute(
+                "UPDATE persons SET centroid = ?, summed = 1 WHERE username = ? AND person_idx = ? AND summed = 0",
+                (to_blob(np.frombuffer(blob, dtype=np.float32) * count), username, person_idx),
+            )
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(user_state)")}
+        if "version" not in columns:
+            conn.execute("ALTER TABLE user_state ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(photos)")}
+        if "width" not in columns:
+            conn.execute("ALTER TABLE photos ADD COLUMN width INTEGER")
+            conn.execute("ALTER TABLE photos ADD COLUMN height INTEGER")
+        if "burst" not in columns:
+            conn.execute("ALTER TABLE photos ADD COLUMN burst INTEGER")
+        if "taken_at" not in columns:
+            for column in ("taken_at", "lat", "lon"):
+                conn.execute(f"ALTER TABLE photos ADD COLUMN {column} REAL")
+        # per-user timeline, for date ranges and time windows
+        conn.execute("CREATE INDEX IF NOT EXISTS photos_taken ON photos(username, taken_at)")
+
+    def connect(self):
+        """One connection per thread (FastAPI runs sync endpoints in a thread pool)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """
+        BEGIN IMMEDIATE takes the write lock up front, so a read-modify-write
+        (load library, add photos, save) cannot interleave with another writer.
+        """
+        conn = self.connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    # --- USERS ---
+
+    def add_user(self, user):
+        """False if the username is taken"""
+        profile = {k: v for k, v in user.items() if k not in ("username", "password")}
+        try:
+            with self.transaction() as conn:
+                conn.execute(
+                    "INSERT INTO users (username, password, profile) VALUES (?, ?, ?)",
+                    (user.get("username"), user.get("password"), json.dumps(profile)),
+                )
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+    def get_user(self, username):
+        row = self.connect().execute(
+            "SELECT username, password, profile FROM users WHERE username = ?", (username,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"username": row[0], "password": row[1], **json.loads(row[2])}
+
+    # --- PHOTOS ---
+
+    def get_user_data(self, username, conn=None):
+        """
+        {"clusters": {Event_N: [urls]}, "extras": [urls], "bursts": [[urls]]}
+        for one user; each burst lists its representative first.
+        """
+        conn = conn or self.connect()
+        urls = {}
+        bursts = {}
+        for photo_id, url, burst in conn.execute(
+            "SELECT photo_id, url, burst FROM photos WHERE username = ? ORDER BY photo_id", (username,)
+        ):
+            urls[photo_id] = url
+            if burst is not None:
+                bursts.setdefault(burst, []).append(url)
+        clusters = {}
+        for event_idx, photo_ids in conn.execute(
+            "SELECT event_idx, photo_ids FROM events WHERE username = ? ORDER BY event_idx", (username,)
+        ):
+            clusters[f"Event_{event_idx+1}"] = [urls[p] for p in json.loads(photo_ids)]
+        extras = [
+            urls[p] for (p,) in conn.execute(
+                "SELECT photo_id FROM extras WHERE username = ? ORDER BY position", (username,)
+            )
+        ]
+        return {"clusters": clusters, "extras": extras,
+                "bursts": [[urls[rep], *members] for rep, members in bursts.items()]}
+
+    def get_versioned_user_data(self, username):
+        """(library version, get_user_data) read from one snapshot"""
+        conn = self.connect()
+        conn.execute("BEGIN")
+        try:
+            return self.library_version(username, conn), self.get_user_data(username, conn)
+        finally:
+            conn.execute("COMMIT")
+
+    def library_version(self, username, conn=None):
+        """Bumped by every save_clusters, 0 for a user without a library"""
+        row = (conn or self.connect()).execute(
+            "SELECT version FROM user_state WHERE username = ?", (username,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def photo_sizes(self, username, conn=None):
+        """{url: (width, height)} of a user's photos, (None, None) when not recorded"""
+        return {
+            url: (w, h) for url, w, h in (conn or self.connect()).execute(
+                "SELECT url, width, height FROM photos WHERE username = ?", (username,)
+            )
+        }
+
+    def photo_hashes(self, username, conn=None):
+        """{url: content hash} of a user's photos (None for photos stored without one)"""
+        return dict((conn or self.connect()).execute(
+            "SELECT url, hash FROM photos WHERE username = ?", (username,)
+        ))
+
+    def photos_taken_between(self, username, since=None, until=None, conn=None):
+        """[(url, taken_at)] with since <= taken_at < until (epoch seconds), oldest first, from the index"""
+        return (conn or self.connect()).execute(
+            "SELECT url, taken_at FROM photos WHERE username = ? AND taken_at >= ? AND taken_at < ? "
+            "ORDER BY taken_at",
+            (username, since if since is not None else float("-inf"), until if until is not None else float("inf")),
+        ).fetchall()
+
+    def has_photo_url(self, url):
+        """True if some user's library holds this storage URL"""
+        return self.connect().execute("SELECT 1 FROM photos WHERE url = ? LIMIT 1", (url,)).fetchone() is not None
+
+    # --- LIBRARY STATE ---
+
+    def load_library(self, conn, username):
+        """Everything UserLibrary needs except the raw face embeddings"""
+        state = conn.execute(
+            "SELECT photos_at_recluster, dim FROM user_state WHERE username = ?", (username,)
+        ).fetchone()
+        photos_at_recluster, dim = state if state else (0, 0)
+
+        photos = [
+            {"url": url, "filename": filename, "hash": h, "faces": n, "burst": burst,
+             "taken_at": taken_at, "lat": lat, "lon": lon}
+            for url, filename, h, n, burst, taken_at, lat, lon in conn.execute(
+                "SELECT url, filename, hash, num_faces, burst, taken_at, lat, lon "
+                "FROM photos WHERE username = ? ORDER BY photo_id",
+                (username,),
+            )
+        ]
+        events = [
+            {"photos": json.loads(photo_ids), "prototypes": from_blob(blob, dim)}
+            for photo_ids, blob in conn.execute(
+                "SELECT photo_ids, prototypes FROM events WHERE username = ? ORDER BY event_idx", (username,)
+            )
+        ]
+        extras = [p for (p,) in conn.execute(
+            "SELECT photo_id FROM extras WHERE username = ? ORDER BY position", (username,)
+        )]
+        persons = conn.execute(
+            "SELECT count, centroid, cover_photo, cover_face FROM persons WHERE username = ? ORDER BY person_idx",
+            (username,),
+        ).fetchall()
+        # faces stored before the person index existed
+        unlabeled = conn.execute(
+            "SELECT 1 FROM faces WHERE username = ? AND person IS NULL LIMIT 1", (username,)
+        ).fetchone() is not None
+
+        return {
+            "photos": photos,
+            "events": events,
+            "extras": extras,
+            "person_counts": [c for c, _, _, _ in persons],
+            "person_sums": np.vstack([from_blob(b, dim) for _, b, _, _ in persons]) if persons else from_blob(b"", dim),
+            "person_covers": [(p, f) if p is not None else None for _, _, p, f in persons],
+            "unlabeled": unlabeled,
+            "photos_at_recluster": photos_at_recluster,
+            "dim": dim,
+        }
+
+    def add_photos(self, conn, username, first_id, photos, faces):
+        """
+        photos: new photo dicts, ids first_id, first_id+1, ...
+        faces: per photo, a list of (embedding vector, location dict[, reduced vector])
+        """
+        conn.executemany(
+            "INSERT INTO photos (username, photo_id, url, filename, hash, num_faces, width, height, burst, "
+            "taken_at, lat, lon) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(username, first_id + i, p["url"], p["filename"], p.get("hash"), p["faces"],
+              p.get("width"), p.get("height"), p.get("burst"), p.get("taken_at"), p.get("lat"), p.get("lon"))
+             for i, p in enumerate(photos)],
+        )
+        conn.executemany(
+            "INSERT INTO faces (username, photo_id, face_idx, embedding, location, reduced) VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (username, first_id + i, j, to_blob(face[0]), json.dumps(face[1]),
+                 to_blob(face[2]) if len(face) > 2 and face[2] is not None else None)
+                for i, photo_faces in enumerate(faces)
+                for j, face in enumerate(photo_faces)
+            ],
+        )
+
+    def save_clusters(self, conn, username, events, extras, person_sums, person_counts, photos_at_recluster, dim,
+                      person_covers=None, changed=None):
+        """
+        Write a user's events, extras and persons (inside the caller's
+        transaction), bumps the version. person_sums: sum of each person's
+        face vectors; person_covers: (photo id, face idx) or None per person. changed=None replaces everything; an incremental
+        add passes {"events": indexes, "persons": indexes, "extras_from":
+        position} and only those rows are written: the events and persons
+        upserted, extras rewritten from that position on, rows past the end
+        of the lists dropped.
+        """
+        person_covers = person_covers or [None] * len(person_counts)
+        if changed is None:
+            for table in ("events", "extras", "persons"):
+                conn.execute(f"DELETE FROM {table} WHERE username = ?", (username,))
+            event_ids, person_ids, extras_from = range(len(events)), range(len(person_counts)), 0
+        else:
+            event_ids = sorted(i for i in changed["events"] if i < len(events))
+            person_ids = sorted(i for i in changed["persons"] if i < len(person_counts))
+            extras_from = changed["extras_from"]
+            conn.execute("DELETE FROM events WHERE username = ? AND event_idx >= ?", (username, len(events)))
+            conn.execute("DELETE FROM extras WHERE username = ? AND position >= ?", (username, extras_from))
+            conn.execute("DELETE FROM persons WHERE username = ? AND person_idx >= ?", (username, len(person_counts)))
+
+        conn.executemany(
+            "INSERT OR REPLACE INTO events (username, event_idx, photo_ids, prototypes) VALUES (?, ?, ?, ?)",
+            [(username, i, json.dumps(events[i]["photos"]), to_blob(events[i]["prototypes"])) for i in event_ids],
+        )
+        conn.executemany(
+            "INSERT INTO extras (username, position, photo_id) VALUES (?, ?, ?)",
+            [(username, i, extras[i]) for i in range(extras_from, len(extras))],
+        )
+        conn.executemany(
+            "INSERT OR REPLACE INTO persons (username, person_idx, count, centroid, cover_photo, cover_face, summed) "
+            "VALUES (?, ?, ?, ?, ?, ?, 1)",
+            [(username, i, person_counts[i], to_blob(person_sums[i]), *(person_covers[i] or (None, None)))
+             for i in person_ids],
+        )
+        conn.execute(
+            "INSERT INTO user_state (username, photos_at_recluster, dim, version) VALUES (?, ?, ?, 1) "
+            "ON CONFLICT(username) DO UPDATE SET photos_at_recluster = excluded.photos_at_recluster, "
+            "dim = excluded.dim, version = version + 1",
+            (username, photos_at_recluster, dim),
+        )
+
+    def load_embeddings(self, conn, username, reducer=None):
+        """
+        Every stored face of a user in (photo, face) order as one matrix.
+        With a reduction.Reducer: the reduced vectors, projecting any face
+        stored without one (or with one of another size).
+        """
+        if reducer is None:
+            rows = conn.execute(
+                "SELECT embedding FROM faces WHERE username = ? ORDER BY photo_id, face_idx", (username,)
+            ).fetchall()
+            if not rows:
+                return np.zeros((0, 0), dtype=np.float32)
+            return from_blob(b"".join(blob for (blob,) in rows), len(rows[0][0]) // 4).copy()
+
+        rows = conn.execute(
+            "SELECT reduced, embedding FROM faces WHERE username = ? ORDER BY photo_id, face_idx", (username,)
+        ).fetchall()
+        return self._reduced(rows, reducer)
+
+    @staticmethod
+    def _reduced(rows, reducer):
+        """(reduced, embedding) rows -> matrix of reduced vectors, projecting the missing ones"""
+        matrix = np.zeros((len(rows), reducer.dim), dtype=np.float32)
+        missing = []
+        for i, (reduced, _) in enumerate(rows):
+            if reduced is not None and len(reduced) == reducer.dim * 4:
+                matrix[i] = np.frombuffer(reduced, dtype=np.float32)
+            else:
+                missing.append(i)
+        if missing:
+            raw = np.vstack([np.frombuffer(rows[i][1], dtype=np.float32) for i in missing])
+            matrix[missing] = reducer.transform(raw)
+        return matrix
+
+    # --- PEOPLE ---
+
+    def face_persons(self, conn, username):
+        """(person, pinned) arrays over every stored face in (photo, face) order, person -1 if unset"""
+        rows = conn.execute(
+            "SELECT person, pinned FROM faces WHERE username = ? ORDER BY photo_id, face_idx", (username,)
+        ).fetchall()
+        person = np.array([-1 if p is None else p for p, _ in rows], dtype=np.int64)
+        return person, np.array([bool(pinned) for _, pinned in rows], dtype=bool)
+
+    def set_face_persons(self, conn, username, labels):
+        """labels: (photo id, face idx, person, pinned) per face to update"""
+        conn.executemany(
+            "UPDATE faces SET person = ?, pinned = ? WHERE username = ? AND photo_id = ? AND face_idx = ?",
+            [(person, int(pinned), username, photo_id, face_idx) for photo_id, face_idx, person, pinned in labels],
+        )
+
+    def person_faces(self, conn, username, person, photo_ids=None):
+        """[(photo id, face idx)] of a person, optionally only in the given photos (from the index)"""
+        query = "SELECT photo_id, face_idx FROM faces WHERE username = ? AND person = ?"
+        params = [username, person]
+        if photo_ids is not None:
+            query += f" AND photo_id IN ({','.join('?' * len(photo_ids))})"
+            params += list(photo_ids)
+        return conn.execute(query + " ORDER BY photo_id, face_idx", params).fetchall()
+
+    def face_vectors(self, conn, username, keys, reducer=None):
+        """Clustering-space vectors of the given (photo id, face idx) faces, in that order"""
+        found = {}
+        for start in range(0, len(keys), FACE_KEYS_PER_QUERY):
+            chunk = keys[start:start + FACE_KEYS_PER_QUERY]
+            found.update(
+                ((photo_id, face_idx), (reduced, embedding)) for photo_id, face_idx, reduced, embedding in conn.execute(
+                    "SELECT photo_id, face_idx, reduced, embedding FROM faces WHERE username = ? "
+                    f"AND (photo_id, face_idx) IN (VALUES {','.join(['(?, ?)'] * len(chunk))})",
+                    [username, *(value for key in chunk for value in key)],
+                )
+            )
+        rows = [found[tuple(key)] for key in keys]
+        if reducer is not None:
+            return self._reduced(rows, reducer)
+        return np.vstack([np.frombuffer(blob, dtype=np.float32) for _, blob in rows])
+
+    def people(self, username, person=None, conn=None):
+        """
+        [(person, faces, cover url, cover location JSON)] of every non-empty
+        person, biggest first (only `person` when given)
+        """
+        query = ("SELECT p.person_idx, p.count, ph.url, f.location FROM persons p "
+                 "LEFT JOIN photos ph ON ph.username = p.username AND ph.photo_id = p.cover_photo "
+                 "LEFT JOIN faces f ON f.username = p.username AND f.photo_id = p.cover_photo "
+                 "AND f.face_idx = p.cover_face WHERE p.username = ? AND p.count > 0")
+        params = [username]
+        if person is not None:
+            query += " AND p.person_idx = ?"
+            params.append(person)
+        return (conn or self.connect()).execute(query + " ORDER BY p.count DESC, p.person_idx", params).fetchall()
+
+    def person_photos(self, username, person, after=-1, limit=50, conn=None):
+        """[(photo id, url)] of a person with photo id > after, at most `limit`, walking the index"""
+        return (conn or self.connect()).execute(
+            "SELECT f.photo_id, ph.url FROM "
+            "(SELECT DISTINCT photo_id FROM faces WHERE username = ? AND person = ? AND photo_id > ? "
+            " ORDER BY photo_id LIMIT ?) f "
+            "JOIN photos ph ON ph.username = ? AND ph.photo_id = f.photo_id ORDER BY f.photo_id",
+            (username, person, after, limit, username),
+        ).fetchall()
+
+    def photo_persons(self, username, url, conn=None):
+        """Persons on one photo, or None if the user has no such photo"""
+        conn = conn or self.connect()
+        row = conn.execute(
+            "SELECT photo_id FROM photos WHERE url = ? AND username = ?", (url, username)
+        ).fetchone()
+        if row is None:
+            return None
+        return [p for (p,) in conn.execute(
+            "SELECT DISTINCT person FROM faces WHERE username = ? AND photo_id = ? AND person IS NOT NULL "
+            "ORDER BY person", (username, row[0]),
+        )]
+
+    # --- REDUCTION ---
+
+    def all_embeddings(self, limit=20000):
+        """A random sample of raw face embeddings across all users"""
+        rows = self.connect().execute(
+            "SELECT embedding FROM faces ORDER BY RANDOM() LIMIT ?", (limit,)
+        ).fetchall()
+        if not rows:
+            return np.zeros((0, 0), dtype=np.float32)
+        return from_blob(b"".join(blob for (blob,) in rows), len(rows[0][0]) // 4).copy()
+
+    def update_reduced(self, transform, batch=2048):
+        """Rewrite every face's reduced vector with transform(raw matrix), returns the count"""
+        conn = self.connect()
+        rowids = [r for (r,) in conn.execute("SELECT rowid FROM faces")]
+        for start in range(0, len(rowids), batch):
+            with self.transaction() as tx:
+                chunk = rowids[start:start + batch]
+                rows = tx.execute(
+                    f"SELECT rowid, embedding FROM faces WHERE rowid IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                reduced = transform(np.vstack([np.frombuffer(blob, dtype=np.float32) for _, blob in rows]))
+                tx.executemany("UPDATE faces SET reduced = ? WHERE rowid = ?",
+                               [(to_blob(vector), rowid) for (rowid, _), vector in zip(rows, reduced)])
+        return len(rowids)
+
+_store = None
+
+def get_store():
+    global _store
+    if _store is None:
+        _store = Store()
+    return _store
@@ -0,0 +1,42 @@
+"""
+Backend tests: run from backend/ with
+
+    python -m pytest -q
+
+The backend modules import each other as top-level modules, like the
+server does when started from backend/.
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class People:
+    """Unit identity vectors; faces are an identity plus a little noise, normalized"""
+
+    def __init__(self, count, dim=64, noise=0.1, seed=0):
+        self.rng = np.random.default_rng(seed)
+        identities = self.rng.standard_normal((count, dim))
+        self.identities = identities / np.linalg.norm(identities, axis=1, keepdims=True)
+        self.noise = noise
+
+    def faces(self, *people):
+        faces = self.identities[list(people)] + self.noise * self.rng.standard_normal(
+            (len(people), self.identities.shape[1])) / np.sqrt(self.identities.shape[1])
+        return (faces / np.linalg.norm(faces, axis=1, keepdims=True)).astype(np.float32)
+
+    def photo(self, name, *people, **meta):
+        """An upload record with one face per person"""
+        return {"filename": name, "url": f"file:///{name}", "hash": name,
+                "faces": self.faces(*people) if people else np.zeros((0, 0), np.float32),
+                "locations": [{} for _ in people], **meta}
+
+
+@pytest.fixture
+def people():
+    return People(8)
@@ -0,0 +1,53 @@
+import numpy as np
+
+import clustering
+
+
+def partition(result):
+    events, extras = result
+    return sorted(sorted(e["photos"]) for e in events), sorted(extras)
+
+
+def album(people):
+    """Two outings with the user (person 0) days apart, and a scenery photo"""
+    day = 86400
+    return [
+        people.photo("beach1.jpg", 0, 1, taken_at=0),
+        people.photo("beach2.jpg", 0, 1, 2, taken_at=600),
+        people.photo("beach3.jpg", 1, 2, taken_at=1200),
+        people.photo("party1.jpg", 0, 3, taken_at=5 * day),
+        people.photo("party2.jpg", 0, 3, 4, taken_at=5 * day + 600),
+        people.photo("party3.jpg", 3, 4, taken_at=5 * day + 900),
+        people.photo("sunset.jpg", taken_at=5 * day + 1800),
+    ]
+
+
+def undated(photos):
+    return [{k: v for k, v in p.items() if k not in ("taken_at", "lat", "lon")} for p in photos]
+
+
+def test_windows_off_matches_clustering_without_metadata(people, monkeypatch):
+    monkeypatch.setattr(clustering, "EVENT_TIME_GAP_HOURS", 0)
+    photos = album(people)
+    with_times = clustering.cluster_photos(photos, verbose=False)
+    without = clustering.cluster_photos(undated(photos), verbose=False)
+    assert partition(with_times) == partition(without)
+
+
+def test_windows_split_events_far_apart(people, monkeypatch):
+    monkeypatch.setattr(clustering, "EVENT_TIME_GAP_HOURS", 6)
+    events, extras = partition(clustering.cluster_photos(album(people), verbose=False))
+    assert all(max(e) < 3 or min(e) >= 3 for e in events)
+    assert 6 in extras
+
+
+def test_no_faces_all_extras(people):
+    photos = [people.photo(f"scenery{i}.jpg") for i in range(3)]
+    assert clustering.cluster_photos(photos, verbose=False) == ([], [0, 1, 2])
+
+
+def test_time_windows_gap_and_undated():
+    photos = [{"taken_at": 0}, {"taken_at": 3600}, {}, {"taken_at": 10 * 3600}]
+    assert clustering.time_windows(photos, gap_hours=2) == ([[0, 1], [3]], [2])
+    assert clustering.time_windows(photos, gap_hours=0) == ([[0, 1, 2, 3]], [])
+    assert np.isclose(clustering.distance_km(0, 0, 0, 1), 111.19, atol=0.1)
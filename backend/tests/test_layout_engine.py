@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+import layout_engine
+
+PAGE_W, PAGE_H = 600, 800
+EPS = 1e-3     # zones are rounded to 3 decimals of a percent
+
+
+def album(count, seed=0):
+    rng = np.random.default_rng(seed)
+    aspects = rng.choice([4 / 3, 3 / 4, 1.0, 16 / 9, 0.3, 5.0], size=count)
+    return [(f"p{i}.jpg", float(a)) for i, a in enumerate(aspects)]
+
+
+def overlaps(a, b):
+    dx = min(a["x"] + a["w"], b["x"] + b["w"]) - max(a["x"], b["x"])
+    dy = min(a["y"] + a["h"], b["y"] + b["h"]) - max(a["y"], b["y"])
+    return dx > EPS and dy > EPS
+
+
+@pytest.mark.parametrize("count", [1, 2, 7, 40, 133])
+def test_every_photo_placed_once_in_order(count):
+    photos = album(count)
+    pages = layout_engine.compute_layout(photos, page_width=PAGE_W, page_height=PAGE_H)
+    assert [z["url"] for page in pages for z in page["zones"]] == [url for url, _ in photos]
+    assert all(page["zones"] for page in pages)
+
+
+@pytest.mark.parametrize("count", [1, 7, 40, 133])
+def test_zones_inside_margins_without_overlap(count):
+    margin = layout_engine.LAYOUT_MARGIN
+    for page in layout_engine.compute_layout(album(count, seed=count), page_width=PAGE_W, page_height=PAGE_H):
+        zones = page["zones"]
+        for z in zones:
+            assert z["w"] > 0 and z["h"] > 0
+            assert z["x"] >= 100 * margin / PAGE_W - EPS and z["x"] + z["w"] <= 100 * (PAGE_W - margin) / PAGE_W + EPS
+            assert z["y"] >= 100 * margin / PAGE_H - EPS and z["y"] + z["h"] <= 100 * (PAGE_H - margin) / PAGE_H + EPS
+        for i, a in enumerate(zones):
+            for b in zones[i + 1:]:
+                assert not overlaps(a, b)
+
+
+def test_zones_keep_the_photo_aspect():
+    photos = album(40)
+    aspects = dict(photos)
+    for page in layout_engine.compute_layout(photos, page_width=PAGE_W, page_height=PAGE_H):
+        for z in page["zones"]:
+            assert z["w"] * PAGE_W / (z["h"] * PAGE_H) == pytest.approx(aspects[z["url"]], rel=1e-2)
+
+
+def test_unknown_sizes_use_the_default_aspect():
+    assert layout_engine.aspect_of(None, 600) == layout_engine.DEFAULT_ASPECT
+    assert layout_engine.aspect_of(800, 0) == layout_engine.DEFAULT_ASPECT
+    assert layout_engine.aspect_of(800, 400) == 2
+
+
+def test_layout_album_is_memoized_by_photos_and_params():
+    photos = album(12)
+    first = layout_engine.layout_album(photos, page_width=PAGE_W)
+    assert layout_engine.layout_album(list(photos), page_width=PAGE_W) is first
+    assert layout_engine.layout_album(photos, page_width=PAGE_W + 1)["key"] != first["key"]
+    assert layout_engine.layout_album(photos[::-1], page_width=PAGE_W)["key"] != first["key"]
+
+
+def test_generate_layout_places_every_photo_on_the_canvas():
+    photos = [{"image_url": f"p{i}.jpg", "width": 400 + 50 * i, "height": 300} for i in range(25)]
+    zones = layout_engine.generate_layout(photos, 595, 842)
+    assert sorted(z["url"] for z in zones) == sorted(p["image_url"] for p in photos)
+    for z in zones:
+        assert 0 <= z["left"] and z["left"] + z["width"] <= 595 + 1e-6
+        assert 0 <= z["top"] and z["top"] + z["height"] <= 842 + 1e-6
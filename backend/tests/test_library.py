@@ -0,0 +1,115 @@
+import contextlib
+import io
+
+import numpy as np
+import pytest
+
+import library
+from library import UserLibrary
+from store import Store
+
+
+@pytest.fixture
+def store(tmp_path):
+    return Store(str(tmp_path / "library.db"))
+
+
+def add(store, username, records):
+    with contextlib.redirect_stdout(io.StringIO()), store.transaction() as conn:
+        lib = UserLibrary.load(store, conn, username)
+        lib.add_photos(records)
+        lib.save()
+
+
+def load(store, username):
+    with store.transaction() as conn:
+        return UserLibrary.load(store, conn, username)
+
+
+def groups(lib):
+    """Events and extras as sets of filenames, independent of their order"""
+    names = [p["filename"] for p in lib.photos]
+    events = {frozenset(names[p] for p in event["photos"]) for event in lib.events}
+    return events, {names[p] for p in lib.extras}
+
+
+def first_batch(people):
+    return [
+        people.photo("a1.jpg", 0, 1, 2), people.photo("a2.jpg", 0, 1, 2), people.photo("a3.jpg", 1, 2),
+        people.photo("b1.jpg", 0, 5, 6), people.photo("b2.jpg", 0, 5, 6),
+        people.photo("tree.jpg"),
+    ]
+
+
+def second_batch(people):
+    """More of both outings, and a new one: the user with three others, too few shared to join a or b"""
+    return [
+        people.photo("a4.jpg", 0, 1, 2), people.photo("b3.jpg", 5, 6),
+        people.photo("c1.jpg", 0, 3, 4, 7), people.photo("c2.jpg", 0, 3, 4, 7), people.photo("lake.jpg"),
+    ]
+
+
+def test_incremental_add_matches_full_recluster(store, people, monkeypatch):
+    monkeypatch.setattr(library, "RECLUSTER_DRIFT_RATIO", 100.0)
+    first, second = first_batch(people), second_batch(people)
+    add(store, "inc", first)
+    add(store, "inc", second)
+    incremental = load(store, "inc")
+    assert incremental.photos_at_recluster == len(first)     # the second batch really was incremental
+
+    add(store, "full", first + second)
+    assert groups(incremental) == groups(load(store, "full"))
+
+
+def test_incremental_add_skips_known_photos(store, people):
+    batch = first_batch(people)
+    add(store, "u", batch)
+    add(store, "u", batch[:2])
+    assert [p["filename"] for p in load(store, "u").photos] == [r["filename"] for r in batch]
+
+
+def test_person_sums_match_their_faces(store, people, monkeypatch):
+    monkeypatch.setattr(library, "RECLUSTER_DRIFT_RATIO", 100.0)
+    add(store, "u", first_batch(people))
+    add(store, "u", second_batch(people))
+    lib = load(store, "u")
+    faces = lib.load_embeddings()
+    labels = np.array([person for (person,) in store.connect().execute(
+        "SELECT person FROM faces WHERE username = 'u' ORDER BY photo_id, face_idx")])
+    for person, count in enumerate(lib.person_counts):
+        assert count == (labels == person).sum()
+        np.testing.assert_allclose(lib.person_sums[person], faces[labels == person].sum(axis=0), atol=1e-4)
+
+
+def test_save_clusters_writes_only_changed_rows(store, people):
+    add(store, "u", first_batch(people))
+    conn = store.connect()
+    lib = load(store, "u")
+    assert len(lib.events) >= 2
+    before = conn.execute("SELECT event_idx, photo_ids FROM events WHERE username = 'u' ORDER BY 1").fetchall()
+
+    # both events change in memory, only the second is marked
+    lib.events[0]["photos"] = [99]
+    lib.events[1]["photos"] = [98]
+    written = conn.total_changes
+    with store.transaction():
+        store.save_clusters(conn, "u", lib.events, lib.extras, lib.person_sums, lib.person_counts,
+                            lib.photos_at_recluster, lib.dim, lib.person_covers,
+                            {"events": {1}, "persons": set(), "extras_from": len(lib.extras)})
+    after = conn.execute("SELECT event_idx, photo_ids FROM events WHERE username = 'u' ORDER BY 1").fetchall()
+
+    assert after[0] == before[0]
+    assert after[1] == (1, "[98]")
+    assert after[2:] == before[2:]
+    assert conn.total_changes - written == 2      # the event row and user_state
+
+
+def test_save_clusters_without_changes_rewrites_everything(store, people):
+    add(store, "u", first_batch(people))
+    conn = store.connect()
+    lib = load(store, "u")
+    lib.events[0]["photos"] = [99]
+    with store.transaction():
+        store.save_clusters(conn, "u", lib.events, lib.extras, lib.person_sums, lib.person_counts,
+                            lib.photos_at_recluster, lib.dim, lib.person_covers)
+    assert conn.execute("SELECT photo_ids FROM events WHERE username = 'u' AND event_idx = 0").fetchone() == ("[99]",)
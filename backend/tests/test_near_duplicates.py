@@ -0,0 +1,69 @@
+import numpy as np
+from PIL import Image
+
+import near_duplicates
+from near_duplicates import BKTree, distance, group
+
+
+def random_hashes(count, seed=0):
+    rng = np.random.default_rng(seed)
+    return [int(h) for h in rng.integers(0, 2 ** 63, size=count, dtype=np.int64)]
+
+
+def flip(value, *bits):
+    for bit in bits:
+        value ^= 1 << bit
+    return value
+
+
+def test_bktree_radius_search_matches_brute_force():
+    keys = random_hashes(300)
+    keys += [flip(keys[0], b) for b in range(0, 40, 4)]   # a cluster around one key
+    tree = BKTree()
+    for pos, key in enumerate(keys):
+        tree.add(key, pos)
+    for query in [keys[0], keys[7], flip(keys[0], 1, 2, 3), random_hashes(1, seed=9)[0]]:
+        for radius in (0, 3, 8, 20):
+            expected = sorted(pos for pos, key in enumerate(keys) if distance(query, key) <= radius)
+            found = tree.search(query, radius)
+            assert sorted(pos for _, pos in found) == expected
+            assert [d for d, _ in found] == sorted(d for d, _ in found)     # nearest first
+
+
+def test_bktree_empty_and_duplicate_keys():
+    tree = BKTree()
+    assert tree.search(123, 64) == []
+    tree.add(5, "a")
+    tree.add(5, "b")
+    assert sorted(value for _, value in tree.search(5, 0)) == ["a", "b"]
+
+
+def test_group_joins_the_nearest_representative():
+    a, b = random_hashes(2, seed=1)
+    hashes = [
+        (a, a),
+        (b, b),
+        (flip(a, 1, 2), flip(a, 3)),     # near a
+        None,                            # not hashable: its own representative
+        (flip(b, 5), flip(b, 6)),        # near b
+        (flip(a, 1, 2, 3), a),           # nearer the copy of a, but copies are never representatives
+    ]
+    assert group(hashes, phash_distance=8, dhash_distance=12) == [0, 1, 0, 3, 1, 0]
+
+
+def test_group_needs_both_hashes_close():
+    a = random_hashes(1, seed=2)[0]
+    far = flip(a, *range(20))
+    hashes = [(a, a), (flip(a, 1), far), (far, flip(a, 1))]
+    assert group(hashes, phash_distance=8, dhash_distance=12) == [0, 1, 2]
+
+
+def test_image_hashes_tolerate_recompression():
+    rng = np.random.default_rng(3)
+    base = Image.fromarray((rng.random((30, 40, 3)) * 255).astype(np.uint8)).resize((320, 240))
+    shifted = Image.fromarray(np.clip(np.asarray(base).astype(int) + 4, 0, 255).astype(np.uint8))
+    other = Image.fromarray((rng.random((30, 40, 3)) * 255).astype(np.uint8)).resize((320, 240))
+    (p1, d1), (p2, d2), (p3, d3) = map(near_duplicates.image_hashes, (base, shifted, other))
+    assert distance(p1, p2) <= near_duplicates.NEAR_DUP_PHASH_DISTANCE
+    assert distance(d1, d2) <= near_duplicates.NEAR_DUP_DHASH_DISTANCE
+    assert distance(p1, p3) > near_duplicates.NEAR_DUP_PHASH_DISTANCE
@@ -0,0 +1,82 @@
+import pytest
+
+import upload_queue
+from upload_queue import LeaseLost, UploadQueue, job_key
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return UploadQueue(str(tmp_path / "queue.db"), str(tmp_path / "spool"))
+
+
+def files(*hashes):
+    return [(f"{h}.jpg", f"/spool/{h}", h) for h in hashes]
+
+
+def finish(job):
+    job.emit("done", {"clusters": {}, "extras": []})
+
+
+def test_job_key_depends_on_user_files_and_method():
+    key = job_key("ann", ["h1", "h2"], None)
+    assert job_key("ann", ["h1", "h2"], None) == key
+    assert job_key("ann", ["h2", "h1"], None) != key
+    assert job_key("ben", ["h1", "h2"], None) != key
+    assert job_key("ann", ["h1", "h2"], "graph") != key
+
+
+def test_enqueue_same_files_returns_the_pending_job(queue):
+    job_id, created = queue.enqueue("ann", files("h1", "h2"))
+    assert created
+    assert queue.enqueue("ann", files("h1", "h2")) == (job_id, False)
+    assert queue.enqueue("ben", files("h1", "h2"))[0] != job_id
+
+    job = queue.claim("w1")
+    assert job.id == job_id
+    assert queue.enqueue("ann", files("h1", "h2")) == (job_id, False)     # still running
+    finish(job)
+    again, created = queue.enqueue("ann", files("h1", "h2"))
+    assert created and again != job_id                                  # finished jobs are not reused
+
+
+def test_claim_is_fair_across_users(queue):
+    ann = [queue.enqueue("ann", files(f"a{i}"))[0] for i in range(3)]
+    ben = queue.enqueue("ben", files("b0"))[0]
+    cat = queue.enqueue("cat", files("c0"))[0]
+
+    first, second, third = (queue.claim(f"w{i}") for i in range(3))
+    assert [first.id, second.id, third.id] == [ann[0], ben, cat]
+    assert queue.claim("w3") is None        # ann's next job waits: one running job per user
+
+    for job in (first, second, third):
+        finish(job)
+    assert queue.claim("w0").id == ann[1]
+
+
+def test_expired_lease_is_claimed_again_and_fences_the_old_worker(queue, monkeypatch):
+    job_id = queue.enqueue("ann", files("h1"))[0]
+    monkeypatch.setattr(upload_queue, "LEASE_SECONDS", -1)      # every lease is already over
+    stale = queue.claim("w1")
+    stale.emit("progress", {"done": 1, "total": 1})
+    monkeypatch.setattr(upload_queue, "LEASE_SECONDS", 120)
+
+    fresh = queue.claim("w2")
+    assert fresh.id == job_id
+    assert queue.snapshot(job_id)["attempts"] == 2
+    assert not queue.renew(job_id, "w1")
+    with pytest.raises(LeaseLost):
+        stale.emit("progress", {"done": 1, "total": 1})
+
+    finish(fresh)
+    assert [event for _, event, _ in queue.events_after(job_id, 0)] == ["retry", "done"]
+    with pytest.raises(LeaseLost):
+        fresh.emit("progress", {"done": 1, "total": 1})         # nothing is written after done
+
+
+def test_job_fails_after_max_attempts(queue, monkeypatch):
+    job_id = queue.enqueue("ann", files("h1"))[0]
+    monkeypatch.setattr(upload_queue, "LEASE_SECONDS", -1)
+    for attempt in range(upload_queue.MAX_ATTEMPTS):
+        assert queue.claim(f"w{attempt}").id == job_id
+    assert queue.claim("last") is None
+    assert queue.snapshot(job_id)["status"] == "error"
@@ -0,0 +1,400 @@
+"""
+Upload job queue
+================
+With UPLOAD_QUEUE=sqlite the API process never runs the models: upload
+endpoints spool the files and enqueue a job, separate worker processes
+(worker.py) run the ingest + clustering pipeline and write the job's
+events back here, where the API reads them for polling and SSE.
+
+    queue_jobs     one row per upload job (status, progress, lease, result)
+    queue_items    the job's files in upload order, by content hash
+    queue_events   the job's event log (same events as jobs.Job)
+    queue_users    when each user was last served, for fairness
+
+Scheduling: a worker claims the oldest queued job of the user served
+least recently, skipping users that already have a job running. A heavy
+uploader therefore gets one worker at a time while other users' jobs
+keep flowing, and one user's library is only ever written by one job.
+
+Retries: a claimed job holds a lease the worker renews while it runs. If
+the worker dies the lease runs out and the job is queued again (up to
+MAX_ATTEMPTS). Writes are fenced by the lease: once a job belongs to
+another worker, the old one's events raise LeaseLost and it stops. A job
+claimed again drops the previous attempt's events; a "retry" event takes
+their place, so event ids keep growing for reconnecting readers.
+
+Files are spooled by content hash (spool.py), so a retry reads the same
+bytes; photos the failed attempt already finished come back from the
+embedding cache and are skipped by the library (same hash), so a retry
+never stores a photo twice. Enqueueing the same files for the same user
+again while the first job is still queued or running returns that job;
+once it has finished, the same upload is a new job.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from jobs import JOB_TTL_SECONDS, KEEP_ALIVE_SECONDS, sse_event
+from spool import SPOOL_DIR, content_path
+
+UPLOAD_QUEUE = os.getenv("UPLOAD_QUEUE", "inline")    # inline | sqlite
+QUEUE_DB_PATH = os.getenv("QUEUE_DB_PATH", "queue.db")
+
+LEASE_SECONDS = int(os.getenv("QUEUE_LEASE_SECONDS", 120))
+MAX_ATTEMPTS = int(os.getenv("QUEUE_MAX_ATTEMPTS", 3))
+POLL_SECONDS = float(os.getenv("QUEUE_POLL_SECONDS", 0.5))
+# Upload endpoints spool files before enqueueing their job, so cleanup
+# leaves anything younger than this alone (and .tmp files of uploads still
+# being streamed)
+SPOOL_GRACE_SECONDS = int(os.getenv("SPOOL_GRACE_SECONDS", 3600))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS queue_jobs (
+    id TEXT PRIMARY KEY,
+    job_key TEXT NOT NULL,
+    username TEXT NOT NULL,
+    method TEXT,
+    status TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    created REAL NOT NULL,
+    finished REAL,
+    partial TEXT,
+    result TEXT
+);
+CREATE INDEX IF NOT EXISTS queue_jobs_status ON queue_jobs(status, created);
+CREATE INDEX IF NOT EXISTS queue_jobs_key ON queue_jobs(job_key);
+CREATE TABLE IF NOT EXISTS queue_items (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    PRIMARY KEY (job_id, idx)
+);
+CREATE INDEX IF NOT EXISTS queue_items_hash ON queue_items(hash);
+CREATE TABLE IF NOT EXISTS queue_events (
+    job_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (job_id, seq)
+);
+CREATE TABLE IF NOT EXISTS queue_users (
+    username TEXT PRIMARY KEY,
+    last_served REAL NOT NULL
+);
+"""
+
+FINISHED = ("done", "error")
+
+
+class LeaseLost(Exception):
+    """The job was given to another worker (lease expired), stop working on it"""
+
+
+def job_key(username, hashes, method):
+    """Same user, same files in the same order, same clustering -> same key"""
+    return hashlib.sha256(json.dumps([username, method, hashes]).encode()).hexdigest()
+
+
+class UploadQueue:
+    def __init__(self, path=QUEUE_DB_PATH, spool_dir=os.path.join(SPOOL_DIR, "queue")):
+        self.path = path
+        self.spool_dir = spool_dir
+        self._local = threading.local()
+        os.makedirs(spool_dir, exist_ok=True)
+        self.connect().executescript(SCHEMA)
+
+    def connect(self):
+        """One connection per thread, WAL like store.Store"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _write(self, fn):
+        """Run fn(conn) in a BEGIN IMMEDIATE transaction"""
+        conn = self.connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(conn)
+            conn.execute("COMMIT")
+            return result
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def items(self, job_id):
+        """The job's files as (filename, spooled path, content hash), in upload order"""
+        return [
+            (filename, content_path(self.spool_dir, key), key)
+            for filename, key in self.connect().execute(
+                "SELECT filename, hash FROM queue_items WHERE job_id = ? ORDER BY idx", (job_id,)
+            )
+        ]
+
+    # --- API SIDE ---
+
+    def enqueue(self, username, items, method=None):
+        """
+        items: (filename, path, content hash) of files already spooled into
+        spool_dir with spool_upload(..., content_addressed=True).
+        Returns (job_id, created)
+        """
+        hashes = [key for _, _, key in items]
+        key = job_key(username, hashes, method)
+
+        def insert(conn):
+            existing = conn.execute(
+                "SELECT id FROM queue_jobs WHERE job_key = ? AND status IN ('queued', 'running') ORDER BY created DESC LIMIT 1",
+                (key,),
+            ).fetchone()
+            if existing:
+                return existing[0], False
+            job_id = uuid.uuid4().hex
+            conn.execute(
+                "INSERT INTO queue_jobs (id, job_key, username, method, status, total, created) "
+                "VALUES (?, ?, ?, ?, 'queued', ?, ?)",
+                (job_id, key, username, method, len(items), time.time()),
+            )
+            conn.executemany(
+                "INSERT INTO queue_items (job_id, idx, filename, hash) VALUES (?, ?, ?, ?)",
+                [(job_id, i, filename, key) for i, (filename, _, key) in enumerate(items)],
+            )
+            return job_id, True
+
+        return self._write(insert)
+
+    def get(self, job_id):
+        row = self.connect().execute(
+            "SELECT id, username, method, status, total, done, worker FROM queue_jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        return QueuedJob(self, *row) if row else None
+
+    def snapshot(self, job_id):
+        conn = self.connect()
+        row = conn.execute(
+            "SELECT username, status, done, total, partial, result, attempts FROM queue_jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        username, status, done, total, partial, result, attempts = row
+        last = conn.execute("SELECT MAX(seq) FROM queue_events WHERE job_id = ?", (job_id,)).fetchone()[0]
+        return {
+            "job_id": job_id,
+            "username": username,
+            "status": status,
+            "done": done,
+            "total": total,
+            "partial": json.loads(partial) if partial else None,
+            "result": json.loads(result) if result else None,
+            "last_event_id": last or 0,
+            "attempts": attempts,
+            "queued_ahead": self.queued_ahead(job_id) if status == "queued" else 0,
+        }
+
+    def queued_ahead(self, job_id):
+        return self.connect().execute(
+            "SELECT COUNT(*) FROM queue_jobs WHERE status = 'queued' "
+            "AND created < (SELECT created FROM queue_jobs WHERE id = ?)", (job_id,)
+        ).fetchone()[0]
+
+    def events_after(self, job_id, seq):
+        return [
+            (s, event_type, json.loads(data))
+            for s, event_type, data in self.connect().execute(
+                "SELECT seq, type, data FROM queue_events WHERE job_id = ? AND seq > ? ORDER BY seq", (job_id, seq)
+            )
+        ]
+
+    def stats(self):
+        counts = dict(self.connect().execute("SELECT status, COUNT(*) FROM queue_jobs GROUP BY status"))
+        return {status: counts.get(status, 0) for status in ("queued", "running", "done", "error")}
+
+    # --- WORKER SIDE ---
+
+    def claim(self, worker):
+        """Lease the next job (fair across users), or None when nothing is runnable"""
+        def take(conn):
+            now = time.time()
+            self._requeue_expired(conn, now)
+            row = conn.execute(
+                """
+                SELECT j.id FROM queue_jobs j
+                LEFT JOIN queue_users u ON u.username = j.username
+                WHERE j.status = 'queued'
+                  AND j.username NOT IN (SELECT username FROM queue_jobs WHERE status = 'running')
+                ORDER BY COALESCE(u.last_served, 0), j.created
+                LIMIT 1
+                """
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE queue_jobs SET status = 'running', attempts = attempts + 1, worker = ?, "
+                "lease_until = ?, done = 0, partial = NULL WHERE id = ?",
+                (worker, now + LEASE_SECONDS, row[0]),
+            )
+            # a retry starts over: drop the previous attempt's events, keeping the last id taken
+            last = conn.execute("SELECT MAX(seq) FROM queue_events WHERE job_id = ?", (row[0],)).fetchone()[0]
+            if last:
+                conn.execute("DELETE FROM queue_events WHERE job_id = ?", (row[0],))
+                attempt = conn.execute("SELECT attempts FROM queue_jobs WHERE id = ?", (row[0],)).fetchone()[0]
+                conn.execute("INSERT INTO queue_events (job_id, seq, type, data) VALUES (?, ?, 'retry', ?)",
+                             (row[0], last, json.dumps({"attempt": attempt})))
+            conn.execute(
+                "INSERT OR REPLACE INTO queue_users (username, last_served) "
+                "SELECT username, ? FROM queue_jobs WHERE id = ?", (now, row[0])
+            )
+            return row[0]
+
+        job_id = self._write(take)
+        return self.get(job_id) if job_id else None
+
+    def _requeue_expired(self, conn, now):
+        """Jobs whose worker stopped renewing the lease go back to the queue (or fail)"""
+        expired = conn.execute(
+            "SELECT id, attempts FROM queue_jobs WHERE status = 'running' AND lease_until < ?", (now,)
+        ).fetchall()
+        for job_id, attempts in expired:
+            if attempts < MAX_ATTEMPTS:
+                print(f"🔁 Upload job {job_id}: worker lost, queued again (attempt {attempts + 1})")
+                conn.execute("UPDATE queue_jobs SET status = 'queued', worker = NULL WHERE id = ?", (job_id,))
+            else:
+                message = f"Gave up after {attempts} attempts"
+                self._append(conn, job_id, "error", {"message": message})
+                conn.execute("UPDATE queue_jobs SET status = 'error', finished = ? WHERE id = ?", (now, job_id))
+
+    def renew(self, job_id, worker):
+        """Extend the lease; False if the job was taken away from this worker"""
+        return self._write(lambda conn: conn.execute(
+            "UPDATE queue_jobs SET lease_until = ? WHERE id = ? AND worker = ? AND status = 'running'",
+            (time.time() + LEASE_SECONDS, job_id, worker),
+        ).rowcount == 1)
+
+    def _append(self, conn, job_id, event_type, data):
+        seq = conn.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM queue_events WHERE job_id = ?", (job_id,)).fetchone()[0]
+        conn.execute("INSERT INTO queue_events (job_id, seq, type, data) VALUES (?, ?, ?, ?)",
+                     (job_id, seq, event_type, json.dumps(data)))
+
+    def emit(self, job_id, worker, event_type, data):
+        """Record an event of a running job; raises LeaseLost if `worker` no longer holds it"""
+        if event_type == "progress":
+            update, params = "done = ?", (data["done"],)
+        elif event_type == "partial":
+            update, params = "partial = ?", (json.dumps(data),)
+        elif event_type == "done":
+            update, params = "status = 'done', result = ?, finished = ?", (json.dumps(data), time.time())
+        elif event_type == "error":
+            update, params = "status = 'error', finished = ?", (time.time(),)
+        else:
+            update, params = "worker = worker", ()
+
+        def write(conn):
+            if conn.execute(f"UPDATE queue_jobs SET {update} WHERE id = ? AND worker = ? AND status = 'running'",
+                            (*params, job_id, worker)).rowcount != 1:
+                raise LeaseLost(job_id)
+            self._append(conn, job_id, event_type, data)
+        self._write(write)
+
+    def cleanup(self):
+        """
+        Drop jobs finished more than JOB_TTL_SECONDS ago and spool files no
+        pending job needs, once they are older than SPOOL_GRACE_SECONDS
+        """
+        def expire(conn):
+            old = [r for (r,) in conn.execute(
+                "SELECT id FROM queue_jobs WHERE finished IS NOT NULL AND finished < ?",
+                (time.time() - JOB_TTL_SECONDS,),
+            )]
+            for table, column in (("queue_events", "job_id"), ("queue_items", "job_id"), ("queue_jobs", "id")):
+                conn.executemany(f"DELETE FROM {table} WHERE {column} = ?", [(j,) for j in old])
+            return {h for (h,) in conn.execute(
+                "SELECT DISTINCT i.hash FROM queue_items i JOIN queue_jobs j ON j.id = i.job_id "
+                "WHERE j.status IN ('queued', 'running')"
+            )}
+
+        # taken before reading the queue: a file spooled after that is never old enough
+        cutoff = time.time() - SPOOL_GRACE_SECONDS
+        needed = self._write(expire)
+        removed = 0
+        for root, _, files in os.walk(self.spool_dir):
+            for name in files:
+                if name in needed:
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                        removed += 1
+                except FileNotFoundError:
+                    pass    # removed by another worker's cleanup
+        return removed
+
+
+class QueuedJob:
+    """A queued job with the interface of jobs.Job, backed by the queue database"""
+
+    def __init__(self, queue, job_id, username, method, status, total, done, worker=None):
+        self.queue = queue
+        self.id = job_id
+        self.username = username
+        self.method = method
+        self.status = status
+        self.total = total
+        self.done = done
+        self.worker = worker    # holder of the lease, events are only written while it holds it
+
+    def emit(self, event_type, data):
+        self.queue.emit(self.id, self.worker, event_type, data)
+        if event_type == "progress":
+            self.done = data["done"]
+
+    def snapshot(self):
+        return self.queue.snapshot(self.id)
+
+    async def stream(self, last_event_id=0):
+        """Server-Sent Events read from the queue database, until the job ends"""
+        sent = last_event_id
+        idle = 0.0
+        while True:
+            events = await asyncio.to_thread(self.queue.events_after, self.id, sent)
+            for seq, event_type, data in events:
+                yield sse_event(seq, event_type, data)
+                sent = seq
+                idle = 0.0
+            if any(event_type in FINISHED for _, event_type, _ in events):
+                return
+            if not events:
+                snapshot = await asyncio.to_thread(self.queue.snapshot, self.id)
+                if snapshot is None or (snapshot["status"] in FINISHED and sent >= snapshot["last_event_id"]):
+                    return
+            await asyncio.sleep(POLL_SECONDS)
+            idle += POLL_SECONDS
+            if idle >= KEEP_ALIVE_SECONDS:
+                idle = 0.0
+                yield ": keep-alive\n\n"
+
+
+_queue = None
+
+def get_queue():
+    """The upload queue, or None when uploads run inline in the API process"""
+    global _queue
+    if UPLOAD_QUEUE != "sqlite":
+        return None
+    if _queue is None:
+        _queue = UploadQueue()
+    return _queue
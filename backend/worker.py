@@ -0,0 +1,119 @@
+"""
+Upload queue workers
+====================
+Runs queued upload jobs (upload_queue.py) outside the API process:
+
+    UPLOAD_QUEUE=sqlite uvicorn main:app          # API: spools + enqueues only
+    python worker.py --processes 2                 # 2 workers, each with its own ingest pool
+
+Every worker process loads the models once (IngestPipeline with
+INGEST_WORKERS processes of its own, so the machine runs
+processes x INGEST_WORKERS model copies), then loops: claim the next job
+fairly across users, run the same pipeline as /upload-jobs/ (ingest,
+library update, events), renew the job's lease while it runs. SIGTERM /
+Ctrl-C lets the current job finish first; a worker that dies instead has
+its job picked up again once the lease runs out. A worker that finds its
+lease gone (too slow to renew) cancels the job instead of racing the
+worker that took it over.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import multiprocessing
+import os
+import signal
+import socket
+
+from upload_queue import LEASE_SECONDS, POLL_SECONDS, LeaseLost, UploadQueue
+
+# How often a worker drops expired jobs and unused spool files
+CLEANUP_SECONDS = 600
+
+
+async def keep_lease(queue, job, worker_id, task):
+    """Renew the job's lease while `task` runs; cancel it once the lease is gone"""
+    while True:
+        await asyncio.sleep(LEASE_SECONDS / 3)
+        if not await asyncio.to_thread(queue.renew, job.id, worker_id):
+            print(f"⚠️ Lost the lease on job {job.id}, stopping it")
+            task.cancel()
+            return
+
+
+async def work(worker_id):
+    import main  # the upload pipeline + storage/cloudinary config of the API
+
+    queue = UploadQueue()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    pipeline = main.get_pipeline()
+    for stats in await pipeline.warm():
+        print(f"🔥 {worker_id}: ingest process {stats['pid']} ready in {stats['cold_start']:.1f}s")
+
+    last_cleanup = 0.0
+    while not stop.is_set():
+        if loop.time() - last_cleanup > CLEANUP_SECONDS:
+            removed = await asyncio.to_thread(queue.cleanup)
+            if removed:
+                print(f"🧹 {worker_id}: removed {removed} spooled files")
+            last_cleanup = loop.time()
+
+        job = await asyncio.to_thread(queue.claim, worker_id)
+        if job is None:
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        print(f"📥 {worker_id}: job {job.id} ({job.total} files for {job.username})")
+        items = await asyncio.to_thread(queue.items, job.id)
+        run = asyncio.create_task(main.run_upload_job(job, items, job.method))
+        lease = asyncio.create_task(keep_lease(queue, job, worker_id, run))
+        try:
+            await run
+        except (asyncio.CancelledError, LeaseLost):
+            print(f"⚠️ {worker_id}: job {job.id} stopped, another worker owns it now")
+        except Exception as e:
+            print(f"❌ {worker_id}: job {job.id} failed: {e}")
+            with contextlib.suppress(LeaseLost):
+                job.emit("error", {"message": str(e)})
+        finally:
+            lease.cancel()
+
+    pipeline.shutdown()
+    print(f"👋 {worker_id}: stopped")
+
+
+def run_worker(index):
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{index}"
+    asyncio.run(work(worker_id))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run upload queue workers")
+    parser.add_argument("--processes", type=int, default=int(os.getenv("QUEUE_WORKERS", 1)))
+    args = parser.parse_args()
+
+    if args.processes == 1:
+        run_worker(0)
+        return
+
+    ctx = multiprocessing.get_context("spawn")
+    processes = [ctx.Process(target=run_worker, args=(i,)) for i in range(args.processes)]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,26 +2,83 @@ import React, { useEffect, useState } from 'react';
 import axios from 'axios';
 import './App.css';
 
+// Downscaled copies served (and cached) by the backend; originals stay full size
+const derivative = (url, size = 'thumb') =>
+  `http://127.0.0.1:8000/derivatives/${size}?url=${encodeURIComponent(url)}`;
+
+// Photos per /photos page; the first page renders while the rest loads
+const PAGE_SIZE = 60;
+// Photos per page of "photos of this person"
+const PERSON_PAGE_SIZE = 24;
+
+// Append one /photos page (an event may continue from the previous page)
+const mergePage = (acc, page) => {
+  const clusters = { ...acc.clusters };
+  for (const [name, urls] of Object.entries(page.clusters)) {
+    clusters[name] = [...(clusters[name] || []), ...urls];
+  }
+  return {
+    ...acc, clusters,
+    extras: [...acc.extras, ...page.extras],
+    bursts: [...(acc.bursts || []), ...(page.bursts || [])],
+  };
+};
+
 function Dashboard({ username, onOpenEditor, onLogout }) {
-  const [photos, setPhotos] = useState({ clusters: {}, extras: [], extras_info: [] });
+  const [photos, setPhotos] = useState({ clusters: {}, extras: [], bursts: [], extras_info: [] });
   const [loading, setLoading] = useState(false);
   const [uploadProgress, setUploadProgress] = useState({ current: 0, total: 0, status: "" });
+  const [people, setPeople] = useState([]);
+  // { id, photos, cursor } of the person being browsed
+  const [person, setPerson] = useState(null);
 
   const MAX_PHOTOS = 20;
 
-  // Fetch photos on mount
+  // Fetch photos on mount, page by page
   useEffect(() => {
+    let cancelled = false;
     const fetchPhotos = async () => {
+      let merged = { clusters: {}, extras: [], bursts: [], extras_info: [] };
+      let cursor = null;
       try {
-        const res = await axios.get(`http://127.0.0.1:8000/photos/${username}`);
-        setPhotos(res.data);
-      } catch (e) { 
+        do {
+          const res = await axios.get(`http://127.0.0.1:8000/photos/${username}`, {
+            params: cursor ? { limit: PAGE_SIZE, cursor } : { limit: PAGE_SIZE },
+          });
+          if (cancelled) return;
+          merged = mergePage(merged, res.data);
+          setPhotos(merged);
+          cursor = res.data.next_cursor;
+        } while (cursor);
+      } catch (e) {
+        if (e.response?.status === 409 && !cancelled) {
+          // library changed between pages: take it in one piece instead
+          const res = await axios.get(`http://127.0.0.1:8000/photos/${username}`);
+          if (!cancelled) setPhotos(res.data);
+          return;
+        }
         console.log("New user - no photos yet."); 
       }
     };
     fetchPhotos();
+    return () => { cancelled = true; };
   }, [username]);
 
+  // People (from the person index); reloaded after every upload
+  const fetchPeople = () => {
+    axios.get(`http://127.0.0.1:8000/people/${username}`)
+      .then(res => setPeople(res.data.people))
+      .catch(() => setPeople([]));
+  };
+  useEffect(fetchPeople, [username]);
+
+  const loadPersonPhotos = async (id, previous = null) => {
+    const res = await axios.get(`http://127.0.0.1:8000/people/${username}/${id}/photos`, {
+      params: previous?.cursor ? { limit: PERSON_PAGE_SIZE, cursor: previous.cursor } : { limit: PERSON_PAGE_SIZE },
+    });
+    setPerson({ id, photos: [...(previous?.photos || []), ...res.data.photos], cursor: res.data.next_cursor });
+  };
+
   // Handle upload
   const handleUpload = async (event) => {
     const files = event.target.files;
@@ -42,8 +99,12 @@ function Dashboard({ username, onOpenEditor, onLogout }) {
     }
 
     try {
-      const res = await axios.post('http://127.0.0.1:8000/upload-photos/', formData);
-      setPhotos(res.data.data);
+      // Start a background job, then follow its progress over Server-Sent Events
+      const res = await axios.post('http://127.0.0.1:8000/upload-jobs/', formData);
+      const data = await followUploadJob(res.data.job_id, files.length);
+      setPhotos(data);
+      fetchPeople();
+      setPerson(null);
       setUploadProgress({ current: 0, total: 0, status: "Success! Photos organized." });
       
       setTimeout(() => {
@@ -51,13 +112,44 @@ function Dashboard({ username, onOpenEditor, onLogout }) {
       }, 3000);
     } catch (err) {
       console.error("Upload error:", err);
-      const errorMsg = err.response?.data?.detail || "Error processing photos. Check console.";
+      const errorMsg = err.response?.data?.detail || err.message || "Error processing photos. Check console.";
       alert(errorMsg);
     } finally {
       setLoading(false);
     }
   };
 
+  // Resolves with the final clusters; EventSource reconnects on its own with Last-Event-ID
+  const followUploadJob = (jobId, total) => new Promise((resolve, reject) => {
+    const source = new EventSource(`http://127.0.0.1:8000/upload-jobs/${jobId}/events`);
+    let events = 0;
+
+    source.addEventListener('progress', (e) => {
+      const data = JSON.parse(e.data);
+      setUploadProgress({
+        current: data.done,
+        total: data.total,
+        status: events > 0
+          ? `Analyzing... ${events} event(s) found so far`
+          : "Uploading & Analyzing...",
+      });
+    });
+    source.addEventListener('partial', (e) => {
+      events = Object.keys(JSON.parse(e.data).clusters).length;
+    });
+    source.addEventListener('done', (e) => {
+      source.close();
+      resolve(JSON.parse(e.data));
+    });
+    source.addEventListener('error', (e) => {
+      // server-sent error events carry data; connection drops do not and are retried
+      if (e.data) {
+        source.close();
+        reject(new Error(JSON.parse(e.data).message));
+      }
+    });
+  });
+
   return (
     <div className="dashboard-container">
       {/* Header with Logout */}
@@ -116,7 +208,7 @@ function Dashboard({ username, onOpenEditor, onLogout }) {
               marginTop: '10px'
             }}>
               <div style={{ 
-                width: '100%', 
+                width: uploadProgress.total ? `${Math.round(100 * uploadProgress.current / uploadProgress.total)}%` : '0%', 
                 height: '100%', 
                 background: '#6c5ce7', 
                 borderRadius: '5px', 
@@ -124,7 +216,7 @@ function Dashboard({ username, onOpenEditor, onLogout }) {
               }}></div>
             </div>
             <p style={{ fontSize: '0.8rem', marginTop: '8px' }}>
-              Processing {uploadProgress.total} photos with AI clustering...
+              Processed {uploadProgress.current} of {uploadProgress.total} photos...
             </p>
           </div>
         )}
@@ -149,6 +241,11 @@ function Dashboard({ username, onOpenEditor, onLogout }) {
           <h4>📊 Your Collection:</h4>
           <p>🎭 Events: {Object.keys(photos.clusters).length}</p>
           <p>🌄 Scenery/Extras: {photos.extras.length}</p>
+          {photos.bursts?.length > 0 && (
+            <p>🔁 Burst groups: {photos.bursts.length} ({
+              photos.bursts.reduce((sum, burst) => sum + burst.length - 1, 0)
+            } near-duplicates)</p>
+          )}
           <p>📷 Total Photos: {
             Object.values(photos.clusters).reduce((sum, cluster) => sum + cluster.length, 0) + 
             photos.extras.length
@@ -239,6 +336,45 @@ function Dashboard({ username, onOpenEditor, onLogout }) {
         </button>
       </div>
 
+      {/* People */}
+      {people.length > 0 && (
+        <div style={{ marginTop: '30px', background: 'white', padding: '15px', borderRadius: '12px', boxShadow: '0 2px 10px rgba(0,0,0,0.05)' }}>
+          <h3 style={{ marginBottom: '15px' }}>🧑‍🤝‍🧑 People</h3>
+          <div style={{ display: 'flex', gap: '12px', overflowX: 'auto', paddingBottom: '6px' }}>
+            {people.map(p => (
+              <div key={p.id} onClick={() => person?.id === p.id ? setPerson(null) : loadPersonPhotos(p.id)}
+                   style={{ textAlign: 'center', cursor: 'pointer', flex: '0 0 auto' }}>
+                {p.face ? (
+                  <img src={`http://127.0.0.1:8000${p.face}`} alt={`Person ${p.id}`} style={{
+                    width: '64px', height: '64px', borderRadius: '50%', objectFit: 'cover',
+                    border: person?.id === p.id ? '3px solid #6c5ce7' : '3px solid transparent',
+                  }} />
+                ) : (
+                  <div style={{ width: '64px', height: '64px', borderRadius: '50%', background: '#f0f0f0' }} />
+                )}
+                <div style={{ fontSize: '0.8rem', color: '#666' }}>{p.faces}</div>
+              </div>
+            ))}
+          </div>
+
+          {person && (
+            <div style={{ marginTop: '12px' }}>
+              <div style={{ display: 'grid', gridTemplateColumns: 'repeat(auto-fill, minmax(120px, 1fr))', gap: '8px' }}>
+                {person.photos.map(url => (
+                  <img key={url} src={derivative(url)} alt="" style={{ width: '100%', height: '120px', objectFit: 'cover', borderRadius: '8px' }} />
+                ))}
+              </div>
+              {person.cursor && (
+                <button onClick={() => loadPersonPhotos(person.id, person)}
+                        style={{ marginTop: '10px', padding: '6px 16px', border: 'none', borderRadius: '6px', background: '#f0f0f7', cursor: 'pointer' }}>
+                  Load more
+                </button>
+              )}
+            </div>
+          )}
+        </div>
+      )}
+
       {/* Photo Preview Section */}
       {Object.keys(photos.clusters).length > 0 && (
         <div style={{ marginTop: '30px' }}>
@@ -271,7 +407,7 @@ function Dashboard({ username, onOpenEditor, onLogout }) {
                 {photos.clusters[key].slice(0, 6).map((url, i) => (
                   <div key={i} style={{ position: 'relative' }}>
                     <img 
-                      src={url}
+                      src={derivative(url)}
                       alt={`Event photo ${i+1}`}
                       style={{
                         width: '100%',
@@ -332,7 +468,7 @@ function Dashboard({ username, onOpenEditor, onLogout }) {
                 {photos.extras.slice(0, 6).map((url, i) => (
                   <div key={i} style={{ position: 'relative' }}>
                     <img 
-                      src={url}
+                      src={derivative(url)}
                       alt={`Extra photo ${i+1}`}
                       style={{
                         width: '100%',
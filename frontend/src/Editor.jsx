@@ -3,6 +3,10 @@ import axios from 'axios';
 import { jsPDF } from 'jspdf';
 import html2canvas from 'html2canvas';
 
+// Downscaled copies served (and cached) by the backend; originals stay full size
+const derivative = (url, size = 'thumb') =>
+  `http://127.0.0.1:8000/derivatives/${size}?url=${encodeURIComponent(url)}`;
+
 /* ─── LAYOUT DEFINITIONS (% of page) ───────────────────────────────────────── */
 const PAD = 3.3, GAP = 1.7;
 const IW = 100 - PAD * 2, IH = 100 - PAD * 2;
@@ -201,7 +205,7 @@ export default function PhotoEditor({ username, onBackToDashboard }) {
 
   /* ── Layout ── */
   const applyLayout = useCallback((key) => {
-    updatePage(p => ({ ...p, layoutKey: key, photos: {} }));
+    updatePage(p => ({ ...p, layoutKey: key, zones: undefined, photos: {} }));
     setShowLayouts(false);
   }, [updatePage]);
 
@@ -278,6 +282,29 @@ export default function PhotoEditor({ username, onBackToDashboard }) {
     setActivePage(activePage + 1);
   }, [page, activePage]);
 
+  // Server-side layout of a whole event (layout_engine.py): every photo at
+  // its aspect ratio, as many pages as needed, appended after the last page
+  const autoLayout = useCallback(async (event) => {
+    try {
+      const r = await axios.get(`http://127.0.0.1:8000/layouts/${username}/${encodeURIComponent(event)}`,
+        { params: { page_width: PAGE_W, page_height: PAGE_H } });
+      const base = Date.now();
+      const added = r.data.pages.map((p, i) => ({
+        ...newPage(base + i),
+        layoutKey: 'auto',
+        zones: p.zones.map(({ x, y, w, h }) => ({ x, y, w, h })),
+        photos: Object.fromEntries(p.zones.map((z, zi) => [zi, z.url])),
+      }));
+      if (!added.length) return;
+      setPages(prev => {
+        setActivePage(prev.length);
+        return [...prev, ...added];
+      });
+    } catch (e) {
+      alert('Auto layout failed');
+    }
+  }, [username]);
+
   const deletePage = useCallback((idx) => {
     setPages(prev => {
       if (prev.length === 1) return prev;
@@ -321,6 +348,11 @@ export default function PhotoEditor({ username, onBackToDashboard }) {
     pdf.save(`photobook.pdf`);
   };
 
+  // Whole album (every event, auto layout) rendered and streamed by the backend
+  const exportAlbum = () => {
+    window.open(`http://127.0.0.1:8000/export/${encodeURIComponent(username)}`, '_blank');
+  };
+
   const selText = (page.texts || []).find(t => t.id === selectedText);
   const totalPhotos = Object.values(allPhotos.clusters || {}).reduce((s, a) => s + a.length, 0)
     + (allPhotos.extras?.length || 0);
@@ -340,9 +372,10 @@ export default function PhotoEditor({ username, onBackToDashboard }) {
           {Object.keys(allPhotos.clusters || {}).map(k => (
             <div key={k} style={{ marginBottom: 12 }}>
               <div style={S.clusterBadge}>{k}</div>
+              <button style={S.autoLayoutBtn} onClick={() => autoLayout(k)}>Auto layout</button>
               <div style={S.thumbGrid}>
                 {allPhotos.clusters[k].map((url, i) => (
-                  <img key={i} src={url} alt="" style={S.thumb}
+                  <img key={i} src={derivative(url)} alt="" style={S.thumb}
                     draggable
                     onDragStart={e => e.dataTransfer.setData('text/plain', url)}
                   />
@@ -354,9 +387,10 @@ export default function PhotoEditor({ username, onBackToDashboard }) {
           {allPhotos.extras?.length > 0 && (
             <div style={{ marginBottom: 12 }}>
               <div style={{ ...S.clusterBadge, background: '#64748b' }}>Extras</div>
+              <button style={S.autoLayoutBtn} onClick={() => autoLayout('extras')}>Auto layout</button>
               <div style={S.thumbGrid}>
                 {allPhotos.extras.map((url, i) => (
-                  <img key={i} src={url} alt="" style={S.thumb}
+                  <img key={i} src={derivative(url)} alt="" style={S.thumb}
                     draggable
                     onDragStart={e => e.dataTransfer.setData('text/plain', url)}
                   />
@@ -464,6 +498,7 @@ export default function PhotoEditor({ username, onBackToDashboard }) {
           <div style={{ marginLeft: 'auto', display: 'flex', gap: 8 }}>
             <button style={Sb('blue')}   onClick={exportPNG}>💾 PNG</button>
             <button style={Sb('orange')} onClick={exportPDF}>📄 PDF ({pages.length}p)</button>
+            <button style={Sb('ghost')}  onClick={exportAlbum} title="Every event, laid out and rendered on the server">🖨️ Album PDF</button>
           </div>
         </div>
 
@@ -555,7 +590,7 @@ export default function PhotoEditor({ username, onBackToDashboard }) {
               onMouseDown={e => { if (e.target === e.currentTarget) setSelectedText(null); }}>
 
               {/* ZONES */}
-              {(LAYOUTS[page.layoutKey]?.zones || []).map((z, zi) => {
+              {(page.zones || LAYOUTS[page.layoutKey]?.zones || []).map((z, zi) => {
                 const photoUrl = page.photos?.[zi];
                 return (
                   <div key={zi}
@@ -578,7 +613,7 @@ export default function PhotoEditor({ username, onBackToDashboard }) {
                       cursor: photoUrl ? 'default' : 'copy',
                     }}>
                     {photoUrl ? (
-                      <img src={photoUrl} alt=""
+                      <img src={derivative(photoUrl, 'preview')} alt=""
                         style={{ width: '100%', height: '100%', objectFit: 'cover', display: 'block', pointerEvents: 'none' }}
                       />
                     ) : (
@@ -999,6 +1034,7 @@ const S = {
   // Sidebar
   sideHead: { fontWeight:700, fontSize:13, color:'#1e293b', marginBottom:2 },
   clusterBadge: { background:'#6c5ce7', color:'white', padding:'3px 8px', borderRadius:4, fontSize:11, fontWeight:700, marginBottom:6, display:'inline-block' },
+  autoLayoutBtn: { marginLeft:6, padding:'2px 8px', border:'1px solid #e2e8f0', borderRadius:4, background:'white', cursor:'pointer', fontSize:11, color:'#6c5ce7', fontWeight:600 },
   thumbGrid: { display:'grid', gridTemplateColumns:'1fr 1fr', gap:5 },
   thumb: { width:'100%', height:76, objectFit:'cover', borderRadius:5, cursor:'grab', border:'2px solid transparent', transition:'all 0.15s', display:'block' },
   textPanel: { background:'#f8fafc', border:'1px solid #e2e8f0', borderRadius:10, padding:12, marginTop:4 },